@@ -10,28 +10,62 @@ import logging, logging.handlers
 import signal
 import sys
 import os
+import argparse
 
-from pubsub import Pubsub
-from http_request import HttpServer
-from rpi_info import RpiInfo
-from manage_timers import ManageTimers
+from log_buffer import RingBufferHandler
+from metrics import process_stats
+from render_scheduler import set_switch_interval
+
+# Used to report time to first timer frame
+STARTUP_TIME = time.monotonic()
+
+# Pubsub (paho), HttpServer (psutil), RpiInfo and ManageTimers (rgbmatrix, agt)
+# are imported by the startup phases so they can load in parallel
 
 logger = logging.getLogger('alexa')
 
 
+def log_process_stats(runtime):
+    threads, rss = process_stats()
+    logger.info("Runtime %s: %d threads (%s), RSS %.1f MiB", runtime, threads,
+        ", ".join(sorted(thread.name for thread in threading.enumerate())), rss / 1048576.0)
+
+
 class Alexa:
     """Handle Alexa display operations"""
 
-    def __init__(self):
+    def __init__(self, parallel_startup = False, display_type = "adafruit", display_options = None,
+                 runtime = "threads", room = None, realtime_priority = None, render_cpu = None,
+                 switch_interval = None):
+        self.parallel_startup = parallel_startup
+        self.display_type = display_type
+        self.display_options = display_options
+        # "threads" or "asyncio", see async_runtime.py
+        self.runtime = runtime
+        # Only display MQTT timers set on this Alexa device, None for all
+        self.room = room
+        # SCHED_FIFO priority and CPU of the render loop, None for the defaults
+        self.realtime_priority = realtime_priority
+        self.render_cpu = render_cpu
+        # GIL switch interval in seconds, None to leave Python's default
+        self.switch_interval = switch_interval
+        self.startup_time = STARTUP_TIME
         self.pubsub = None
         self.server = None
         self.rpi_info = None
         self.manage_timers = None
+        # AsyncRuntime with runtime "asyncio", once started
+        self.async_runtime = None
 
         # Docs: https://docs.python.org/3/library/logging.html
         # Docs on config: https://docs.python.org/3/library/logging.config.html
         FORMAT = '%(asctime)-15s %(threadName)-10s %(levelname)6s %(message)s'
         logging.basicConfig(level=logging.NOTSET, format=FORMAT)
+
+        # Recent log records served by the /log endpoint
+        self.log_buffer = RingBufferHandler()
+        self.log_buffer.setFormatter(logging.Formatter(FORMAT))
+        logging.getLogger().addHandler(self.log_buffer)
   
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
@@ -50,6 +84,10 @@ class Alexa:
   
     def signal_handler(self, signal, frame):
         logger.info('Shutdown...')
+        if self.async_runtime is not None:
+            # MQTT and HTTP belong to the runtime thread, shut them down there
+            self.async_runtime.stop()
+            sys.exit(0)
         if self.server is not None:
             self.server.shutdown()
         # if self.light is not None:
@@ -62,12 +100,61 @@ class Alexa:
     def startup(self):
         logger.info('Startup...')
 
-
+        from manage_timers import ManageTimers
         self.manage_timers = ManageTimers(self)
-        self.pubsub = Pubsub(self)
+        self.manage_timers.room = self.room
+        self.manage_timers.scheduler.priority = self.realtime_priority
+        self.manage_timers.scheduler.cpu = self.render_cpu
+        if self.switch_interval is not None:
+            set_switch_interval(self.switch_interval)
+
+        phases = [
+            ("bluetooth", self.manage_timers.init_bluetooth),
+            ("display", self.startup_display),
+            ("mqtt", self.startup_mqtt),
+            ("http", self.startup_http),
+        ]
+        timings = {}
+        if self.parallel_startup:
+            self.run_phases_parallel(phases, timings)
+        else:
+            for name, target in phases:
+                self.run_phase(name, target, timings)
+
+        logger.info("Startup phases: %s, total %.3fs",
+            ", ".join("%s %.3fs" % (name, timings[name]) for name, target in phases),
+            time.monotonic() - self.startup_time)
+
+        if self.runtime == "asyncio":
+            from async_runtime import AsyncRuntime
+            self.async_runtime = AsyncRuntime(self)
+            self.async_runtime.start()
+        log_process_stats(self.runtime)
+
+        # NOTE: This is a blocking call
+        self.manage_timers.startup()
+        if self.runtime == "asyncio":
+            # No bluetooth gadget to block on
+            self.async_runtime.join()
+
+    def startup_display(self):
+        # The asyncio runtime has no splash thread, the message scrolls during startup
+        self.manage_timers.init_display(background_splash=self.parallel_startup and self.runtime == "threads",
+            display_type=self.display_type, display_options=self.display_options)
+
+    def startup_mqtt(self):
+        from pubsub import Pubsub
+        self.pubsub = Pubsub(self, start_loop=(self.runtime == "threads"))
+
+    def startup_http(self):
+        from http_request import HttpServer
+        from rpi_info import RpiInfo
         self.rpi_info = RpiInfo(self)
 
         self.server = HttpServer(self)
+        if self.runtime == "asyncio":
+            # Served on the runtime's event loop
+            return
         # the following is a blocking call
         #self.server.run()
 
@@ -75,10 +162,35 @@ class Alexa:
         thread1.setDaemon(True)
         thread1.start()
 
-        # NOTE: This is a blocking call
-        self.manage_timers.startup()
-
-
+    def run_phase(self, name, target, timings):
+        start = time.monotonic()
+        target()
+        timings[name] = time.monotonic() - start
+
+    def run_phases_parallel(self, phases, timings):
+        """
+        Run the startup phases in their own threads and wait for all of them.
+        The first exception raised by a phase is raised again here.
+        """
+        errors = []
+
+        def run(name, target):
+            try:
+                self.run_phase(name, target, timings)
+            except Exception as e:
+                logger.exception("Startup phase %s failed", name)
+                errors.append(e)
+
+        threads = []
+        for name, target in phases:
+            thread = threading.Thread(target=run, args=(name, target), name="startup-" + name)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
 
 
 def main():
@@ -86,6 +198,43 @@ def main():
     The main function
     :return:
     """
+    parser = argparse.ArgumentParser(description="Alexa timer display")
+    parser.add_argument("--parallel-startup", action="store_true",
+                        help="start MQTT, HTTP, display and bluetooth concurrently and scroll "
+                             "the startup message without blocking")
+    parser.add_argument("--display", choices=["adafruit", "max7219", "virtual"], default="adafruit",
+                        help="adafruit: RGB matrix HAT, max7219: 4 module 32x8 LED matrix, "
+                             "virtual: in-memory frame buffer (no panel needed)")
+    parser.add_argument("--capture-dir",
+                        help="with --display virtual, write every frame to this directory")
+    parser.add_argument("--capture-format", choices=["png", "raw"], default="png")
+    parser.add_argument("--chain-length", type=int, default=1,
+                        help="adafruit and virtual: number of daisy chained 64x32 panels, "
+                             "each shows two more timers")
+    parser.add_argument("--parallel-chains", type=int, default=1,
+                        help="adafruit and virtual: number of parallel panel chains")
+    parser.add_argument("--runtime", choices=["threads", "asyncio"], default="threads",
+                        help="asyncio: run MQTT, HTTP and the render loop on one event loop "
+                             "thread instead of a thread each")
+    parser.add_argument("--room",
+                        help="only display MQTT timers set on this Alexa device (deviceName)")
+    parser.add_argument("--realtime", type=int, nargs="?", const=10, metavar="PRIORITY",
+                        help="threads runtime: run the render thread SCHED_FIFO at this priority "
+                             "(default 10) so the colon blink and seconds stay on time under load")
+    parser.add_argument("--render-cpu", type=int,
+                        help="threads runtime: run the render thread on this CPU")
+    parser.add_argument("--gil-switch-interval", type=float, metavar="MS",
+                        help="GIL switch interval for the whole process in milliseconds "
+                             "(Python's default is 5), shorter hands the GIL to the render loop sooner")
+    args = parser.parse_args()
+
+    display_options = None
+    if args.display == "adafruit":
+        display_options = { "chain_length": args.chain_length, "parallel": args.parallel_chains }
+    elif args.display == "virtual":
+        display_options = { "capture_dir": args.capture_dir, "capture_format": args.capture_format,
+                            "chain_length": args.chain_length, "parallel": args.parallel_chains }
+
     if os.geteuid() != 0:
         exit("You need to have root privileges to run this script.\nPlease try again, this time using 'sudo'. Exiting.")
 
@@ -96,7 +245,9 @@ def main():
     # noise = int(data[187:192])
     # print("Link:{} Level:{} Noise:{}".format(link, level, noise))
 
-    alexa = Alexa()
+    alexa = Alexa(args.parallel_startup, args.display, display_options, args.runtime, args.room,
+                  args.realtime, args.render_cpu,
+                  args.gil_switch_interval / 1000 if args.gil_switch_interval is not None else None)
     alexa.startup()
 
 
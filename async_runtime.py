@@ -0,0 +1,211 @@
+#
+# Alexa Timer Display
+#
+# async_runtime.py - optional runtime that drives MQTT, HTTP and the render
+#                    loop from one asyncio event loop
+#
+# The default runtime uses a thread per job: the paho network thread, the
+# HTTP server thread, a render thread per burst of timers and the startup
+# splash.  This one runs a single "runtime" thread with an event loop:
+#
+#   MQTT       paho sockets are watched by the loop (add_reader/add_writer)
+#              instead of paho's loop_start thread, reconnecting with backoff
+#   HTTP       HttpServer.serve() runs as a task
+#   render     ManageTimers.run_timers_async() runs as a task
+#   bluetooth  the agt gadget's blocking main() stays on the main thread and
+#              its directive handlers are handed to the loop
+#
+# plus the one HTTP handler thread for blocking handlers.  The startup
+# message scrolls before the loop starts instead of in a splash thread.
+#
+import asyncio
+import logging
+import threading
+
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger(__name__)
+
+
+class MqttLoopBridge():
+    """
+    Runs a paho client's network I/O on an asyncio event loop using paho's
+    socket callbacks, in place of loop_start()
+    """
+
+    # Seconds between loop_misc calls (keepalive pings)
+    MISC_INTERVAL = 1
+    # Same as Pubsub's reconnect_delay_set(1, 30)
+    RECONNECT_MIN_DELAY = 1
+    RECONNECT_MAX_DELAY = 30
+
+    def __init__(self, loop, client, host, port):
+        self.loop = loop
+        self.client = client
+        self.host = host
+        self.port = port
+        self.stopping = False
+        self.misc = None
+        self.reconnecting = None
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def start(self):
+        self.schedule_connect(0)
+
+    def stop(self):
+        self.stopping = True
+        if self.reconnecting is not None:
+            self.reconnecting.cancel()
+
+    def on_loop(self, callback, *args):
+        """
+        Run callback on the loop.  paho calls the socket callbacks from
+        reconnect(), which runs in an executor thread.
+        """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self.on_loop(self.socket_opened, sock)
+
+    def socket_opened(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        self.misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.on_loop(self.socket_closed, sock)
+
+    def socket_closed(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if self.misc is not None:
+            self.misc.cancel()
+            self.misc = None
+        if not self.stopping:
+            self.schedule_connect(MqttLoopBridge.RECONNECT_MIN_DELAY)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.on_loop(self.loop.remove_writer, sock)
+
+    async def misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(MqttLoopBridge.MISC_INTERVAL)
+
+    def schedule_connect(self, delay):
+        if self.reconnecting is None or self.reconnecting.done():
+            self.reconnecting = self.loop.create_task(self.connect(delay))
+
+    async def connect(self, delay):
+        """
+        Connect, retrying with backoff between the client's reconnect delays
+        """
+        while not self.stopping:
+            if delay:
+                await asyncio.sleep(delay)
+            # paho connects with a blocking socket (timing out after its
+            # connect timeout, 5 s), so connect from an executor thread
+            try:
+                await self.loop.run_in_executor(None, self.client.reconnect)
+                return
+            except OSError as e:
+                logger.warning("MQTT connect to %s:%d failed: %s", self.host, self.port, e)
+            delay = min(max(delay * 2, MqttLoopBridge.RECONNECT_MIN_DELAY), MqttLoopBridge.RECONNECT_MAX_DELAY)
+
+
+class AsyncRuntime():
+    """
+    Runs the app's MQTT client, HTTP server and render loop on one event
+    loop in a "runtime" thread.  The app must have been started with
+    Pubsub(start_loop=False) and an HttpServer that is not yet running.
+    """
+
+    # Seconds stop() waits for the offline message, disconnect and the thread
+    STOP_TIMEOUT = 5
+
+    def __init__(self, app):
+        self.app = app
+        self.loop = None
+        self.mqtt = None
+        self.thread = None
+        self.main_task = None
+        self.ready = threading.Event()
+
+    def start(self):
+        """
+        Start the runtime thread and wait until the loop is running
+        """
+        self.thread = threading.Thread(target=self.run, name="runtime")
+        self.thread.daemon = True
+        self.thread.start()
+        self.ready.wait()
+
+    def join(self):
+        self.thread.join()
+
+    def run(self):
+        try:
+            asyncio.run(self.main())
+        except asyncio.CancelledError:
+            # stop()
+            logger.info("Runtime stopped")
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.main_task = asyncio.current_task()
+        manage_timers = self.app.manage_timers
+
+        # Render task, woken from any thread by timer_changed
+        wake = asyncio.Event()
+        manage_timers.wake = lambda: self.loop.call_soon_threadsafe(wake.set)
+        tasks = [self.loop.create_task(manage_timers.run_timers_async(wake))]
+        if manage_timers.timers_from_bluetooth is not None:
+            manage_timers.timers_from_bluetooth.run_callback = self.loop.call_soon_threadsafe
+
+        pubsub = self.app.pubsub
+        if pubsub is not None:
+            self.mqtt = MqttLoopBridge(self.loop, pubsub.client, pubsub.mqttBrokerHost, pubsub.mqttBrokerPort)
+            self.mqtt.start()
+
+        if self.app.server is not None:
+            tasks.append(self.loop.create_task(self.app.server.serve()))
+
+        self.ready.set()
+        # Timers that arrived before the loop started
+        wake.set()
+        await asyncio.gather(*tasks)
+
+    def stop(self):
+        """
+        Shut down from another thread (the signal handler): the MQTT offline
+        message and disconnect are sent from the loop, which owns the
+        socket, then the loop stops.  Waits for the runtime thread to end.
+        """
+        if self.thread is None or not self.thread.is_alive():
+            return
+        future = asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop)
+        try:
+            future.result(AsyncRuntime.STOP_TIMEOUT)
+        except Exception as e:
+            logger.warning("Runtime shutdown failed: %r", e)
+        self.thread.join(AsyncRuntime.STOP_TIMEOUT)
+
+    async def shutdown(self):
+        if self.mqtt is not None:
+            self.mqtt.stop()
+        if self.app.pubsub is not None:
+            self.app.pubsub.shutdown()
+        # Cancels the render and HTTP tasks, asyncio.run() then closes the loop
+        self.main_task.cancel()
+
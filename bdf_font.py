@@ -0,0 +1,130 @@
+#
+# Alexa Timer Display
+#
+# bdf_font.py - load BDF fonts and rasterize text the same way rgbmatrix
+#               graphics.DrawText does, so text can be pre-rendered in Python
+#
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Glyph drawn for code points that are not in the font
+REPLACEMENT_CODEPOINT = 0xFFFD
+
+
+class Glyph:
+    """
+    A single glyph.  Pixels are stored as spans per row so they can be
+    copied into a frame buffer with slice assignments.
+    """
+    __slots__ = ('device_width', 'height', 'y_offset', 'spans')
+
+    def __init__(self, device_width, height, y_offset, spans):
+        self.device_width = device_width
+        self.height = height
+        self.y_offset = y_offset
+        # List of (row, x start, x end) relative to the top left of the glyph
+        self.spans = spans
+
+
+class BdfFont:
+    """
+    BDF font.  Glyph placement follows rgbmatrix bdf-font.cc: the y passed
+    to draw is the baseline and each glyph advances x by its DWIDTH.
+    """
+
+    def __init__(self, path, codepoints = None):
+        """
+        Load a BDF font.  If codepoints is given, only those glyphs are kept.
+        """
+        self.path = path
+        self.height = 0
+        self.baseline = 0
+        self.glyphs = {}
+        self._load(path, codepoints)
+
+    def _load(self, path, codepoints):
+        with open(path, 'r', encoding='latin-1') as f:
+            lines = f.read().splitlines()
+
+        codepoint = None
+        device_width = 0
+        width = height = x_offset = y_offset = 0
+        rows = None
+        for line in lines:
+            if rows is not None:
+                if line.startswith('ENDCHAR'):
+                    if codepoints is None or codepoint in codepoints:
+                        self.glyphs[codepoint] = self._make_glyph(device_width, width, height,
+                                                                  x_offset, y_offset, rows)
+                    rows = None
+                else:
+                    rows.append(line)
+            elif line.startswith('ENCODING '):
+                codepoint = int(line.split()[1])
+                device_width = 0
+            elif line.startswith('DWIDTH '):
+                device_width = int(line.split()[1])
+            elif line.startswith('BBX '):
+                width, height, x_offset, y_offset = [int(x) for x in line.split()[1:5]]
+            elif line.startswith('BITMAP'):
+                rows = []
+            elif line.startswith('FONTBOUNDINGBOX '):
+                values = [int(x) for x in line.split()[1:5]]
+                self.height = values[1]
+                self.baseline = values[1] + values[3]
+
+    def _make_glyph(self, device_width, width, height, x_offset, y_offset, rows):
+        spans = []
+        for row, hexValue in enumerate(rows[:height]):
+            bits = int(hexValue, 16)
+            bitCount = 4 * len(hexValue)
+            start = None
+            # Only the device width is drawn, the same as rgbmatrix
+            for x in range(device_width + 1):
+                bit = x - x_offset
+                on = x < device_width and 0 <= bit < bitCount and (bits >> (bitCount - 1 - bit)) & 1
+                if on and start is None:
+                    start = x
+                elif not on and start is not None:
+                    spans.append((row, start, x))
+                    start = None
+        return Glyph(device_width, height, y_offset, spans)
+
+    def glyph(self, codepoint):
+        glyph = self.glyphs.get(codepoint)
+        if glyph is None:
+            glyph = self.glyphs.get(REPLACEMENT_CODEPOINT)
+        return glyph
+
+    def text_width(self, text):
+        width = 0
+        for char in text:
+            glyph = self.glyph(ord(char))
+            if glyph is not None:
+                width += glyph.device_width
+        return width
+
+    def draw_text(self, buffer, width, height, x, y, color, text):
+        """
+        Draw text into an RGB frame buffer (bytearray of width * height * 3)
+        with the baseline at y.  Returns the width of the text in pixels.
+        """
+        pixel = bytes(color)
+        startX = x
+        for char in text:
+            glyph = self.glyph(ord(char))
+            if glyph is None:
+                continue
+            top = y - glyph.height - glyph.y_offset
+            for row, spanStart, spanEnd in glyph.spans:
+                py = top + row
+                if py < 0 or py >= height:
+                    continue
+                x0 = max(0, x + spanStart)
+                x1 = min(width, x + spanEnd)
+                if x0 < x1:
+                    offset = py * width
+                    buffer[(offset + x0) * 3:(offset + x1) * 3] = pixel * (x1 - x0)
+            x += glyph.device_width
+        return x - startX
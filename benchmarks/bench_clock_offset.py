@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+#
+# Countdown error after boot with the Pi's clock off, with and without
+# ClockOffset
+#
+# Replays a simulated clock for each scenario: the Pi's wall clock is off
+# from the true time until NTP steps it (if it ever does), and the timer
+# sender (whose clock is right) publishes a timers message about every 20
+# seconds, the first one answering the request made on connecting.  Broker
+# delays are 10-300 ms, 2-5 s one time in ten.  At 10 frames a second, from
+# the first message (and so the first timer) on, the time used for the
+# countdowns is compared with the true time:
+#
+#   p50/p99/max ms     countdown error
+#   over 1 s           seconds the countdowns were more than a second off
+#   jump ms            largest change of the error between two frames
+#   est ms             median error the clock estimated for itself, blank
+#                      while unknown (fewer than MIN_ERROR_SAMPLES messages)
+#
+# Usage: python3 benchmarks/bench_clock_offset.py [--minutes 30] [--seed 1]
+#
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import clock_offset
+from clock_offset import ClockOffset
+
+FRAME = 0.1
+# Seconds after boot the first message arrives
+CONNECTED = 3.0
+BOOT_TIME = 1.6e9
+
+# name, Pi clock error until NTP steps it, drift while unsynchronized
+# (seconds per second), seconds after boot NTP steps the clock, or None
+SCENARIOS = (
+    ("ntp after 90 s", -3 * 3600.0, 0.0, 90.0),
+    ("no ntp", -3 * 3600.0, 100e-6, None),
+    ("no ntp, 2.5 s off", 2.5, 100e-6, None),
+    ("ntp synchronized", 0.0, 0.0, 0.0),
+)
+
+
+class SimulatedClock:
+
+    def __init__(self, error, drift, ntpStep):
+        self.t = 0.0
+        self.error = error
+        self.drift = drift
+        self.ntpStep = ntpStep
+
+    def synchronized(self):
+        return self.ntpStep is not None and self.t >= self.ntpStep
+
+    def true_time(self):
+        return BOOT_TIME + self.t
+
+    def wall(self):
+        if self.synchronized():
+            # NTP keeps the clock within a few ms
+            return self.true_time() + 0.003
+        return self.true_time() + self.error + self.drift * self.t
+
+    def monotonic(self):
+        return 1000.0 + self.t
+
+    def ntp_state(self):
+        if self.synchronized():
+            return True, 0.003, 0.05
+        return False, 16.0, 16.0
+
+
+def broker_delay(rnd):
+    if rnd.random() < 0.1:
+        return rnd.uniform(2, 5)
+    return rnd.uniform(0.01, 0.3)
+
+
+def replay(clock, corrected, minutes, rnd):
+    """
+    Countdown errors per frame from the first message on, with corrected
+    the time used for countdowns and the ClockOffset fed the messages
+    """
+    messages = []
+    at = CONNECTED
+    while at < minutes * 60:
+        published = at
+        messages.append((at + broker_delay(rnd), published))
+        at += rnd.uniform(10, 30)
+    messages.sort()
+    messagesStart = messages[0][0]
+
+    errors = []
+    estimates = []
+    frames = int(minutes * 60 / FRAME)
+    for frame in range(frames):
+        clock.t = frame * FRAME
+        while messages and messages[0][0] <= clock.t:
+            arrival, published = messages.pop(0)
+            corrected.add_sample(BOOT_TIME + published, clock.monotonic() - (clock.t - arrival))
+        now = corrected.now()
+        if clock.t >= messagesStart:
+            errors.append(now - clock.true_time())
+            estimate = corrected.error_estimate()
+            if estimate == estimate:
+                estimates.append(estimate)
+    return errors, estimates
+
+
+class Uncorrected:
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def add_sample(self, published, arrival):
+        pass
+
+    def now(self):
+        return self.clock.wall()
+
+    def error_estimate(self):
+        return float('nan')
+
+
+def summary(errors, estimates):
+    absolute = sorted(abs(error) for error in errors)
+    over = sum(1 for error in absolute if error > 1.0) * FRAME
+    jump = max(abs(b - a) for a, b in zip(errors, errors[1:]))
+    estimate = "%10.1f" % (sorted(estimates)[len(estimates) // 2] * 1000) if estimates else ""
+    return "%10.1f %10.1f %12.1f %9.1f %10.1f %s" % (absolute[len(absolute) // 2] * 1000,
+        absolute[int(len(absolute) * 0.99)] * 1000, absolute[-1] * 1000, over, jump * 1000, estimate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Countdown error with and without clock correction")
+    parser.add_argument("--minutes", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print("%-20s %-12s %10s %10s %12s %9s %10s %10s" % ("scenario", "clock", "p50 ms", "p99 ms",
+          "max ms", "over 1 s", "jump ms", "est ms"))
+    for name, error, drift, ntpStep in SCENARIOS:
+        for label in ("time.time", "ClockOffset"):
+            rnd = random.Random(args.seed)
+            clock = SimulatedClock(error, drift, ntpStep)
+            if label == "time.time":
+                corrected = Uncorrected(clock)
+            else:
+                corrected = ClockOffset(clock.wall, clock.monotonic, clock.ntp_state)
+            errors, estimates = replay(clock, corrected, args.minutes, rnd)
+            print("%-20s %-12s %s" % (name, label, summary(errors, estimates)))
+
+    print("\nreal adjtimex state: %s" % (clock_offset.read_ntp_state(),))
+
+
+if __name__ == "__main__":
+    main()
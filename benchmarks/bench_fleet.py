@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# Benchmark the fleet aggregator's status message throughput and fleet views
+#
+# Status messages are delivered through the fake paho client, which runs the
+# aggregator's callbacks the way the paho network thread would, so this
+# measures topic matching, parsing and the index update per message.
+# Workloads, for fleets of 100 to 2000 nodes:
+#
+#   birth     every node and device publishes its retained birth message
+#   churn     random online/offline flips, a quarter of them repeats of the current status
+#   churn+rd  churn while another thread reads incremental views as fast as it can
+#
+# and the cost of a full view and an incremental view as served on /v1/fleet.
+#
+# Usage: python3 benchmarks/bench_fleet.py [--messages 100000]
+#
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+os.chdir(ROOT)
+
+import fakes
+fakes.install()
+
+from fleet_aggregator import FleetAggregator
+
+NAMESPACE = "yukon"
+FLEET_SIZES = [100, 500, 2000]
+MQTT_CONFIG = {"host": "localhost", "port": 1883, "username": "", "password": ""}
+
+
+def node_topic(node):
+    return "%s/node/%s/status" % (NAMESPACE, node)
+
+
+def device_topic(node):
+    return "%s/device/alexa/kitchen/%s/display/status" % (NAMESPACE, node)
+
+
+def make_aggregator():
+    aggregator = FleetAggregator(NAMESPACE)
+    aggregator.connect(MQTT_CONFIG, "bench")
+    aggregator.on_connect(aggregator.client, None, {}, 0)
+    return aggregator
+
+
+def churn_messages(nodes, count):
+    messages = []
+    random.seed(1)
+    for i in range(count):
+        node = random.choice(nodes)
+        if i % 4 == 0:
+            messages.append((device_topic(node), b"unknown"))
+        else:
+            messages.append((node_topic(node), random.choice((b"online", b"offline"))))
+    return messages
+
+
+def deliver(client, messages):
+    start = time.perf_counter()
+    for topic, payload in messages:
+        client.deliver(topic, payload)
+    return len(messages) / (time.perf_counter() - start)
+
+
+def encode(view):
+    return json.dumps(view, separators=(',', ':')).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fleet aggregator benchmark")
+    parser.add_argument("--messages", type=int, default=100000, help="churn messages per fleet size")
+    args = parser.parse_args()
+
+    print("%6s %12s %12s %12s %10s %10s %12s %12s" % ("nodes", "birth msg/s", "churn msg/s",
+          "churn+rd", "views/s", "full ms", "full KiB", "incr(100) ms"))
+    for size in FLEET_SIZES:
+        nodes = ["rpi%04d" % i for i in range(size)]
+        aggregator = make_aggregator()
+        client = aggregator.client
+        index = aggregator.index
+
+        births = [(node_topic(node), b"online") for node in nodes]
+        births += [(device_topic(node), b"unknown") for node in nodes]
+        birthRate = deliver(client, births)
+
+        messages = churn_messages(nodes, args.messages)
+        churnRate = deliver(client, messages)
+
+        # Same churn with a reader polling incremental views, like HTTP clients would
+        stop = threading.Event()
+        views = [0]
+
+        def reader():
+            since = index.seq
+            while not stop.is_set():
+                view = index.view(since)
+                encode(view)
+                since = view["seq"]
+                views[0] += 1
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        readStart = time.perf_counter()
+        readRate = deliver(client, messages)
+        stop.set()
+        thread.join()
+        viewRate = views[0] / (time.perf_counter() - readStart)
+
+        start = time.perf_counter()
+        body = encode(index.view())
+        fullSeconds = time.perf_counter() - start
+
+        since = index.seq
+        deliver(client, churn_messages(nodes, 100))
+        start = time.perf_counter()
+        encode(index.view(since))
+        incrSeconds = time.perf_counter() - start
+
+        print("%6d %12.0f %12.0f %12.0f %10.0f %10.2f %12.1f %12.3f" % (size, birthRate, churnRate,
+              readRate, viewRate, fullSeconds * 1000, len(body) / 1024.0, incrSeconds * 1000))
+
+
+if __name__ == "__main__":
+    main()
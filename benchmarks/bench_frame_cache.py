@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# Benchmark per-frame cost of DisplayAdafruitHat with and without the frame cache
+#
+# Runs on a fake canvas, so it does not need rgbmatrix or a matrix panel.
+# The baseline is an emulation: "DrawText" is one Python SetPixel call per
+# lit pixel, the same pixels the rgbmatrix C++ DrawText sets, but much
+# slower than the native call.  The draw column is an upper bound for the
+# real DrawText and the cached column pays the same emulated DrawText for
+# frames drawn the first time.  Compare hit rates here, and time the
+# native DrawText on the Pi itself.
+#
+#   hits     frames blitted from the cache
+#   first    frames shown for the first time, drawn with DrawText
+#
+# Usage: python3 benchmarks/bench_frame_cache.py
+#
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+os.chdir(ROOT)
+
+# Stand-in for rgbmatrix so display_adafruit_hat can be imported
+import fakes
+fakes.install()
+
+from display_adafruit_hat import DisplayAdafruitHat, FONT_PATH, FONT_SMALL_PATH, \
+    TIMER_CODEPOINTS, PRIMARY_COLOR, SECONDARY_COLOR
+from bdf_font import BdfFont
+from frame_cache import FrameCache
+
+WIDTH = 64
+HEIGHT = 32
+
+
+class FakeCanvas:
+    width = WIDTH
+    height = HEIGHT
+
+    def __init__(self):
+        self.pixels = bytearray(WIDTH * HEIGHT * 3)
+        self.set_pixel_calls = 0
+
+    def Clear(self):
+        self.pixels[:] = bytes(len(self.pixels))
+
+    def SetPixel(self, x, y, r, g, b):
+        self.set_pixel_calls += 1
+        offset = (y * WIDTH + x) * 3
+        self.pixels[offset:offset + 3] = bytes((r, g, b))
+
+    def SetImage(self, image, offset_x=0, offset_y=0):
+        self.pixels[:] = image
+
+
+def draw_text(canvas, font, x, y, color, text):
+    """
+    Emulates graphics.DrawText: one SetPixel per lit pixel
+    """
+    for char in text:
+        glyph = font.glyph(ord(char))
+        top = y - glyph.height - glyph.y_offset
+        for row, start, end in glyph.spans:
+            py = top + row
+            if 0 <= py < HEIGHT:
+                for px in range(x + start, x + end):
+                    if 0 <= px < WIDTH:
+                        canvas.SetPixel(px, py, *color)
+        x += glyph.device_width
+
+
+def frames(start, seconds, secondary_offset):
+    """
+    Formatted frames of a countdown, two per second like the render loop
+    """
+    display = DisplayAdafruitHat.__new__(DisplayAdafruitHat)
+    result = []
+    remaining = start
+    while remaining > start - seconds:
+        primary = display.format_time_remaining(remaining)
+        secondary = None
+        if secondary_offset is not None:
+            secondary = display.format_time_remaining(remaining + secondary_offset, True)
+        result.append((primary, secondary))
+        remaining -= 0.5
+    return result
+
+
+def run(frame_list, font, font_small, use_cache):
+    canvas = FakeCanvas()
+    cache = FrameCache(WIDTH, HEIGHT) if use_cache else None
+    start = time.perf_counter()
+    for primary, secondary in frame_list:
+        y = 27 if secondary is None else 22
+        if cache is not None:
+            runs = ((font, 2, y, PRIMARY_COLOR, primary),)
+            if secondary is not None:
+                runs += ((font_small, 4, 31, SECONDARY_COLOR, secondary),)
+            # As DisplayAdafruitHat.draw_panel, DrawText the first time
+            image = cache.get_frame(runs, render_first=False)
+            if image is not None:
+                canvas.SetImage(image)
+                continue
+        canvas.Clear()
+        if secondary is not None:
+            draw_text(canvas, font_small, 4, 31, SECONDARY_COLOR, secondary)
+        draw_text(canvas, font, 2, y, PRIMARY_COLOR, primary)
+    elapsed = (time.perf_counter() - start) / len(frame_list)
+    return elapsed, cache.stats() if cache is not None else None
+
+
+def main():
+    font = BdfFont(FONT_PATH, TIMER_CODEPOINTS)
+    font_small = BdfFont(FONT_SMALL_PATH, TIMER_CODEPOINTS)
+    workloads = [
+        ("minutes, one timer", frames(1800, 600, None)),
+        ("minutes, two timers", frames(1800, 600, 7200)),
+        ("hours, one timer", frames(7200, 600, None)),
+        ("repeat 10 s loop", frames(30, 10, None) * 60),
+    ]
+    print("%-22s %8s %14s %14s %8s %8s" % ("workload", "frames", "draw (us)", "cached (us)", "hits", "first"))
+    for name, frame_list in workloads:
+        uncached, stats = run(frame_list, font, font_small, False)
+        cached, stats = run(frame_list, font, font_small, True)
+        total = stats["hits"] + stats["misses"] + stats["first"]
+        print("%-22s %8d %14.2f %14.2f %7.0f%% %7.0f%%" % (name, len(frame_list), uncached * 1e6,
+              cached * 1e6, stats["hitRate"] * 100, stats["first"] * 100 / total))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+#
+# Benchmark per-frame draw time of multi-panel layouts on the virtual display
+#
+# Runs a countdown of two timers per panel the way the render loop does,
+# drawing only when time_until_next_change() says the text changes, and
+# compares redrawing only the changed panels with redrawing every panel.
+# Draw time includes copying the frame to the display (the swap).
+#
+# Usage: python3 benchmarks/bench_multi_panel.py [--seconds 600] [--budget-ms 10]
+#
+import argparse
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from display_virtual import DisplayVirtual
+
+# (chain_length, parallel)
+LAYOUTS = [(1, 1), (2, 1), (4, 1), (2, 2), (4, 2)]
+
+
+def countdown(display, seconds, full_redraw):
+    """
+    Draw times (seconds) of each frame of a countdown and the panels redrawn
+    """
+    count = display.timer_capacity
+    # Timers a few minutes apart so they change at different times, some in hours mode
+    ends = [45 + i * 397.3 + (3600 if i % 3 == 2 else 0) for i in range(count)]
+    now = 0.0
+    drawTimes = []
+    panelRedraws = display.panel_redraws
+    while now < seconds:
+        remaining = [max(0, end - now) for end in ends]
+        if full_redraw:
+            display.buffer_panels = None
+        start = time.perf_counter()
+        drawn = display.display_timers(remaining)
+        elapsed = time.perf_counter() - start
+        if drawn:
+            drawTimes.append(elapsed)
+        change = display.time_until_next_change(remaining)
+        now += change if change is not None else 1
+    return drawTimes, display.panel_redraws - panelRedraws
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=600, help="virtual seconds of countdown")
+    parser.add_argument("--budget-ms", type=float, default=10,
+                        help="refresh budget per frame, 10 ms is one refresh at 100 Hz")
+    args = parser.parse_args()
+
+    print("%-8s %6s %7s %-6s %8s %9s %9s %9s %9s %7s" % ("panels", "timers", "frames", "mode",
+          "panels/f", "avg us", "p99 us", "max us", "p99/bdgt", "over"))
+    for chain_length, parallel in LAYOUTS:
+        for mode in ("dirty", "full"):
+            display = DisplayVirtual(chain_length=chain_length, parallel=parallel)
+            drawTimes, panelRedraws = countdown(display, args.seconds, mode == "full")
+            budget = args.budget_ms / 1000.0
+            over = sum(1 for t in drawTimes if t > budget)
+            print("%-8s %6d %7d %-6s %8.2f %9.1f %9.1f %9.1f %8.1f%% %7d" % (
+                "%dx%d" % (chain_length, parallel), display.timer_capacity, len(drawTimes), mode,
+                panelRedraws / len(drawTimes), sum(drawTimes) / len(drawTimes) * 1e6,
+                percentile(drawTimes, 0.99) * 1e6, max(drawTimes) * 1e6,
+                percentile(drawTimes, 0.99) / budget * 100, over))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+#
+# Benchmark the timer ingest and render pipeline without hardware
+#
+# Uses the fakes in benchmarks/fakes for rgbmatrix, agt, paho and netifaces,
+# so it runs on any Linux box.  Workloads:
+#
+#   mqtt_full_update   full timers message through Pubsub.on_message_update_timers
+#   mqtt_delta_burst   burst of one-timer delta messages
+#   bluetooth          SetAlert/DeleteAlert directives through TimersFromBluetooth
+#   render_countdown   ManageTimers._run_timer on a virtual clock until all timers expire
+#   format_time        DisplayAdafruitHat.format_time_remaining
+#
+# Each workload runs with 1 to 10,000 timers and reports throughput, cost per
+# operation and tracemalloc allocations.  Results can be written as JSON and
+# compared against an earlier run:
+#
+#   python3 benchmarks/bench_pipeline.py --json before.json
+#   ... change code ...
+#   python3 benchmarks/bench_pipeline.py --json after.json --compare before.json
+#
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+os.chdir(ROOT)
+
+import fakes
+fakes.install()
+
+from clock_offset import ClockOffset
+import manage_timers
+import render_scheduler
+from display_adafruit_hat import DisplayAdafruitHat
+from manage_timers import ManageTimers
+from pubsub import Pubsub
+from timer_index import BLUETOOTH, MQTT, Timer
+
+SIZES = [1, 10, 100, 1000, 10000]
+QUICK_SIZES = [1, 100, 1000]
+# Virtual seconds of countdown for render_countdown
+COUNTDOWN_SECONDS = 3600
+BURST_SIZE = 1000
+
+
+class VirtualClock:
+    """
+    Stands in for the time module in manage_timers and render_scheduler.
+    time() and monotonic() only move when the render loop waits, so an hour
+    long countdown runs as fast as it can be drawn.
+    """
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return time.perf_counter()
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class VirtualEvent:
+    """
+    Replaces ManageTimers.event.  wait() advances the virtual clock.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.waits = 0
+
+    def set(self):
+        pass
+
+    def clear(self):
+        pass
+
+    def is_set(self):
+        return False
+
+    def wait(self, timeout = None):
+        self.waits += 1
+        self.clock.now += timeout
+        return False
+
+
+class BenchManageTimers(ManageTimers):
+    """
+    ManageTimers that does not start the render thread, so ingest is
+    measured on its own
+    """
+
+    def _create_timer_thread(self):
+        pass
+
+
+def make_app():
+    app = SimpleNamespace(server=None, startup_time=time.monotonic())
+    app.manage_timers = BenchManageTimers(app)
+    app.manage_timers.init_bluetooth()
+    return app
+
+
+def make_pubsub(app):
+    # Pubsub reads config.yml from the current directory
+    previous = os.getcwd()
+    configDir = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(ROOT, "config_EXAMPLE.yml"), os.path.join(configDir, "config.yml"))
+        os.chdir(configDir)
+        return Pubsub(app)
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(configDir)
+
+
+def iso_time(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).astimezone().isoformat(timespec="seconds")
+
+
+def timer_list(count, now, prefix = "timer"):
+    return [{"id": "%s-%d" % (prefix, i), "deviceName": "kitchen",
+             "expireTime": iso_time(now + 60 + (i * 37) % 36000)} for i in range(count)]
+
+
+def measure(name, timers, run, ops):
+    """
+    Time run() and repeat it under tracemalloc to count allocations.
+    run() must be repeatable and do `ops` operations.
+    """
+    start = time.perf_counter()
+    extra = run() or {}
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    run()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "name": name,
+        "timers": timers,
+        "ops": ops,
+        "seconds": round(seconds, 6),
+        "ops_per_sec": round(ops / seconds, 1) if seconds > 0 else None,
+        "us_per_op": round(seconds / ops * 1e6, 3),
+        "alloc_peak_kib": round((peak - before) / 1024.0, 1),
+        "alloc_retained_kib": round((current - before) / 1024.0, 1),
+    }
+    result.update(extra)
+    return result
+
+
+def bench_mqtt_full_update(count):
+    app = make_app()
+    pubsub = make_pubsub(app)
+    now = time.time()
+    # Alternate between two lists so every message changes all timers
+    payloads = [json.dumps({"seq": seq, "timers": timer_list(count, now, "timer%d" % (seq % 2))}).encode()
+                for seq in range(2)]
+    repeat = max(4, min(2000, 20000 // count))
+
+    def run():
+        for i in range(repeat):
+            pubsub.client.deliver(pubsub.queueDeviceUpdateTimers, payloads[i % 2])
+
+    return measure("mqtt_full_update", count, run, repeat)
+
+
+def bench_mqtt_delta_burst(count):
+    app = make_app()
+    pubsub = make_pubsub(app)
+    now = time.time()
+    timers = timer_list(count, now)
+    state = {"seq": 0}
+
+    def run():
+        # Start each run from a full list so the deltas follow its seq
+        pubsub.client.deliver(pubsub.queueDeviceUpdateTimers,
+                              json.dumps({"seq": state["seq"], "timers": timers}).encode())
+        for i in range(BURST_SIZE):
+            state["seq"] += 1
+            timerId = "timer-%d" % (i % count)
+            if i % 3 == 2:
+                ops = [{"op": "remove", "id": timerId}]
+            else:
+                ops = [{"op": "update", "id": timerId, "expireTime": iso_time(now + 120 + i)}]
+            pubsub.client.deliver(pubsub.queueDeviceUpdateTimerDeltas,
+                                  json.dumps({"seq": state["seq"], "ops": ops}).encode())
+        state["seq"] += 1
+        return {"timers_requests": len(pubsub.client.published)}
+
+    return measure("mqtt_delta_burst", count, run, BURST_SIZE)
+
+
+def bench_bluetooth(count):
+    app = make_app()
+    gadget = app.manage_timers.timers_from_bluetooth
+    now = time.time()
+    for timer in timer_list(count, now, "existing"):
+        gadget.timers.set(Timer(timer["id"], BLUETOOTH, now + 600))
+    directives = [SimpleNamespace(payload=SimpleNamespace(
+        type="TIMER", token="token-%d" % i, scheduledTime=iso_time(now + 60 + i)))
+        for i in range(BURST_SIZE)]
+
+    def run():
+        for directive in directives:
+            gadget.on_alerts_setalert(directive)
+        for directive in directives:
+            gadget.on_alerts_deletealert(directive)
+
+    return measure("bluetooth", count, run, 2 * BURST_SIZE)
+
+
+def bench_render_countdown(count):
+    clock = VirtualClock()
+    realTime = manage_timers.time
+    manage_timers.time = clock
+    render_scheduler.time = clock
+    try:
+        app = make_app()
+        timers = app.manage_timers
+        timers.display = DisplayAdafruitHat()
+        timers.display_ready.set()
+        timers.event = VirtualEvent(clock)
+        # Countdowns read the corrected clock, make it follow the virtual one
+        timers.clock = ClockOffset(clock.time, clock.time, lambda: None)
+        timers.reconciler.wall = timers.clock.now
+        matrix = timers.display.matrix
+
+        def run():
+            start = clock.now
+            # Spread the timers over the countdown, the last one ends at COUNTDOWN_SECONDS
+            for i in range(count):
+                timers.timers_from_mqtt.timers.set(Timer("timer-%d" % i, MQTT,
+                                                         start + COUNTDOWN_SECONDS * (i + 1) / count))
+            timers.reconcile()
+            swaps = matrix.swaps
+            waits = timers.event.waits
+            timers._run_timer()
+            return {"frames": matrix.swaps - swaps, "iterations": timers.event.waits - waits,
+                    "virtual_seconds": round(clock.now - start, 1)}
+
+        # ops is the number of loop iterations, roughly two per virtual second
+        warm = run()
+        return measure("render_countdown", count, run, max(1, warm["iterations"]))
+    finally:
+        manage_timers.time = realTime
+        render_scheduler.time = realTime
+
+
+def bench_format_time(count):
+    display = DisplayAdafruitHat.__new__(DisplayAdafruitHat)
+    # Every quarter second of a ten hour countdown
+    values = [i * 0.25 for i in range(4 * 36000)]
+
+    def run():
+        for value in values:
+            display.format_time_remaining(value)
+            display.format_time_remaining(value, True)
+
+    return measure("format_time", count, run, 2 * len(values))
+
+
+# (name, function, True if run for each number of timers)
+WORKLOADS = [
+    ("mqtt_full_update", bench_mqtt_full_update, True),
+    ("mqtt_delta_burst", bench_mqtt_delta_burst, True),
+    ("bluetooth", bench_bluetooth, True),
+    ("render_countdown", bench_render_countdown, True),
+    ("format_time", bench_format_time, False),
+]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline):
+    previous = {}
+    if baseline is not None:
+        previous = dict(((r["name"], r["timers"]), r) for r in baseline["results"])
+    print("%-18s %7s %9s %12s %11s %10s %10s" % (
+        "workload", "timers", "ops", "ops/sec", "us/op", "peak KiB", "vs base"))
+    for result in results:
+        change = ""
+        old = previous.get((result["name"], result["timers"]))
+        if old is not None and old["us_per_op"] > 0:
+            change = "%+.1f%%" % ((result["us_per_op"] / old["us_per_op"] - 1) * 100)
+        print("%-18s %7d %9d %12.1f %11.3f %10.1f %10s" % (
+            result["name"], result["timers"], result["ops"], result["ops_per_sec"] or 0,
+            result["us_per_op"], result["alloc_peak_kib"], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest and render pipeline benchmark")
+    parser.add_argument("--quick", action="store_true", help="fewer timer counts")
+    parser.add_argument("--workload", action="append", choices=[workload[0] for workload in WORKLOADS],
+                        help="run only this workload (may be repeated)")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    # The handlers log every timer at INFO, which would dominate the timings
+    logging.basicConfig(level=logging.WARNING)
+
+    sizes = QUICK_SIZES if args.quick else SIZES
+    results = []
+    for name, workload, perSize in WORKLOADS:
+        if args.workload and name not in args.workload:
+            continue
+        for count in (sizes if perSize else [0]):
+            results.append(workload(count))
+            print("%s timers=%d done" % (name, count), file=sys.stderr)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.json:
+        output = {
+            "commit": git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+#
+# Replay timers reported over MQTT and Bluetooth through the old
+# "MQTT first" policy and TimerReconciler
+#
+# Timers on the paired Echo are set, changed and cancelled on a virtual
+# timeline.  Each event reaches the MQTT index after a short delay that
+# sometimes spikes (a broker or network hiccup), and the Bluetooth index
+# about a second later with the expire time rounded to the second.  After
+# each delivery the timers shown by each policy are compared with the
+# actual timers:
+#
+#   set/change/cancel ms   time from an event to it being shown (p50/p99)
+#   missed                 events never shown before the next one
+#   duplicate s            seconds a timer was shown twice
+#   stale s                seconds a cancelled timer was still shown
+#
+# The old policy shows the MQTT timers if there are any, otherwise the
+# Bluetooth ones, and clears the Bluetooth timers on any change while
+# there are no MQTT timers.
+#
+# Usage: python3 benchmarks/bench_reconcile.py [--timers 500] [--hours 8] [--seed 1]
+#
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timer_index import BLUETOOTH, MQTT, Timer, TimerIndex
+from timer_reconciler import TOLERANCE, TimerReconciler
+
+
+
+def mqtt_delay(rnd):
+    if rnd.random() < 0.1:
+        return rnd.uniform(2, 5)
+    return rnd.uniform(0.05, 0.3)
+
+
+def bluetooth_delay(rnd):
+    return rnd.uniform(0.8, 1.3)
+
+
+def make_events(count, rnd, base, span):
+    """
+    List of (time, event, timer number, expire time), expire None for cancel
+    """
+    events = []
+    for i in range(count):
+        start = base + rnd.uniform(0, span)
+        expire = start + rnd.uniform(60, 900)
+        events.append((start, "set", i, expire))
+        choice = rnd.random()
+        if choice < 0.3:
+            at = start + rnd.uniform(5, 50)
+            events.append((at, "change", i, expire + rnd.choice((-30, 30, 60, 300))))
+        elif choice < 0.6:
+            events.append((start + rnd.uniform(5, 50), "cancel", i, None))
+    events.sort()
+    return events
+
+
+def deliveries(events, rnd):
+    """
+    Per source arrival of each event, in order for each timer
+    """
+    result = []
+    for source, delay in ((MQTT, mqtt_delay), (BLUETOOTH, bluetooth_delay)):
+        last = {}
+        for at, event, number, expire in events:
+            arrival = max(at + delay(rnd), last.get(number, 0) + 0.001)
+            last[number] = arrival
+            if source == BLUETOOTH and expire is not None:
+                # scheduledTime has second resolution
+                expire = float(int(expire))
+            result.append((arrival, source, number, expire))
+    result.sort()
+    return result
+
+
+class OldPolicy:
+
+    def __init__(self):
+        self.indexes = {MQTT: TimerIndex(), BLUETOOTH: TimerIndex()}
+
+    def changed(self, now):
+        if len(self.indexes[MQTT]) == 0:
+            self.indexes[BLUETOOTH].clear()
+
+    def shown(self):
+        if len(self.indexes[MQTT]):
+            return self.indexes[MQTT].sorted_timers()
+        return self.indexes[BLUETOOTH].sorted_timers()
+
+
+class ReconcilePolicy:
+
+    def __init__(self):
+        self.indexes = {MQTT: TimerIndex(), BLUETOOTH: TimerIndex()}
+        self.reconciler = TimerReconciler()
+
+    def changed(self, now):
+        self.reconciler.reconcile(self.indexes, now=now)
+
+    def shown(self):
+        return [(entry.id, entry.expire) for entry in self.reconciler.timers()]
+
+
+def timer_number(timer_id):
+    return int(timer_id.split("-")[1])
+
+
+def replay(policy, events, arrivals):
+    # Actual state after each event: timer number to expire time
+    pending = list(events)
+    actual = {}
+    # Events waiting to be shown: timer number to (event time, event, expire)
+    waiting = {}
+    latency = {"set": [], "change": [], "cancel": []}
+    missed = 0
+    duplicate = 0.0
+    stale = 0.0
+    lastTime = None
+    lastShown = []
+    changeTime = 0.0
+
+    for arrival, source, number, expire in arrivals:
+        # Time the previous view was on the display
+        if lastTime is not None:
+            seen = {}
+            for timerId, shownExpire in lastShown:
+                seen[timer_number(timerId)] = seen.get(timer_number(timerId), 0) + 1
+            for shownNumber, count in seen.items():
+                if count > 1:
+                    duplicate += arrival - lastTime
+                if shownNumber not in actual:
+                    stale += arrival - lastTime
+
+        while pending and pending[0][0] <= arrival:
+            at, event, eventNumber, eventExpire = pending.pop(0)
+            if eventNumber in waiting:
+                missed += 1
+            waiting[eventNumber] = (at, event, eventExpire)
+            if eventExpire is None:
+                actual.pop(eventNumber, None)
+            else:
+                actual[eventNumber] = eventExpire
+
+        index = policy.indexes[source]
+        timerId = ("m-%d" if source == MQTT else "t-%d") % number
+        if expire is None:
+            index.remove(timerId)
+        else:
+            index.set(Timer(timerId, source, expire))
+        start = time.perf_counter()
+        policy.changed(arrival)
+        changeTime += time.perf_counter() - start
+
+        shown = policy.shown()
+        byNumber = {}
+        for shownId, shownExpire in shown:
+            byNumber.setdefault(timer_number(shownId), []).append(shownExpire)
+        for eventNumber, (at, event, eventExpire) in list(waiting.items()):
+            shownExpires = byNumber.get(eventNumber, [])
+            if event == "cancel":
+                done = not shownExpires
+            else:
+                done = any(abs(value - eventExpire) <= TOLERANCE for value in shownExpires)
+            if done:
+                latency[event].append(arrival - at)
+                del waiting[eventNumber]
+        lastTime = arrival
+        lastShown = shown
+
+    missed += len(waiting)
+    return latency, missed, duplicate, stale, changeTime / len(arrivals)
+
+
+def percentiles(values):
+    if not values:
+        return "-"
+    values = sorted(values)
+    return "%d/%d" % (values[len(values) // 2] * 1000, values[min(len(values) - 1, int(len(values) * 0.99))] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MQTT first policy vs timer reconciliation")
+    parser.add_argument("--timers", type=int, default=500)
+    parser.add_argument("--hours", type=float, default=8, help="hours over which the timers are set")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    events = make_events(args.timers, rnd, time.time(), args.hours * 3600)
+    arrivals = deliveries(events, rnd)
+
+    print("%d timers, %d events, %d deliveries\n" % (args.timers, len(events), len(arrivals)))
+    print("%-10s %12s %12s %12s %7s %12s %8s" % ("policy", "set ms", "change ms", "cancel ms",
+          "missed", "duplicate s", "stale s"))
+    for name, policy in (("mqtt-first", OldPolicy()), ("reconcile", ReconcilePolicy())):
+        latency, missed, duplicate, stale, perDelivery = replay(policy, events, arrivals)
+        print("%-10s %12s %12s %12s %7d %12.1f %8.1f" % (name, percentiles(latency["set"]),
+              percentiles(latency["change"]), percentiles(latency["cancel"]), missed, duplicate, stale))
+        if name == "reconcile":
+            stats = policy.reconciler.stats()
+            print("\n%.1f us to reconcile each delivery" % (perDelivery * 1e6))
+            print(", ".join("%s %s" % (key, value) for key, value in sorted(stats.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+#
+# How late the render loop wakes up for its frame deadlines, idle and with
+# threads parsing MQTT timer messages
+#
+# A render thread counts down a timer with RenderScheduler the way
+# ManageTimers._run_timer does: draw, then wait for the next colon blink or
+# second boundary.  Load threads json.loads and json.dumps full timer
+# lists, like the MQTT handler, which holds the GIL for the whole parse.
+# Each mode runs for --seconds:
+#
+#   idle        no load
+#   load        --load-threads load threads
+#   switch      load, with the GIL switch interval at --switch-interval
+#   realtime    load, with the render thread SCHED_FIFO (needs root,
+#               skipped otherwise)
+#   both        load, SCHED_FIFO and the shorter switch interval (needs root)
+#
+# Lateness is the time from a deadline to the render thread running again,
+# the frames that blink the colon or tick the second.
+#
+# Usage: sudo python3 benchmarks/bench_render_jitter.py [--seconds 30] [--load-threads 2] [--cpu N]
+#                                                      [--switch-interval 1]
+#
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from render_scheduler import RenderScheduler, set_switch_interval
+from timer_text import format_time_remaining, time_until_change
+
+TIMERS_PER_MESSAGE = 200
+
+
+def timers_message(now):
+    return json.dumps({"seq": 1, "published": now, "timers": [
+        {"id": "AB72C64C86AW2-B0F007155344044W-%08d" % i, "deviceName": "room-%d" % (i % 10),
+         "expireTime": "2020-10-03T12:46:%02d-0600" % (i % 60), "label": "timer %d" % i}
+        for i in range(TIMERS_PER_MESSAGE)]})
+
+
+def load(stop):
+    payload = timers_message(time.time())
+    while not stop.is_set():
+        json.dumps(json.loads(payload))
+
+
+def render(scheduler, seconds, late):
+    scheduler.enter_realtime()
+    event = threading.Event()
+    end = time.monotonic() + seconds
+    expire = end + 0.5
+    while True:
+        now = time.monotonic()
+        if now >= end:
+            break
+        remaining = expire - now
+        format_time_remaining(remaining)
+        deadline = now + time_until_change(remaining)
+        scheduler.wait(event, deadline)
+        late.append(time.monotonic() - deadline)
+
+
+def run(seconds, loadThreads, priority, cpu, switchInterval):
+    defaultInterval = sys.getswitchinterval()
+    if switchInterval is not None:
+        set_switch_interval(switchInterval)
+    stop = threading.Event()
+    loaders = [threading.Thread(target=load, args=(stop,), daemon=True) for i in range(loadThreads)]
+    for thread in loaders:
+        thread.start()
+    late = []
+    scheduler = RenderScheduler(priority, cpu)
+    thread = threading.Thread(target=render, args=(scheduler, seconds, late))
+    thread.start()
+    thread.join()
+    stop.set()
+    for loader in loaders:
+        loader.join()
+    sys.setswitchinterval(defaultInterval)
+    return late
+
+
+def summary(late):
+    late = sorted(late)
+    return "%7d %9.2f %9.2f %9.2f" % (len(late), late[len(late) // 2] * 1000,
+        late[int(len(late) * 0.99)] * 1000, late[-1] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render loop deadline lateness under load")
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--load-threads", type=int, default=2)
+    parser.add_argument("--priority", type=int, default=10)
+    parser.add_argument("--cpu", type=int, help="also pin the render thread to this CPU in realtime mode")
+    parser.add_argument("--switch-interval", type=float, default=1, metavar="MS",
+                        help="GIL switch interval in the switch and both modes")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    json.loads(timers_message(time.time()))
+    print("%d CPUs, parsing one %d timer message takes %.2f ms\n" % (os.cpu_count(), TIMERS_PER_MESSAGE,
+          (time.perf_counter() - start) * 1000))
+    print("%-10s %7s %9s %9s %9s" % ("mode", "frames", "p50 ms", "p99 ms", "max ms"))
+    switchInterval = args.switch_interval / 1000
+    modes = [("idle", 0, None, None, None), ("load", args.load_threads, None, None, None),
+             ("switch", args.load_threads, None, None, switchInterval)]
+    if os.geteuid() == 0:
+        modes.append(("realtime", args.load_threads, args.priority, args.cpu, None))
+        modes.append(("both", args.load_threads, args.priority, args.cpu, switchInterval))
+    for name, loadThreads, priority, cpu, interval in modes:
+        print("%-10s %s" % (name, summary(run(args.seconds, loadThreads, priority, cpu, interval))))
+
+
+if __name__ == "__main__":
+    main()
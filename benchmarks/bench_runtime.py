@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+#
+# Compare thread count and RSS of the threaded and single event loop runtimes
+#
+# Runs the app (alexa.Alexa with the virtual display, real paho against the
+# local broker in benchmarks/mqtt_broker.py, fake bluetooth) in a child
+# process per runtime.  Once it has started, timer messages are published
+# and HTTP requests made for a few seconds while the child samples its
+# thread count and RSS.
+#
+# Usage: python3 benchmarks/bench_runtime.py [--seconds 5] [--rate 20]
+#
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+os.chdir(ROOT)
+
+RUNTIMES = ("threads", "asyncio")
+SAMPLE_INTERVAL = 0.05
+
+
+def iso_time(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).astimezone().isoformat(timespec="seconds")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout = 10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Nothing listening on port %d" % port)
+
+
+def child(runtime, brokerPort, httpPort, seconds):
+    """
+    Run the app in this process and print its stats as JSON
+    """
+    import logging
+
+    import fakes
+    fakes.install(("rgbmatrix", "agt", "netifaces"))
+
+    import alexa
+    import metrics
+    import timers_from_bluetooth
+    from http_request import HttpServer
+
+    HttpServer.PORT = httpPort
+
+    class BenchAlexa(alexa.Alexa):
+
+        def startup_mqtt(self):
+            # Pubsub reads config.yml from the current directory
+            configDir = tempfile.mkdtemp()
+            try:
+                with open(os.path.join(ROOT, "config_EXAMPLE.yml")) as f:
+                    config = f.read().replace("MQTT_SERVER", "127.0.0.1").replace("1883", str(brokerPort))
+                with open(os.path.join(configDir, "config.yml"), "w") as f:
+                    f.write(config)
+                os.chdir(configDir)
+                super().startup_mqtt()
+            finally:
+                os.chdir(ROOT)
+                shutil.rmtree(configDir)
+
+    def gadget_main(gadget):
+        """
+        Stands in for the gadget's blocking main(), on the main thread
+        """
+        idle = metrics.process_stats()
+        print("READY", flush=True)
+        peakThreads, peakRss = idle
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            threads, rss = metrics.process_stats()
+            peakThreads = max(peakThreads, threads)
+            peakRss = max(peakRss, rss)
+            time.sleep(SAMPLE_INTERVAL)
+        manage_timers = app.manage_timers
+        print(json.dumps({
+            "runtime": runtime,
+            "idle_threads": idle[0],
+            "idle_rss": idle[1],
+            "peak_threads": peakThreads,
+            "peak_rss": peakRss,
+            "thread_names": sorted(thread.name for thread in threading.enumerate()),
+            "frames": manage_timers.display.redraws,
+            "latency": manage_timers.latency.summary().get("mqtt"),
+        }), flush=True)
+        os._exit(0)
+
+    timers_from_bluetooth.TimersFromBluetooth.main = gadget_main
+    app = BenchAlexa(False, "virtual", {}, runtime)
+    logging.getLogger().setLevel(logging.WARNING)
+    app.startup()
+
+
+def drive(brokerPort, httpPort, seconds, rate):
+    """
+    Publish timer messages and make HTTP requests for seconds
+    """
+    import fakes
+    fakes.install(("rgbmatrix", "agt", "netifaces"))
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(client_id="bench-runtime")
+    client.connect("127.0.0.1", brokerPort)
+    client.loop_start()
+    topic = "yukon/device/alexa/kitchen/%s/display/timers" % os.uname().nodename
+    deadline = time.monotonic() + seconds
+    count = 0
+    while time.monotonic() < deadline:
+        now = time.time()
+        timers = [{"id": "t%d" % i, "deviceName": "kitchen", "expireTime": iso_time(now + 60 + 30 * i + count % 7)}
+                  for i in range(3)]
+        client.publish(topic, json.dumps({"timers": timers, "published": now}))
+        if count % 2 == 0:
+            for path in ("/metrics", "/"):
+                try:
+                    urllib.request.urlopen("http://127.0.0.1:%d%s" % (httpPort, path), timeout=2).read()
+                except OSError:
+                    pass
+        count += 1
+        time.sleep(1.0 / rate)
+    client.loop_stop()
+    client.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Threaded vs single event loop runtime")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--rate", type=float, default=20, help="timer messages per second")
+    parser.add_argument("--child", choices=RUNTIMES, help=argparse.SUPPRESS)
+    parser.add_argument("--broker-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--http-port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Sample a little longer than the load lasts
+        child(args.child, args.broker_port, args.http_port, args.seconds + 1)
+        return
+
+    brokerPort = free_port()
+    broker = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "mqtt_broker.py"),
+                               "--port", str(brokerPort)], stdout=subprocess.DEVNULL)
+    results = []
+    try:
+        wait_for_port(brokerPort)
+        for runtime in RUNTIMES:
+            httpPort = free_port()
+            process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", runtime,
+                                        "--broker-port", str(brokerPort), "--http-port", str(httpPort),
+                                        "--seconds", str(args.seconds)],
+                                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            line = process.stdout.readline()
+            if line.strip() != "READY":
+                process.kill()
+                raise RuntimeError("%s runtime did not start: %r" % (runtime, line))
+            wait_for_port(httpPort)
+            drive(brokerPort, httpPort, args.seconds, args.rate)
+            results.append(json.loads(process.stdout.readline()))
+            process.wait()
+    finally:
+        broker.terminate()
+        broker.wait()
+
+    print("%-8s %8s %8s %9s %9s %7s %12s" % ("runtime", "threads", "peak", "RSS MiB", "peak MiB",
+          "frames", "p50/p99 ms"))
+    for result in results:
+        latency = result["latency"]
+        print("%-8s %8d %8d %9.1f %9.1f %7d %12s" % (result["runtime"], result["idle_threads"],
+              result["peak_threads"], result["idle_rss"] / 1048576.0, result["peak_rss"] / 1048576.0,
+              result["frames"], "%.1f/%.1f" % (latency["local"]["p50"], latency["local"]["p99"])
+              if latency else "-"))
+    for result in results:
+        print("%s threads at the end: %s" % (result["runtime"], ", ".join(result["thread_names"])))
+
+
+if __name__ == "__main__":
+    main()
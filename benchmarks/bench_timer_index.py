@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+#
+# Benchmark the cost of a single timer update with thousands of timers
+#
+# Compares the previous approach (dict + sorted() on every update and a list
+# comprehension filter on every render tick) with TimerIndex, one timer
+# changed at a time with set() and in a full list with update_all(), and a
+# full list with every timer changed.
+#
+# Usage: python3 benchmarks/bench_timer_index.py
+#
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timer_index import MQTT, Timer, TimerIndex
+
+SIZES = [10, 100, 1000, 5000, 10000]
+UPDATES = 2000
+
+
+def make_timers(count):
+    now = time.time()
+    return {"timer-%d" % i: now + random.randint(60, 36000) for i in range(count)}
+
+
+def bench_sorted(timers, updates):
+    ids = list(timers)
+    now = time.time()
+    start = time.perf_counter()
+    for i in range(updates):
+        timers[random.choice(ids)] = now + random.randint(60, 36000)
+        sorted_timers = sorted(timers.items(), key=lambda kv: (kv[1], kv[0]))
+        # What ManageTimers.filter_timers did on each render tick
+        sorted_timers[:] = [x for x in sorted_timers if x[1] > now - 15]
+        sorted_timers[:2]
+    return (time.perf_counter() - start) / updates
+
+
+def records(timers):
+    return [Timer(timer_id, MQTT, expire_time) for timer_id, expire_time in timers.items()]
+
+
+def bench_index(timers, updates):
+    index = TimerIndex()
+    index.update_all(records(timers))
+    ids = list(timers)
+    now = time.time()
+    start = time.perf_counter()
+    for i in range(updates):
+        index.set(Timer(random.choice(ids), MQTT, now + random.randint(60, 36000)))
+        index.expire(now - 15)
+        index.peek(2)
+    return (time.perf_counter() - start) / updates
+
+
+def bench_update_all(timers, updates, changed):
+    """
+    Full list MQTT update where changed timers (a count, or a fraction of
+    them if a float) changed per message.  TimersFromMqtt builds the
+    records while parsing each message, so that is not timed here, the
+    same as sorted() above is not timed building its dict.
+    """
+    index = TimerIndex()
+    index.update_all(records(timers))
+    ids = list(timers)
+    if isinstance(changed, float):
+        changed = max(1, int(len(ids) * changed))
+    now = time.time()
+    updates = max(1, updates // 10)
+    elapsed = 0
+    for i in range(updates):
+        timers_map = dict(timers)
+        for timer_id in random.sample(ids, changed):
+            timers_map[timer_id] = now + random.randint(60, 36000)
+        message = records(timers_map)
+        start = time.perf_counter()
+        index.update_all(message)
+        index.peek(2)
+        elapsed += time.perf_counter() - start
+    return elapsed / updates
+
+
+def main():
+    random.seed(1)
+    print("%8s %16s %16s %16s %16s" % ("timers", "sorted (us)", "index (us)", "update_all (us)",
+                                        "all changed (us)"))
+    for size in SIZES:
+        timers = make_timers(size)
+        old = bench_sorted(dict(timers), UPDATES)
+        new = bench_index(dict(timers), UPDATES)
+        full = bench_update_all(dict(timers), UPDATES, 1)
+        rebuild = bench_update_all(dict(timers), UPDATES, 1.0)
+        print("%8d %16.2f %16.2f %16.2f %16.2f" % (size, old * 1e6, new * 1e6, full * 1e6, rebuild * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#
+# Memory per timer of the Timer record and the cost of filtering by room
+#
+# Compares the slotted Timer with the same fields held in a dict (the shape
+# of the MQTT payload), a plain class and a namedtuple, measured with
+# tracemalloc.  Then the whole TimerIndex per timer, and getting one room's
+# timers with the device index against scanning all timers.
+#
+# Usage: python3 benchmarks/bench_timer_record.py [--timers 10000] [--rooms 10]
+#
+import argparse
+import collections
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timer_index import MQTT, Timer, TimerIndex
+
+FIELDS = ("id", "source", "device", "label", "expire", "created", "type")
+TimerTuple = collections.namedtuple("TimerTuple", FIELDS)
+LOOKUPS = 2000
+
+
+class TimerClass:
+    """
+    Timer without __slots__
+    """
+
+    def __init__(self, timer_id, source, device, label, expire, created, timer_type):
+        self.id = timer_id
+        self.source = source
+        self.device = device
+        self.label = label
+        self.expire = expire
+        self.created = created
+        self.type = timer_type
+
+
+def timer_fields(count, rooms):
+    now = time.time()
+    # Device names arrive as new strings in every message
+    return [("timer-%d" % i, MQTT, "room-%d" % (i % rooms), "pasta" if i % 4 == 0 else None,
+             now + random.randint(60, 36000), now, "TIMER") for i in range(count)]
+
+
+def measure(make, fields):
+    """
+    Bytes allocated per timer to hold the records made from fields
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = [make(*timer) for timer in fields]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # The list holding the records is not part of a record
+    return (after - before - sys.getsizeof(records)) / len(fields)
+
+
+def make_dict(timer_id, source, device, label, expire, created, timer_type):
+    return {"id": timer_id, "source": source, "deviceName": device, "label": label,
+            "expireTime": expire, "created": created, "type": timer_type}
+
+
+def make_timer(timer_id, source, device, label, expire, created, timer_type):
+    return Timer(timer_id, source, expire, device, label, created, timer_type)
+
+
+def index_bytes(fields):
+    records = [make_timer(*timer) for timer in fields]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    index = TimerIndex()
+    index.update_all(records)
+    index.peek(2)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(fields), index
+
+
+def time_lookups(lookup, rooms):
+    start = time.perf_counter()
+    for i in range(LOOKUPS):
+        lookup("room-%d" % (i % rooms))
+    return (time.perf_counter() - start) / LOOKUPS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Timer record memory and room filtering")
+    parser.add_argument("--timers", type=int, default=10000)
+    parser.add_argument("--rooms", type=int, default=10)
+    args = parser.parse_args()
+    random.seed(1)
+
+    fields = timer_fields(args.timers, args.rooms)
+    print("%d timers in %d rooms\n" % (args.timers, args.rooms))
+    print("%-24s %14s" % ("record", "bytes/timer"))
+    for name, make in (("dict", make_dict), ("class", TimerClass), ("namedtuple", TimerTuple),
+                       ("Timer (__slots__)", make_timer)):
+        print("%-24s %14.1f" % (name, measure(make, fields)))
+
+    perTimer, index = index_bytes(fields)
+    print("%-24s %14.1f" % ("TimerIndex with Timers", perTimer))
+
+    def scan(device):
+        return [timer for timer in index.sorted_records() if timer.device == device]
+
+    scanTime = time_lookups(scan, args.rooms)
+    indexTime = time_lookups(index.device_timers, args.rooms)
+    print("\n%-24s %14s" % ("timers in one room", "us/lookup"))
+    print("%-24s %14.2f" % ("scan all timers", scanTime * 1e6))
+    print("%-24s %14.2f" % ("device index", indexTime * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# Micro-benchmark of expireTime / scheduledTime parsing
+#
+# Reports parse throughput of timestamp_parser.parse_timestamp and of
+# dateutil.parser.parse (when dateutil is installed), and the import
+# time of each module measured in a fresh interpreter.
+#
+# Usage: python3 benchmarks/bench_timestamp_parser.py
+#
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from timestamp_parser import parse_timestamp
+
+SAMPLES = [
+    "2020-10-03T12:46:12-0600",
+    "2020-10-03T12:47:30-0600",
+    "2020-02-11T02:00:00-07:00",
+    "2020-02-11T09:00:00+0000",
+    "2020-02-11T09:00:00.000Z",
+]
+ITERATIONS = 20000
+
+
+def throughput(parse):
+    start = time.perf_counter()
+    for i in range(ITERATIONS):
+        for sample in SAMPLES:
+            parse(sample)
+    elapsed = time.perf_counter() - start
+    return ITERATIONS * len(SAMPLES) / elapsed
+
+
+def import_time(module):
+    """
+    Seconds to import a module in a fresh interpreter.  logging and re are
+    imported first since the app has always loaded them anyway.
+    """
+    code = ("import logging, re, time; t = time.perf_counter(); import %s; "
+            "print(time.perf_counter() - t)" % module)
+    best = None
+    for i in range(5):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, universal_newlines=True)
+        if out.returncode != 0:
+            return None
+        value = float(out.stdout.strip())
+        best = value if best is None else min(best, value)
+    return best
+
+
+def main():
+    try:
+        import dateutil.parser
+        dateutil_parse = lambda text: dateutil.parser.parse(text).timestamp()
+        for sample in SAMPLES:
+            assert abs(parse_timestamp(sample) - dateutil_parse(sample)) < 1e-6, sample
+    except ImportError:
+        dateutil_parse = None
+
+    print("%-18s %16s %14s" % ("parser", "parses/second", "import (ms)"))
+    fast_import = import_time("timestamp_parser")
+    print("%-18s %16.0f %14.2f" % ("timestamp_parser", throughput(parse_timestamp), fast_import * 1000))
+    if dateutil_parse is not None:
+        slow_import = import_time("dateutil.parser")
+        print("%-18s %16.0f %14.2f" % ("dateutil", throughput(dateutil_parse), slow_import * 1000))
+    else:
+        print("%-18s %16s %14s" % ("dateutil", "not installed", "-"))
+
+
+if __name__ == "__main__":
+    main()
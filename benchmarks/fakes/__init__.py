@@ -0,0 +1,52 @@
+#
+# Fake rgbmatrix, agt, paho and netifaces modules for running benchmarks
+# on a plain Linux box without a Pi, a matrix panel, a paired Echo or an
+# MQTT broker.
+#
+# Usage, before importing any of the app modules:
+#
+#   import fakes
+#   fakes.install()
+#
+import os
+import sys
+
+FAKES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Top level modules provided here
+MODULES = ("rgbmatrix", "agt", "paho", "netifaces")
+
+
+def install(modules = MODULES):
+    """
+    Put the fakes ahead of any installed modules of the same name.  Only
+    the given top level modules are faked, for example everything but paho
+    to run against a real broker.
+    """
+    if FAKES_DIR not in sys.path:
+        sys.path.insert(0, FAKES_DIR)
+    for name in list(sys.modules):
+        if name.split(".")[0] in modules and not getattr(sys.modules[name], "FAKE", False):
+            del sys.modules[name]
+    for name in MODULES:
+        if name not in modules:
+            _prefer_installed(name)
+
+
+def _prefer_installed(name):
+    """
+    Import the installed module now, skipping the fakes directory, so later
+    imports use it.  Left to fail on first use if it is not installed.
+    """
+    module = sys.modules.get(name)
+    if module is not None and not getattr(module, "FAKE", False):
+        return
+    for key in [key for key in sys.modules if key.split(".")[0] == name]:
+        del sys.modules[key]
+    sys.path.remove(FAKES_DIR)
+    try:
+        __import__(name)
+    except ImportError:
+        pass
+    finally:
+        sys.path.insert(0, FAKES_DIR)
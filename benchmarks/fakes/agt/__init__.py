@@ -0,0 +1,14 @@
+#
+# Fake agt (Alexa Gadgets Toolkit).  AlexaGadget does not open Bluetooth;
+# benchmarks call the directive handlers directly.
+#
+FAKE = True
+
+
+class AlexaGadget:
+
+    def __init__(self, gadget_config_path = None):
+        self.gadget_config_path = gadget_config_path
+
+    def main(self):
+        pass
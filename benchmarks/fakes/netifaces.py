@@ -0,0 +1,10 @@
+#
+# Fake netifaces: every interface has the loopback address
+#
+FAKE = True
+
+AF_INET = 2
+
+
+def ifaddresses(name):
+    return {AF_INET: [{"addr": "127.0.0.1", "netmask": "255.0.0.0"}]}
@@ -0,0 +1 @@
+FAKE = True
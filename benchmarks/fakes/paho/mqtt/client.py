@@ -0,0 +1,95 @@
+#
+# Fake paho.mqtt.client.  Nothing is sent over the network: publish()
+# records messages and deliver() runs the matching callbacks in the
+# calling thread, the way the paho network loop would.
+#
+FAKE = True
+
+import time
+
+
+class MQTTMessage:
+
+    def __init__(self, topic, payload, qos = 0, retain = False):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.mid = 0
+        # paho stamps messages with time.monotonic() when they are read
+        self.timestamp = time.monotonic()
+
+
+def topic_matches_sub(sub, topic):
+    subLevels = sub.split("/")
+    topicLevels = topic.split("/")
+    for i, level in enumerate(subLevels):
+        if level == "#":
+            return True
+        if i >= len(topicLevels) or (level != "+" and level != topicLevels[i]):
+            return False
+    return len(subLevels) == len(topicLevels)
+
+
+class Client:
+
+    def __init__(self, client_id = "", clean_session = None, userdata = None, protocol = 4, transport = "tcp"):
+        self.client_id = client_id
+        self.userdata = userdata
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.callbacks = []
+        self.subscriptions = []
+        # (topic, payload, qos, retain) of every publish
+        self.published = []
+
+    def enable_logger(self, logger = None):
+        pass
+
+    def reconnect_delay_set(self, min_delay = 1, max_delay = 120):
+        pass
+
+    def max_queued_messages_set(self, queue_size):
+        pass
+
+    def will_set(self, topic, payload = None, qos = 0, retain = False):
+        pass
+
+    def username_pw_set(self, username, password = None):
+        pass
+
+    def message_callback_add(self, sub, callback):
+        self.callbacks.append((sub, callback))
+
+    def connect_async(self, host, port = 1883, keepalive = 60):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def subscribe(self, topic, qos = 0):
+        self.subscriptions.append((topic, qos))
+        return (0, len(self.subscriptions))
+
+    def publish(self, topic, payload = None, qos = 0, retain = False):
+        self.published.append((topic, payload, qos, retain))
+
+    def deliver(self, topic, payload):
+        """
+        Deliver a message as if it arrived from the broker
+        """
+        msg = MQTTMessage(topic, payload)
+        matched = False
+        for sub, callback in self.callbacks:
+            if topic_matches_sub(sub, topic):
+                callback(self, self.userdata, msg)
+                matched = True
+        if not matched and self.on_message is not None:
+            self.on_message(self, self.userdata, msg)
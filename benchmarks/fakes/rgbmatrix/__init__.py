@@ -0,0 +1,78 @@
+#
+# Fake rgbmatrix.  Canvases are RGB byte buffers and SwapOnVSync returns
+# immediately, counting swaps.
+#
+FAKE = True
+
+from . import graphics
+
+
+class RGBMatrixOptions:
+
+    def __init__(self):
+        self.rows = 32
+        self.cols = 64
+        self.chain_length = 1
+        self.parallel = 1
+
+
+class FrameCanvas:
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(width * height * 3)
+        self.set_pixel_calls = 0
+
+    def Clear(self):
+        self.pixels[:] = bytes(len(self.pixels))
+
+    def Fill(self, r, g, b):
+        self.pixels[:] = bytes((r, g, b)) * (self.width * self.height)
+
+    def SetPixel(self, x, y, r, g, b):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.set_pixel_calls += 1
+            offset = (y * self.width + x) * 3
+            self.pixels[offset:offset + 3] = bytes((r, g, b))
+
+    def SetImage(self, image, offset_x = 0, offset_y = 0, unsafe = True):
+        imageWidth, imageHeight = image.size
+        data = image.convert("RGB").tobytes()
+        for row in range(imageHeight):
+            y = offset_y + row
+            if not 0 <= y < self.height:
+                continue
+            start = max(0, offset_x)
+            end = min(self.width, offset_x + imageWidth)
+            if start >= end:
+                continue
+            source = (row * imageWidth + start - offset_x) * 3
+            target = (y * self.width + start) * 3
+            self.pixels[target:target + (end - start) * 3] = data[source:source + (end - start) * 3]
+
+
+class RGBMatrix:
+
+    def __init__(self, rows = 32, chains = 1, parallel = 1, options = None):
+        if options is None:
+            options = RGBMatrixOptions()
+            options.rows, options.chain_length, options.parallel = rows, chains, parallel
+        self.options = options
+        self.width = options.cols * options.chain_length
+        self.height = options.rows * options.parallel
+        self.brightness = 100
+        self.swaps = 0
+        self.canvas = FrameCanvas(self.width, self.height)
+
+    def CreateFrameCanvas(self):
+        return FrameCanvas(self.width, self.height)
+
+    def SwapOnVSync(self, canvas, framerate_fraction = 1):
+        self.swaps += 1
+        previous = self.canvas
+        self.canvas = canvas
+        return previous
+
+    def Clear(self):
+        self.canvas.Clear()
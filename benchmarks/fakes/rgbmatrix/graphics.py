@@ -0,0 +1,54 @@
+#
+# Fake rgbmatrix.graphics.  DrawText sets one pixel per lit font pixel,
+# the same work the C++ implementation does.
+#
+FAKE = True
+
+from bdf_font import BdfFont
+
+
+class Color:
+
+    def __init__(self, red = 0, green = 0, blue = 0):
+        self.red = red
+        self.green = green
+        self.blue = blue
+
+
+class Font:
+
+    def __init__(self):
+        self.font = None
+
+    def LoadFont(self, path):
+        self.font = BdfFont(path)
+
+    @property
+    def height(self):
+        return self.font.height
+
+    @property
+    def baseline(self):
+        return self.font.baseline
+
+    def CharacterWidth(self, char):
+        return self.font.glyph(char).device_width
+
+
+def DrawText(canvas, font, x, y, color, text):
+    start = x
+    for char in text:
+        glyph = font.font.glyph(ord(char))
+        top = y - glyph.height - glyph.y_offset
+        for row, spanStart, spanEnd in glyph.spans:
+            for px in range(x + spanStart, x + spanEnd):
+                canvas.SetPixel(px, top + row, color.red, color.green, color.blue)
+        x += glyph.device_width
+    return x - start
+
+
+def DrawLine(canvas, x1, y1, x2, y2, color):
+    steps = max(abs(x2 - x1), abs(y2 - y1), 1)
+    for i in range(steps + 1):
+        canvas.SetPixel(x1 + (x2 - x1) * i // steps, y1 + (y2 - y1) * i // steps,
+                        color.red, color.green, color.blue)
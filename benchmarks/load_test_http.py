@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# HTTP load test for the status server
+#
+# Opens a number of keep-alive connections and sends GET requests as fast
+# as the server answers them, then reports requests per second and
+# latency percentiles.
+#
+# Usage:
+#   python3 benchmarks/load_test_http.py --port 80 --path /v1/userLightStates
+#   python3 benchmarks/load_test_http.py --local
+#
+# --local starts an HttpServer in this process on a free port with a stub
+# app, so the server can be measured without the display or MQTT.
+#
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+async def run_connection(host, port, path, count, latencies, errors):
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        errors.append("connect")
+        return
+    request = ("GET %s HTTP/1.1\r\nHost: %s\r\nConnection: keep-alive\r\n\r\n" % (path, host)).encode()
+    try:
+        for i in range(count):
+            start = time.perf_counter()
+            writer.write(request)
+            header = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            close = False
+            for line in header.split(b"\r\n")[1:]:
+                name, _, value = line.partition(b":")
+                name = name.strip().lower()
+                if name == b"content-length":
+                    length = int(value)
+                elif name == b"connection" and value.strip().lower() == b"close":
+                    close = True
+            if length:
+                await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if not header.startswith(b"HTTP/1.1 200") and not header.startswith(b"HTTP/1.0 200"):
+                errors.append(header.split(b"\r\n")[0].decode())
+            if close:
+                # Server does not keep the connection alive, reconnect
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+    except (OSError, asyncio.IncompleteReadError) as e:
+        errors.append(type(e).__name__)
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, path, connections, requests):
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[run_connection(host, port, path, requests, latencies, errors)
+                           for i in range(connections)])
+    elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def start_local_server():
+    """
+    Start HttpServer in a thread on a free port with a minimal app object
+    """
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import http_request
+
+    class StubApp:
+        manage_timers = None
+        rpi_info = None
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    http_request.HttpServer.PORT = port
+    server = http_request.HttpServer(StubApp())
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    for i in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return port
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load test")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=80)
+    parser.add_argument("--path", default="/v1/userLightStates")
+    parser.add_argument("--connections", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200, help="requests per connection")
+    parser.add_argument("--local", action="store_true", help="start a local HttpServer to test")
+    args = parser.parse_args()
+
+    port = args.port
+    if args.local:
+        port = start_local_server()
+
+    latencies, errors, elapsed = asyncio.run(
+        run_load(args.host, port, args.path, args.connections, args.requests))
+
+    print("requests:     %d" % len(latencies))
+    print("errors:       %d %s" % (len(errors), sorted(set(errors))[:5] if errors else ""))
+    print("requests/sec: %.0f" % (len(latencies) / elapsed))
+    print("p50 latency:  %.2f ms" % (percentile(latencies, 50) * 1000))
+    print("p99 latency:  %.2f ms" % (percentile(latencies, 99) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+#
+# Minimal MQTT 3.1.1 broker for local load tests, no outside network needed
+#
+# Enough of the protocol for paho and mosquitto_pub/sub clients: CONNECT with
+# will, SUBSCRIBE/UNSUBSCRIBE with + and # wildcards, PUBLISH at QoS 0, 1 and
+# 2 from clients, retained messages and PINGREQ.  Messages are delivered to
+# subscribers at QoS 0.  A subscriber that does not keep up has messages
+# dropped once MAX_BUFFER bytes are waiting to be written to it, counted in
+# the stats, the way a broker protects itself from slow consumers.
+#
+# In a thread of the calling process:
+#
+#   broker = MqttBroker()
+#   broker.start()           # listens on 127.0.0.1, broker.port
+#   ...
+#   broker.stop()
+#
+# Or as its own process:  python3 benchmarks/mqtt_broker.py --port 1883
+#
+import argparse
+import asyncio
+import logging
+import struct
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def topic_matches(topicFilter, topic):
+    """
+    True if a topic matches a subscription filter with + and # wildcards
+    """
+    filterLevels = topicFilter.split("/")
+    topicLevels = topic.split("/")
+    # Wildcards do not match topics starting with $
+    if topic.startswith("$") and filterLevels[0] in ("+", "#"):
+        return False
+    for i, level in enumerate(filterLevels):
+        if level == "#":
+            return True
+        if i >= len(topicLevels) or (level != "+" and level != topicLevels[i]):
+            return False
+    return len(filterLevels) == len(topicLevels)
+
+
+def encode_packet(packetType, flags, body):
+    header = bytearray([(packetType << 4) | flags])
+    length = len(body)
+    while True:
+        byte = length % 128
+        length //= 128
+        header.append(byte | 0x80 if length else byte)
+        if not length:
+            break
+    return bytes(header) + body
+
+
+def encode_string(value):
+    return struct.pack(">H", len(value)) + value
+
+
+class BrokerClient():
+    """
+    One connected client
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.clientId = None
+        # topic filter strings
+        self.subscriptions = set()
+        self.will = None
+        self.delivered = 0
+        self.dropped = 0
+        # Largest number of bytes waiting to be written to this client
+        self.maxBuffer = 0
+
+    def send(self, packet, droppable = False):
+        transport = self.writer.transport
+        buffered = transport.get_write_buffer_size()
+        if droppable and buffered > MqttBroker.MAX_BUFFER:
+            self.dropped += 1
+            return False
+        self.writer.write(packet)
+        self.maxBuffer = max(self.maxBuffer, buffered + len(packet))
+        return True
+
+
+class MqttBroker():
+
+    # Bytes queued to a subscriber before its messages are dropped
+    MAX_BUFFER = 1024 * 1024
+
+    def __init__(self, host = "127.0.0.1", port = 0):
+        self.host = host
+        self.port = port
+        self.clients = {}
+        # topic to payload
+        self.retained = {}
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.ready = threading.Event()
+
+    def start(self):
+        """
+        Run the broker in a daemon thread and wait until it is listening
+        """
+        self.thread = threading.Thread(target=self.run, name="mqtt-broker")
+        self.thread.daemon = True
+        self.thread.start()
+        self.ready.wait()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info("MQTT broker listening on %s:%d", self.host, self.port)
+        self.ready.set()
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    def stop(self):
+        if self.loop is not None and self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+    def stats(self):
+        """
+        Message counts since the start, and per client counts of the
+        connected clients by client id
+        """
+        clients = list(self.clients.values())
+        return {
+            "received": self.received,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "clients": dict((client.clientId, {"delivered": client.delivered, "dropped": client.dropped,
+                                               "maxBuffer": client.maxBuffer}) for client in clients)
+        }
+
+    async def handle_connection(self, reader, writer):
+        client = BrokerClient(writer)
+        clean = False
+        try:
+            while True:
+                first = await reader.readexactly(1)
+                length = 0
+                multiplier = 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7f) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length) if length else b""
+                packetType = first[0] >> 4
+                flags = first[0] & 0x0f
+
+                if packetType == CONNECT:
+                    self.connect(client, body)
+                elif client.clientId is None:
+                    break
+                elif packetType == PUBLISH:
+                    self.publish_received(client, flags, body)
+                elif packetType == PUBREL:
+                    client.send(encode_packet(PUBCOMP, 0, body[:2]))
+                elif packetType == SUBSCRIBE:
+                    self.subscribe(client, body)
+                elif packetType == UNSUBSCRIBE:
+                    self.unsubscribe(client, body)
+                elif packetType == PINGREQ:
+                    client.send(encode_packet(PINGRESP, 0, b""))
+                elif packetType == DISCONNECT:
+                    clean = True
+                    break
+                # PUBACK, PUBREC and PUBCOMP are not expected, messages go out at QoS 0
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if client.clientId is not None:
+                if self.clients.get(client.clientId) is client:
+                    del self.clients[client.clientId]
+                # Also when the connection was taken over by a new one with the same id
+                if not clean and client.will is not None:
+                    self.route(*client.will)
+            writer.close()
+
+    def connect(self, client, body):
+        offset = 0
+        nameLength = struct.unpack_from(">H", body, offset)[0]
+        offset += 2 + nameLength
+        level, connectFlags, keepAlive = struct.unpack_from(">BBH", body, offset)
+        offset += 4
+        client.clientId, offset = self.read_string(body, offset)
+        if connectFlags & 0x04:
+            willTopic, offset = self.read_string(body, offset)
+            willPayload, offset = self.read_bytes(body, offset)
+            client.will = (willTopic, willPayload, bool(connectFlags & 0x20))
+        # Username and password are accepted without checking
+        previous = self.clients.get(client.clientId)
+        if previous is not None:
+            previous.writer.close()
+        self.clients[client.clientId] = client
+        client.send(encode_packet(CONNACK, 0, b"\x00\x00"))
+
+    def publish_received(self, client, flags, body):
+        qos = (flags >> 1) & 0x03
+        topic, offset = self.read_string(body, 0)
+        if qos:
+            packetId = body[offset:offset + 2]
+            offset += 2
+            client.send(encode_packet(PUBACK if qos == 1 else PUBREC, 0, packetId))
+        self.received += 1
+        self.route(topic, body[offset:], bool(flags & 0x01))
+
+    def route(self, topic, payload, retain):
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        packet = None
+        for subscriber in list(self.clients.values()):
+            for topicFilter in subscriber.subscriptions:
+                if topic_matches(topicFilter, topic):
+                    if packet is None:
+                        packet = encode_packet(PUBLISH, 0, encode_string(topic.encode("utf-8")) + payload)
+                    if subscriber.send(packet, True):
+                        subscriber.delivered += 1
+                        self.delivered += 1
+                    else:
+                        self.dropped += 1
+                    break
+
+    def subscribe(self, client, body):
+        packetId = body[:2]
+        offset = 2
+        granted = bytearray()
+        newFilters = []
+        while offset < len(body):
+            topicFilter, offset = self.read_string(body, offset)
+            offset += 1
+            client.subscriptions.add(topicFilter)
+            newFilters.append(topicFilter)
+            granted.append(0)
+        client.send(encode_packet(SUBACK, 0, packetId + bytes(granted)))
+        for topic, payload in list(self.retained.items()):
+            if any(topic_matches(topicFilter, topic) for topicFilter in newFilters):
+                client.send(encode_packet(PUBLISH, 0x01, encode_string(topic.encode("utf-8")) + payload))
+
+    def unsubscribe(self, client, body):
+        offset = 2
+        while offset < len(body):
+            topicFilter, offset = self.read_string(body, offset)
+            client.subscriptions.discard(topicFilter)
+        client.send(encode_packet(UNSUBACK, 0, body[:2]))
+
+    def read_bytes(self, body, offset):
+        length = struct.unpack_from(">H", body, offset)[0]
+        return body[offset + 2:offset + 2 + length], offset + 2 + length
+
+    def read_string(self, body, offset):
+        value, offset = self.read_bytes(body, offset)
+        return value.decode("utf-8"), offset
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Minimal MQTT broker for local load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    broker = MqttBroker(args.host, args.port)
+    try:
+        broker.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+#
+# MQTT load generator and local broker harness for Pubsub and TimersFromMqtt
+#
+# Starts a local broker (benchmarks/mqtt_broker.py in its own process, so it
+# does not share the GIL with the app), the app's Pubsub and ManageTimers
+# with a virtual display and the real render thread, then N producers that
+# publish full timer lists to the display's .../timers topic at increasing
+# total rates.  For each rate it reports:
+#
+#   sent/s      messages the producers published
+#   handled/s   messages Pubsub.on_message_update_timers finished
+#   backlog     most messages published but not yet handled at any time
+#   outq        most messages in the Pubsub client's outgoing queue
+#               (limited to 10 by max_queued_messages_set)
+#   dropped     messages never handled, after waiting for the backlog to drain
+#   local ms    update arrival to the frame showing it (p50/p99), see latency_trace
+#   broker ms   producer publish time to arrival (p50/p99)
+#
+# The first rate where handled/s falls below 95% of sent/s or messages are
+# dropped is reported as the saturation point.  Runs with real paho; the
+# display, bluetooth and netifaces modules are faked.
+#
+# Usage:
+#   python3 benchmarks/mqtt_load.py --producers 4 --rates 50,100,200,400,800 --timers 5
+#   python3 benchmarks/mqtt_load.py --broker localhost:1883     # e.g. a local mosquitto
+#   python3 benchmarks/mqtt_load.py --in-process-broker         # broker in a thread
+#
+import argparse
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+os.chdir(ROOT)
+
+# Real paho, everything else faked
+import fakes
+fakes.install(("rgbmatrix", "agt", "netifaces"))
+
+import paho.mqtt.client as mqtt
+
+from display_virtual import DisplayVirtual
+from latency_trace import LatencyTracker
+from manage_timers import ManageTimers
+from mqtt_broker import MqttBroker
+from pubsub import Pubsub, MQTT_HANDLER_SECONDS
+
+# Seconds between backlog samples
+SAMPLE_INTERVAL = 0.02
+# Seconds to wait for the backlog to drain after the producers stop
+DRAIN_TIMEOUT = 10
+SATURATION = 0.95
+
+
+def iso_time(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).astimezone().isoformat(timespec="seconds")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(host, port, timeout = 10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Broker not listening on %s:%d" % (host, port))
+
+
+class Producer():
+    """
+    One simulated Alexa timer producer: publishes the full list of its
+    timers at a fixed rate from its own thread
+    """
+
+    def __init__(self, index, host, port, topic, timers, payload_bytes):
+        self.index = index
+        self.topic = topic
+        self.timers = timers
+        self.payload_bytes = payload_bytes
+        self.sent = 0
+        self.client = mqtt.Client(client_id="load-producer-%d" % index)
+        self.client.connect(host, port, 60)
+        self.client.loop_start()
+
+    def payload(self):
+        now = time.time()
+        message = {
+            "timers": [{"id": "producer-%d-timer-%d" % (self.index, i), "deviceName": "load",
+                        "expireTime": iso_time(now + 600 + 60 * i)} for i in range(self.timers)],
+            "published": now
+        }
+        data = json.dumps(message)
+        if len(data) < self.payload_bytes:
+            message["pad"] = "x" * (self.payload_bytes - len(data) - 10)
+            data = json.dumps(message)
+        return data
+
+    def run(self, rate, duration):
+        interval = 1.0 / rate
+        start = time.monotonic()
+        deadline = start
+        while deadline < start + duration:
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.client.publish(self.topic, self.payload(), qos=0)
+            self.sent += 1
+            deadline += interval
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def handled_count():
+    counts, total = MQTT_HANDLER_SECONDS.labels('timers').snapshot()
+    return sum(counts)
+
+
+def make_app(host, port):
+    app = SimpleNamespace(server=None, startup_time=time.monotonic())
+    app.manage_timers = ManageTimers(app)
+    app.manage_timers.init_bluetooth()
+    app.manage_timers.display = DisplayVirtual()
+    app.manage_timers.display_ready.set()
+
+    # Pubsub reads config.yml from the current directory
+    previous = os.getcwd()
+    configDir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(ROOT, "config_EXAMPLE.yml")) as f:
+            config = f.read().replace("MQTT_SERVER", host).replace("1883", str(port))
+        with open(os.path.join(configDir, "config.yml"), "w") as f:
+            f.write(config)
+        os.chdir(configDir)
+        app.pubsub = Pubsub(app)
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(configDir)
+
+    deadline = time.monotonic() + 10
+    while not app.pubsub.client.is_connected():
+        if time.monotonic() > deadline:
+            raise RuntimeError("Pubsub did not connect to %s:%d" % (host, port))
+        time.sleep(0.05)
+    # Let the subscriptions made in on_connect complete
+    time.sleep(0.5)
+    return app
+
+
+def run_step(app, producers, rate, duration):
+    """
+    Publish at a total rate for duration seconds and measure the ingest
+    """
+    manage_timers = app.manage_timers
+    manage_timers.latency = LatencyTracker()
+    outQueue = getattr(app.pubsub.client, "_out_messages", {})
+
+    sentBefore = sum(producer.sent for producer in producers)
+    handledBefore = handled_count()
+    threads = [threading.Thread(target=producer.run, args=(rate / len(producers), duration))
+               for producer in producers]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+
+    maxBacklog = 0
+    maxOutQueue = 0
+    while any(thread.is_alive() for thread in threads):
+        sent = sum(producer.sent for producer in producers) - sentBefore
+        maxBacklog = max(maxBacklog, sent - (handled_count() - handledBefore))
+        maxOutQueue = max(maxOutQueue, len(outQueue))
+        time.sleep(SAMPLE_INTERVAL)
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    sent = sum(producer.sent for producer in producers) - sentBefore
+    handledInTime = handled_count() - handledBefore
+
+    # Wait for what is still queued, stop when nothing arrives for a second
+    last = handled_count()
+    lastChange = time.monotonic()
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while time.monotonic() < deadline and handled_count() - handledBefore < sent:
+        time.sleep(0.05)
+        if handled_count() != last:
+            last = handled_count()
+            lastChange = time.monotonic()
+        elif time.monotonic() - lastChange > 1:
+            break
+    handled = handled_count() - handledBefore
+
+    latency = manage_timers.latency.summary().get("mqtt", {})
+    return {
+        "rate": rate,
+        "sent_per_sec": sent / elapsed,
+        "handled_per_sec": handledInTime / elapsed,
+        "max_backlog": maxBacklog,
+        "max_out_queue": maxOutQueue,
+        "dropped": max(0, sent - handled),
+        "local": latency.get("local"),
+        "broker": latency.get("broker"),
+    }
+
+
+def format_latency(latency):
+    if not latency:
+        return "-"
+    return "%.1f/%.1f" % (latency["p50"], latency["p99"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MQTT load generator for the timer display")
+    parser.add_argument("--producers", type=int, default=4)
+    parser.add_argument("--rates", default="10,50,100,200,400,800,1600",
+                        help="total messages per second to try, comma separated")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per rate")
+    parser.add_argument("--timers", type=int, default=5, help="timers in each message")
+    parser.add_argument("--payload-bytes", type=int, default=0,
+                        help="pad each message to at least this size")
+    parser.add_argument("--broker", help="HOST:PORT of a running broker instead of starting one")
+    parser.add_argument("--in-process-broker", action="store_true",
+                        help="run the broker in a thread of this process")
+    parser.add_argument("--log-level", default="WARNING",
+                        help="app log level, INFO logs every message like the device does")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stderr, level=args.log_level.upper(),
+                        format='%(asctime)-15s %(threadName)-10s %(levelname)6s %(message)s')
+
+    brokerProcess = None
+    broker = None
+    if args.broker:
+        host, _, port = args.broker.partition(":")
+        port = int(port or 1883)
+    elif args.in_process_broker:
+        broker = MqttBroker()
+        broker.start()
+        host, port = broker.host, broker.port
+    else:
+        host, port = "127.0.0.1", free_port()
+        brokerProcess = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "mqtt_broker.py"),
+                                          "--port", str(port)], stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(host, port)
+        app = make_app(host, port)
+        topic = app.pubsub.queueDeviceUpdateTimers
+        producers = [Producer(i, host, port, topic, args.timers, args.payload_bytes)
+                     for i in range(args.producers)]
+        payloadSize = len(producers[0].payload())
+        print("%d producers -> %s:%d %s, %d timers, %d byte messages, %.0f s per rate\n" % (
+            args.producers, host, port, topic, args.timers, payloadSize, args.duration))
+        print("%7s %9s %10s %8s %6s %8s %13s %13s" % ("rate", "sent/s", "handled/s", "backlog",
+              "outq", "dropped", "local ms", "broker ms"))
+
+        results = []
+        saturation = None
+        for rate in [float(rate) for rate in args.rates.split(",")]:
+            result = run_step(app, producers, rate, args.duration)
+            results.append(result)
+            print("%7.0f %9.1f %10.1f %8d %6d %8d %13s %13s" % (rate, result["sent_per_sec"],
+                  result["handled_per_sec"], result["max_backlog"], result["max_out_queue"],
+                  result["dropped"], format_latency(result["local"]), format_latency(result["broker"])))
+            if saturation is None and (result["dropped"] > 0
+                    or result["handled_per_sec"] < SATURATION * result["sent_per_sec"]):
+                saturation = rate
+
+        if broker is not None:
+            print("\nbroker: %s" % json.dumps({key: value for key, value in broker.stats().items()
+                                               if key != "clients"}))
+        if saturation is None:
+            print("\nNot saturated up to %s messages/s" % args.rates.split(",")[-1])
+        else:
+            print("\nSaturated at %.0f messages/s" % saturation)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"producers": args.producers, "timers": args.timers,
+                           "payload_bytes": payloadSize, "saturation": saturation,
+                           "results": results}, f, indent=2)
+
+        for producer in producers:
+            producer.stop()
+        app.pubsub.shutdown()
+    finally:
+        if brokerProcess is not None:
+            brokerProcess.terminate()
+            brokerProcess.wait()
+        if broker is not None:
+            broker.stop()
+
+
+if __name__ == "__main__":
+    main()
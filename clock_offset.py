@@ -0,0 +1,249 @@
+#
+# Alexa Timer Display
+#
+# clock_offset.py - corrected wall clock for the countdowns
+#
+# A countdown is the expire time minus now.  The Pi has no real time clock,
+# so right after boot, before NTP has synchronized, time.time() can be
+# seconds to hours off.  The correction comes from, in order:
+#
+#   ntp     the kernel clock is synchronized by ntpd or chronyd (read with
+#           adjtimex), time.time() is right to within its estimated error
+#   mqtt    the sender's clock, from the "published" time of timer
+#           messages.  Each message gives the sender's clock less the
+#           broker delay, so the message with the least delay of the recent
+#           SAMPLE_COUNT is the closest.  Its error is estimated from how
+#           much the delay varies, not known until MIN_ERROR_SAMPLES
+#           messages and never less than the published time's resolution
+#           plus a broker round trip
+#   none    time.time() as is
+#
+# The corrected clock is kept relative to time.monotonic(), so NTP stepping
+# time.time() does not move the countdowns.  The first correction, and any
+# change over STEP_SECONDS, is applied at once.  Smaller changes are slewed
+# at SLEW_RATE so no second of a countdown visibly jumps.
+#
+import ctypes
+import ctypes.util
+import logging
+import threading
+import time
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_COUNT = 64
+# Drop samples older than this, the monotonic clock drifts too
+SAMPLE_MAX_AGE = 3600
+STEP_SECONDS = 1.0
+# Seconds of correction per second
+SLEW_RATE = 0.05
+# Seconds between reads of the kernel's NTP state
+NTP_CHECK_SECONDS = 10
+# Messages needed before the mqtt error is estimated, with fewer the spread
+# of their delays says little
+MIN_ERROR_SAMPLES = 4
+# Least delay of a message through the broker, the best sample is off by at least this
+BROKER_ROUND_TRIP = 0.05
+
+# adjtimex clock state and status bit
+TIME_ERROR = 5
+STA_UNSYNC = 0x0040
+
+CLOCK_OFFSET_SECONDS = metrics.gauge('alexa_clock_offset_seconds',
+    'Correction added to the Pi clock for the countdowns')
+CLOCK_ERROR_SECONDS = metrics.gauge('alexa_clock_error_seconds',
+    'Estimated error of the corrected clock, NaN if unknown')
+
+
+class _Timeval(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_usec", ctypes.c_long)]
+
+
+class _Timex(ctypes.Structure):
+    """
+    struct timex from <sys/timex.h>
+    """
+    _fields_ = [
+        ("modes", ctypes.c_uint),
+        ("offset", ctypes.c_long),
+        ("freq", ctypes.c_long),
+        ("maxerror", ctypes.c_long),
+        ("esterror", ctypes.c_long),
+        ("status", ctypes.c_int),
+        ("constant", ctypes.c_long),
+        ("precision", ctypes.c_long),
+        ("tolerance", ctypes.c_long),
+        ("time", _Timeval),
+        ("tick", ctypes.c_long),
+        ("ppsfreq", ctypes.c_long),
+        ("jitter", ctypes.c_long),
+        ("shift", ctypes.c_int),
+        ("stabil", ctypes.c_long),
+        ("jitcnt", ctypes.c_long),
+        ("calcnt", ctypes.c_long),
+        ("errcnt", ctypes.c_long),
+        ("stbcnt", ctypes.c_long),
+        ("tai", ctypes.c_int),
+        ("padding", ctypes.c_int * 11),
+    ]
+
+
+_libc = None
+
+
+def read_ntp_state():
+    """
+    The kernel clock's NTP state as (synchronized, estimated error seconds,
+    maximum error seconds), or None if adjtimex is not available
+    """
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            _libc.adjtimex
+        except (OSError, AttributeError):
+            logger.info("adjtimex not available, NTP state unknown")
+            _libc = False
+    if not _libc:
+        return None
+    # modes 0 only reads the state
+    timex = _Timex()
+    state = _libc.adjtimex(ctypes.byref(timex))
+    if state < 0:
+        return None
+    synchronized = state != TIME_ERROR and not timex.status & STA_UNSYNC
+    return synchronized, timex.esterror / 1e6, timex.maxerror / 1e6
+
+
+class ClockOffset:
+    """
+    The corrected clock, see above.  wall, monotonic and ntp_state default
+    to time.time, time.monotonic and read_ntp_state.
+    """
+
+    def __init__(self, wall = time.time, monotonic = time.monotonic, ntp_state = read_ntp_state):
+        self.wall = wall
+        self.monotonic = monotonic
+        self.ntp_state = ntp_state
+        self.lock = threading.Lock()
+        # (monotonic arrival, sender's clock minus monotonic) of recent messages
+        self.samples = deque(maxlen=SAMPLE_COUNT)
+        # Resolution of the published times, 1 s until a sender sends fractions
+        self.resolution = 1.0
+        # (sender's clock minus monotonic, error or None) from the samples, None if not known
+        self.estimate = None
+        # Corrected clock minus monotonic, None until first used
+        self.base = None
+        self.baseTime = None
+        self.ntp = None
+        self.ntpChecked = None
+        self.source = "none"
+        self.error = None
+
+    def add_sample(self, published, arrival):
+        """
+        A message published at the sender's wall clock time published (epoch
+        seconds) arrived at time.monotonic() arrival.  Retained messages are
+        not samples, they may have been published long before.
+        """
+        with self.lock:
+            self.samples.append((arrival, published - arrival))
+            if published != int(published):
+                self.resolution = 0.001
+            self.estimate = None
+
+    def now(self):
+        """
+        Corrected time.time()
+        """
+        with self.lock:
+            monotonic = self.monotonic()
+            self._update(monotonic)
+            return monotonic + self.base
+
+    def offset(self):
+        """
+        Seconds added to time.time() for the countdowns
+        """
+        with self.lock:
+            monotonic = self.monotonic()
+            self._update(monotonic)
+            return self.base - (self.wall() - monotonic)
+
+    def error_estimate(self):
+        """
+        Estimated error of the corrected clock in seconds, NaN if not known
+        """
+        with self.lock:
+            self._update(self.monotonic())
+            return self.error if self.error is not None else float('nan')
+
+    def status(self):
+        with self.lock:
+            monotonic = self.monotonic()
+            self._update(monotonic)
+            wallBase = self.wall() - monotonic
+            estimate = self._estimate(monotonic)
+            ntp = self.ntp
+            return {
+                "source": self.source,
+                "offset": self.base - wallBase,
+                "error": self.error,
+                "ntpSynchronized": ntp[0] if ntp is not None else None,
+                "ntpEstimatedError": ntp[1] if ntp is not None else None,
+                "ntpMaxError": ntp[2] if ntp is not None else None,
+                "mqttOffset": estimate[0] - wallBase if estimate is not None else None,
+                "mqttSamples": len(self.samples),
+            }
+
+    def _update(self, monotonic):
+        """
+        Move the corrected clock towards the current best estimate
+        """
+        target = self._target(monotonic)
+        if self.base is None or abs(target - self.base) > STEP_SECONDS:
+            if self.base is not None:
+                logger.info("Clock correction stepped %.3f seconds, source %s", target - self.base, self.source)
+            self.base = target
+        else:
+            limit = SLEW_RATE * (monotonic - self.baseTime)
+            self.base += max(-limit, min(limit, target - self.base))
+        self.baseTime = monotonic
+
+    def _target(self, monotonic):
+        if self.ntpChecked is None or monotonic - self.ntpChecked >= NTP_CHECK_SECONDS:
+            self.ntpChecked = monotonic
+            self.ntp = self.ntp_state()
+        wallBase = self.wall() - monotonic
+        if self.ntp is not None and self.ntp[0]:
+            self.source = "ntp"
+            self.error = self.ntp[1]
+            return wallBase
+        estimate = self._estimate(monotonic)
+        if estimate is not None:
+            self.source = "mqtt"
+            self.error = estimate[1]
+            return estimate[0]
+        self.source = "none"
+        self.error = None
+        return wallBase
+
+    def _estimate(self, monotonic):
+        samples = self.samples
+        while samples and samples[0][0] < monotonic - SAMPLE_MAX_AGE:
+            samples.popleft()
+            self.estimate = None
+        if self.estimate is None and samples:
+            values = sorted(value for arrival, value in samples)
+            best = values[-1]
+            error = None
+            if len(values) >= MIN_ERROR_SAMPLES:
+                # How much the broker delay varies, the best may still be off by about as much
+                error = max(best - values[len(values) // 2], self.resolution + BROKER_ROUND_TRIP)
+            self.estimate = (best, error)
+        elif not samples:
+            self.estimate = None
+        return self.estimate
@@ -15,10 +15,30 @@ import sys
 
 from rgbmatrix import graphics, RGBMatrix, RGBMatrixOptions
 
+from font_atlas import load_font, subset_bdf
+from frame_cache import FrameCache
+import metrics
+from panel_layout import PanelLayout, PANEL_WIDTH, PANEL_HEIGHT, PRIMARY
+from timer_text import FONT_PATH, FONT_SMALL_PATH, TIMER_CODEPOINTS, DISPLAY_CODEPOINTS, \
+    PRIMARY_COLOR, SECONDARY_COLOR, format_time_remaining, time_until_change
+
+# PIL is only needed to blit cached frames.  Without it, text is always drawn with graphics.DrawText
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 logger = logging.getLogger(__name__)
 
+SWAP_SECONDS = metrics.histogram('alexa_display_swap_seconds', 'Time spent in SwapOnVSync for a timer frame')
+PANEL_REDRAWS = metrics.counter('alexa_display_panel_redraws_total', 'Timer panels redrawn')
+
 class DisplayAdafruitHat():
-    def __init__(self):
+    def __init__(self, chain_length = 1, parallel = 1):
+        """
+        chain_length and parallel are the number of 64x32 panels daisy
+        chained and on parallel chains, as in RGBMatrixOptions
+        """
         print("__init__")
 
         options = RGBMatrixOptions()
@@ -26,8 +46,8 @@ class DisplayAdafruitHat():
         options.rows = 32
         options.cols = 64
 
-        options.chain_length = 1
-        options.parallel = 1
+        options.chain_length = chain_length
+        options.parallel = parallel
         options.row_address_type = 0
         options.multiplexing = 0
         options.pwm_bits = 11
@@ -45,6 +65,16 @@ class DisplayAdafruitHat():
         self.matrix = RGBMatrix(options = options)
 
         self.offscreen_canvas = self.matrix.CreateFrameCanvas()
+        self.layout = PanelLayout(chain_length, parallel)
+        self.timer_capacity = self.layout.timer_capacity
+        # Text of the frame currently on the display, used to skip identical redraws
+        self.last_frame = None
+        # SwapOnVSync alternates between two canvases.  Panel texts drawn on
+        # each, indexed by swap count parity, so only changed panels are redrawn.
+        # None if the canvas holds something else.
+        self.swaps = 0
+        self.canvas_panels = [None, None]
+        self.blackColor = graphics.Color(0, 0, 0)
         self.font = graphics.Font()
         self.fontSmall = graphics.Font()
 
@@ -53,103 +83,127 @@ class DisplayAdafruitHat():
         #self.font.LoadFont("../../../fonts/10x20.bdf")
         #self.font.LoadFont("ibm-vio-12x20-r-iso10646-1-20.bdf")
 
-        self.fontSmall.LoadFont("fonts/ibm-vio-6x10-r-iso10646-1-10-modified.bdf")
-        self.font.LoadFont("fonts/ibm-vio-12x30-r-iso10646-1-30-modified.bdf")
+        # Subsets hold only the glyphs drawn, rgbmatrix parses the full fonts much slower
+        self.fontSmall.LoadFont(subset_bdf(FONT_SMALL_PATH, DISPLAY_CODEPOINTS))
+        self.font.LoadFont(subset_bdf(FONT_PATH, DISPLAY_CODEPOINTS))
         #self.font.LoadFont("fonts/ibm-vio-10x21-r-iso10646-1-21.bdf")
         #self.font.LoadFont("fonts/ibm-vio-12x22-r-iso10646-1-22-modified.bdf")
         #self.font.LoadFont("../../../fonts/helvR12.bdf")
         self.matrix.brightness = 100 
         #self.textColor = graphics.Color(255, 0, 0)
+        self.textColor = graphics.Color(*PRIMARY_COLOR)
+        self.textColorSecondary = graphics.Color(*SECONDARY_COLOR)
+
+        # Cache of pre-rendered panel frames shown more than once, each blitted with a single SetImage
+        self.frame_cache = None
+        if Image is not None:
+            self.frameFont = load_font(FONT_PATH, TIMER_CODEPOINTS)
+            self.frameFontSmall = load_font(FONT_SMALL_PATH, TIMER_CODEPOINTS)
+            self.frame_cache = FrameCache(PANEL_WIDTH, PANEL_HEIGHT,
+                lambda buffer: Image.frombytes("RGB", (PANEL_WIDTH, PANEL_HEIGHT), bytes(buffer)))
         logger.info("display adafruit hat init complete")
 
 
     def display_time_remaining(self, primary_time_remaining, secondary_time_remaining = None):
-
-       
-        self.offscreen_canvas.Clear()
- 
-        # Set the default Y offset for primary timer to middle of display
-        outTextPrimaryYOffset = 27
-
-        # Display Secondary timer (if one is set)
+        """
+        Draw the timers.  Returns False if the frame is identical to the one
+        already on the display and nothing was drawn.
+        """
+        remaining = [primary_time_remaining]
         if secondary_time_remaining is not None:
-            outTextSecondary = self.format_time_remaining(secondary_time_remaining, True)
-            #outTextSecondary = " " + outTextSecondary
-            textColor = graphics.Color(128, 0, 0)
-            graphics.DrawText(self.offscreen_canvas, self.fontSmall, 4, 31, textColor, outTextSecondary)
-            # We change the Y offset of primary timer to top of display to leave room for secondary timer
-            outTextPrimaryYOffset = 22
-
-        # Display Primary Timer
-        outTextPrimary = self.format_time_remaining(primary_time_remaining)
-        textColor = graphics.Color(255, 0, 0)
-        graphics.DrawText(self.offscreen_canvas, self.font, 2, outTextPrimaryYOffset, textColor, outTextPrimary)
-        
+            remaining.append(secondary_time_remaining)
+        return self.display_timers(remaining)
+
+    def display_timers(self, remaining_list):
+        """
+        Draw up to timer_capacity timers, two per panel.  Only panels whose
+        text differs from what is on the offscreen canvas are redrawn.
+        Returns False if nothing changed on the display.
+        """
+        texts = self.layout.panel_texts(remaining_list)
+        frame = tuple(texts)
+        if frame == self.last_frame:
+            return False
+        self.last_frame = frame
+
+        canvas = self.offscreen_canvas
+        parity = self.swaps % 2
+        for index in self.layout.dirty_panels(texts, self.canvas_panels[parity]):
+            x, y = self.layout.panels[index]
+            self.draw_panel(canvas, x, y, self.layout.runs(texts[index]))
+            PANEL_REDRAWS.inc()
+        self.canvas_panels[parity] = texts
+
+        swapStart = time.perf_counter()
+        self.swap()
+        SWAP_SECONDS.observe(time.perf_counter() - swapStart)
+        return True
+
+    def draw_panel(self, canvas, x, y, runs):
+        """
+        Draw one panel's text runs (role, x, y, text) with its top left corner at x, y
+        """
+        if self.frame_cache is not None:
+            frameRuns = tuple((self.frameFont if role == PRIMARY else self.frameFontSmall, runX, runY,
+                               PRIMARY_COLOR if role == PRIMARY else SECONDARY_COLOR, text)
+                              for role, runX, runY, text in runs)
+            # Frames shown for the first time are drawn with the native DrawText below,
+            # only frames shown again are rendered and blitted from the cache
+            image = self.frame_cache.get_frame(frameRuns, render_first=False)
+            if image is not None:
+                canvas.SetImage(image, x, y)
+                return
+
+        if len(self.layout.panels) == 1:
+            canvas.Clear()
+        else:
+            for row in range(y, y + PANEL_HEIGHT):
+                graphics.DrawLine(canvas, x, row, x + PANEL_WIDTH - 1, row, self.blackColor)
+        for role, runX, runY, text in runs:
+            if role == PRIMARY:
+                graphics.DrawText(canvas, self.font, x + runX, y + runY, self.textColor, text)
+            else:
+                graphics.DrawText(canvas, self.fontSmall, x + runX, y + runY, self.textColorSecondary, text)
+
+    def swap(self):
         self.offscreen_canvas = self.matrix.SwapOnVSync(self.offscreen_canvas)
+        self.swaps += 1
 
-    def format_time_remaining(self, time_remaining, no_flash_colon = False):
-
-        if time_remaining is None:
-            return ""
-
-        halfSecond = (time_remaining % 1) >= 0.5
+    def time_until_next_change(self, remaining_list):
+        """
+        Seconds until display_timers() would draw something different
+        """
+        return self.layout.time_until_change(remaining_list)
 
-        #logger.info("%d seconds left.  halfSecond: %d", time_remaining, halfSecond)
+    def time_until_change(self, time_remaining, no_flash_colon = False):
+        return time_until_change(time_remaining, no_flash_colon)
 
-        # Format the timer digits for display
-        gmtime = time.gmtime(time_remaining)
-
-        hours = gmtime.tm_hour
-        minutes = gmtime.tm_min
-        seconds = gmtime.tm_sec
-
-        # Format Hours
-        hoursStr = str(hours)
-        if (hours < 10):
-            hoursStr = " " + hoursStr
-
-        # Format Minutes
-        minutesStr = str(minutes)
-        if (hours == 0 and minutes == 0):
-            minutesStr = "  "
-        else:
-            minutesStr = str(minutes)
-            if (hours > 0 and minutes < 10):
-                minutesStr = minutesStr.zfill(2)
-            elif (minutes < 10):
-                minutesStr = " " + minutesStr
-
-        # Format Seconds
-        secondsStr = str(seconds).zfill(2)
-
-        # Format time seperator
-        if halfSecond or (time_remaining == 0) or no_flash_colon:
-            sperator = ":" 
-        else:
-            sperator = "~"
-
-        if hours > 0:
-            outText = hoursStr + "\uFEFD" + minutesStr + "\uFEFE"
-        else:
-            outText = minutesStr + sperator + secondsStr
-
-        return outText
+    def format_time_remaining(self, time_remaining, no_flash_colon = False):
+        return format_time_remaining(time_remaining, no_flash_colon)
 
     def clear(self):
         self.show_text("")
 
     def show_text(self, outText, line = 1):
+        self.last_frame = None
+        self.canvas_panels[self.swaps % 2] = None
         self.offscreen_canvas.Clear()
-        textColor = graphics.Color(255, 0, 0)
-        len = graphics.DrawText(self.offscreen_canvas, self.fontSmall, 2, (15*line), textColor, outText)
-        self.offscreen_canvas = self.matrix.SwapOnVSync(self.offscreen_canvas)
+        len = graphics.DrawText(self.offscreen_canvas, self.fontSmall, 2, (15*line), self.textColor, outText)
+        self.swap()
 
-    def scroll_text(self, outText, line = 1, repeat = 1):
-        textColor = graphics.Color(255, 0, 0)
+    def scroll_text(self, outText, line = 1, repeat = 1, stop_event = None):
+        """
+        Scroll text across the display.  Stops early if stop_event is set.
+        """
+        textColor = self.textColor
+        self.last_frame = None
 
         for loop_count in range(repeat):
             pos = self.offscreen_canvas.width
             while True:
+                if stop_event is not None and stop_event.is_set():
+                    return
+                self.canvas_panels[self.swaps % 2] = None
                 self.offscreen_canvas.Clear()
                 len = graphics.DrawText(self.offscreen_canvas, self.fontSmall, pos, (15*line), textColor, outText)
                 pos -= 1
@@ -157,7 +211,7 @@ class DisplayAdafruitHat():
                     #pos = offscreen_canvas.width
                     break
                 time.sleep(0.02)
-                self.offscreen_canvas = self.matrix.SwapOnVSync(self.offscreen_canvas)
+                self.swap()
 
 
     def test(self):
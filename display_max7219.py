@@ -21,12 +21,54 @@ from luma.core.render import canvas
 from luma.core.virtual import viewport
 from luma.core.legacy import text, show_message
 from luma.core.legacy.font import proportional, CP437_FONT, TINY_FONT, SINCLAIR_FONT, LCD_FONT
+from PIL import Image
 
 
 logger = logging.getLogger('display')
 
-# Alexa Gadget code
+# MAX7219 registers
+MAX7219_NOOP = 0x00
+MAX7219_DIGIT_0 = 0x01
+
+WIDTH = 32
+HEIGHT = 8
+
+
+def build_font(font):
+    """
+    Proportional version of a luma legacy font, computed once.  Each glyph
+    is a bytes of columns (bit 0 is the top row) with leading and trailing
+    blank columns trimmed and one blank column of spacing.
+    """
+    font = list(font)
+    # Smaller colon ":"
+    font[0x3a] = [0x00, 0x14, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
+    # Override tilda "~" to use as smaller colon ":" with dots further apart
+    font[0x7e] = [0x00, 0x22, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
+    # Override tilda "~" to use as two pixel wide space
+    #font[0x7e] = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
+
+    glyphs = []
+    for code, bitmap in enumerate(font):
+        if code == 32:
+            # A slim space
+            glyphs.append(bytes(4))
+            continue
+        nonzero = [idx for idx, val in enumerate(bitmap) if val != 0]
+        if nonzero:
+            glyphs.append(bytes(bitmap[nonzero[0]:nonzero[-1] + 1]) + b"\0")
+        else:
+            glyphs.append(b"\0")
+    return tuple(glyphs)
+
+
 class DisplayMax7219():
+    """
+    Four cascaded 8x8 MAX7219 modules.  Frames are drawn into 32 column
+    bytes and only the MAX7219 digit registers that changed since the last
+    frame are written over SPI; modules whose register did not change get a
+    no-op in the same transfer.
+    """
 
     def __init__(self):
         # create matrix device
@@ -34,29 +76,56 @@ class DisplayMax7219():
         self.device = max7219(serial, cascaded=4, block_orientation=90,
                         rotate=0, blocks_arranged_in_reverse_order=False)
         self.device.contrast(16)
-        # Smaller colon ":"
-        LCD_FONT[0x3a] = [0x00, 0x14, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-        # Override tilda "~" to use as smaller colon ":" with dots further apart
-        LCD_FONT[0x7e] = [0x00, 0x22, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-        # Override tilda "~" to use as two pixel wide space
-        #LCD_FONT[0x7e] = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
+        self.font = build_font(LCD_FONT)
+        # Start of each module in the preprocessed image, in SPI chain order (same as luma)
+        self.offsets = [y * self.device.width + x
+                        for y in range(self.device.height - 8, -8, -8)
+                        for x in range(self.device.width - 8, -8, -8)]
+        # Column bytes and register values last written, None if unknown
+        self.last_columns = None
+        self.registers = None
+        # Number of SPI transfers, one per digit register row written
+        self.spiWrites = 0
+        # The primary timer and the presence of a secondary one are shown
+        self.timer_capacity = 2
         print("Created device")
 
 
-    def display_time_remaining(self, time_remaining):
+    def display_time_remaining(self, primary_time_remaining, secondary_time_remaining = None):
+        """
+        Draw the primary timer.  The display is too small for a second timer,
+        so a pixel in the bottom right corner shows there is one.  Returns
+        False if nothing changed on the display.
+        """
+        columns = self.render_text(self.format_time_remaining(primary_time_remaining), 4)
+        if secondary_time_remaining is not None:
+            columns[WIDTH - 1] |= 0x80
+        return self.write_columns(columns)
 
-        halfSecond = (time_remaining % 1) >= 0.5
+    def display_timers(self, remaining_list):
+        secondary = remaining_list[1] if len(remaining_list) > 1 else None
+        return self.display_time_remaining(remaining_list[0], secondary)
+
+    def time_until_next_change(self, remaining_list):
+        return self.time_until_change(remaining_list[0])
 
-        logger.info("%d seconds left.  halfSecond: %d", time_remaining, halfSecond)
+    def format_time_remaining(self, time_remaining, no_flash_colon = False):
+
+        halfSecond = (time_remaining % 1) >= 0.5
 
         # Format the timer digits for display
-        minutes = time.strftime("%M", time.gmtime(time_remaining))
-        seconds = time.strftime("%S", time.gmtime(time_remaining))
-        
-        #hours = datetime.now().strftime('%H')
-        #minutes = datetime.now().strftime('%M')
+        gmtime = time.gmtime(time_remaining)
+        hours = gmtime.tm_hour
+        minutes = "%02d" % gmtime.tm_min
+        seconds = "%02d" % gmtime.tm_sec
 
-        if halfSecond or (minutes == "00" and seconds == "00"):
+        if hours > 0:
+            # Hours mode shows hours and minutes, e.g. "1h05"
+            outText = str(hours) + "h" + minutes
+            # TODO: Update font to remove slash through zero
+            return outText.replace("0", "O")
+
+        if halfSecond or (minutes == "00" and seconds == "00") or no_flash_colon:
             sperator = ":" 
         else:
             sperator = "~"
@@ -71,14 +140,111 @@ class DisplayMax7219():
         seconds = seconds.replace("0", "O")
         minutes = minutes.replace("0", "O")
 
-        outText = minutes + sperator + seconds
-        with canvas(self.device) as draw:
-            text(draw, (4, 1), outText, fill="white", font=alt_proportional(LCD_FONT))
+        return minutes + sperator + seconds
+
+    def time_until_change(self, time_remaining, no_flash_colon = False):
+        """
+        Seconds until the displayed text changes, or None if it will not change
+        """
+        if time_remaining is None or time_remaining <= 0:
+            return None
+        if no_flash_colon:
+            # Only the presence of a secondary timer is shown, not its time
+            return None
+        if time_remaining >= 3600:
+            return (time_remaining % 60) + 0.001
+        return (time_remaining % 0.5) + 0.001
+
+    def render_text(self, outText, x = 0, y = 1):
+        """
+        Column bytes of text drawn at x with its top row at y
+        """
+        textColumns = self.render_text_wide(outText, y)
+        columns = bytearray(WIDTH)
+        start = max(0, -x)
+        end = min(len(textColumns), WIDTH - x)
+        if start < end:
+            columns[x + start:x + end] = textColumns[start:end]
+        return columns
+
+    def write_columns(self, columns):
+        """
+        Show a frame of column bytes.  Returns False if it is already shown.
+        """
+        if columns == self.last_columns:
+            return False
+        self.last_columns = columns
+
+        image = Image.new("1", (WIDTH, HEIGHT))
+        image.putdata([255 if (columns[x] >> y) & 1 else 0 for y in range(HEIGHT) for x in range(WIDTH)])
+        # Applies block_orientation and module order the same way luma does
+        pixels = self.device.preprocess(image).getdata()
+        width = self.device.width
+
+        registers = []
+        for digit in range(8):
+            row = []
+            for offset in self.offsets:
+                byte = 0
+                idx = offset + digit
+                for bit in range(8):
+                    if pixels[idx]:
+                        byte |= 1 << bit
+                    idx += width
+                row.append(byte)
+            registers.append(row)
+
+        for digit, row in enumerate(registers):
+            lastRow = self.registers[digit] if self.registers is not None else None
+            if row == lastRow:
+                continue
+            data = []
+            for module, byte in enumerate(row):
+                if lastRow is not None and lastRow[module] == byte:
+                    data += [MAX7219_NOOP, 0]
+                else:
+                    data += [MAX7219_DIGIT_0 + digit, byte]
+            self.device.data(data)
+            self.spiWrites += 1
+        self.registers = registers
+        return True
+
+    def show_text(self, outText, line = 1):
+        self.write_columns(self.render_text(outText))
+
+    def scroll_text(self, outText, line = 1, repeat = 1, stop_event = None):
+        """
+        Scroll text across the display.  Stops early if stop_event is set.
+        """
+        textColumns = bytearray(WIDTH) + self.render_text_wide(outText) + bytearray(WIDTH)
+        for loop_count in range(repeat):
+            for pos in range(len(textColumns) - WIDTH + 1):
+                if stop_event is not None and stop_event.is_set():
+                    return
+                self.write_columns(bytearray(textColumns[pos:pos + WIDTH]))
+                time.sleep(0.03)
+
+    def render_text_wide(self, outText, y = 1):
+        """
+        Column bytes of text of any width
+        """
+        columns = bytearray()
+        font = self.font
+        for char in outText:
+            code = ord(char)
+            glyph = font[code] if code < len(font) else font[ord('?')]
+            columns += bytes((byte << y) & 0xff for byte in glyph)
+        return columns
+
+    def clear(self):
+        self.off()
 
-        
     def off(self):
         self.device.clear()
         self.device.show()
+        # clear() wrote zeros to every register
+        self.last_columns = bytearray(WIDTH)
+        self.registers = [[0] * len(self.offsets) for digit in range(8)]
 
     def test(self):
 
@@ -112,35 +278,5 @@ class DisplayMax7219():
         # time.sleep(10)
 
 
-class alt_proportional(object):
-    """
-    Wraps an existing font array, and on on indexing, trims any leading
-    or trailing zero column definitions. This works especially well
-    with scrolling messages, as interspace columns are squeezed to a
-    single pixel.
-    """
-    def __init__(self, font):
-        self.font = font
-
-    def __getitem__(self, ascii_code):
-        bitmap = self.font[ascii_code]
-        # Return a slim version of the space character
-        if ascii_code == 32:
-            return [0] * 4
-        #elif ascii_code == 0x7e:
-        #    return [0] * 2
-        else:
-            return self._trim(bitmap) + [0]
-
-    def _trim(self, arr):
-        nonzero = [idx for idx, val in enumerate(arr) if val != 0]
-        if not nonzero:
-            return []
-        first = nonzero[0]
-        last = nonzero[-1] + 1
-        return arr[first:last]
-
-
-
 if __name__ == '__main__':
-    DisplayMax7219().test()
\ No newline at end of file
+    DisplayMax7219().test()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+#
+# Display time on a virtual RGB frame buffer of one or more 64x32 panels
+#
+# Draws the same frames as DisplayAdafruitHat, using the BDF fonts, into a
+# NumPy array instead of the matrix panel.  Used to run the app headless,
+# profile rendering and compare frames pixel for pixel.  Frames can be
+# captured to a directory as PNG or raw RGB files.
+#
+# Needs: sudo pip3 install numpy
+#
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import numpy
+
+from font_atlas import load_font
+from frame_cache import FrameCache
+from panel_layout import PanelLayout, PANEL_WIDTH, PANEL_HEIGHT, PRIMARY
+from timer_text import FONT_PATH, FONT_SMALL_PATH, TIMER_CODEPOINTS, DISPLAY_CODEPOINTS, \
+    PRIMARY_COLOR, SECONDARY_COLOR, format_time_remaining, time_until_change
+
+logger = logging.getLogger(__name__)
+
+
+class DisplayVirtual():
+    """
+    Virtual display.  frame is a (height, width, 3) uint8 array of what is
+    "on the panels", replaced on each redraw.  redraws counts frames drawn
+    and panel_redraws the timer panels drawn for them.
+    """
+
+    # Size of one panel
+    WIDTH = PANEL_WIDTH
+    HEIGHT = PANEL_HEIGHT
+    # Seconds between scroll_text steps, the same as DisplayAdafruitHat
+    SCROLL_DELAY = 0.02
+
+    def __init__(self, capture_dir = None, capture_format = "png", chain_length = 1, parallel = 1):
+        """
+        If capture_dir is given every frame drawn is written there as
+        frame-NNNNNN.png or frame-NNNNNN.rgb (capture_format "png" or "raw").
+        chain_length and parallel arrange panels as on a chained matrix.
+        """
+        if capture_format not in ("png", "raw"):
+            raise ValueError("capture_format must be png or raw: " + capture_format)
+        self.capture_dir = capture_dir
+        self.capture_format = capture_format
+        if capture_dir is not None:
+            os.makedirs(capture_dir, exist_ok=True)
+
+        self.font = load_font(FONT_PATH, TIMER_CODEPOINTS)
+        self.fontSmall = load_font(FONT_SMALL_PATH, DISPLAY_CODEPOINTS)
+
+        self.layout = PanelLayout(chain_length, parallel)
+        self.timer_capacity = self.layout.timer_capacity
+        self.width = self.layout.width
+        self.height = self.layout.height
+        self.frame_cache = FrameCache(PANEL_WIDTH, PANEL_HEIGHT)
+
+        self.lock = threading.Lock()
+        self.frame = numpy.zeros((self.height, self.width, 3), numpy.uint8)
+        # Text of the frame currently on the display, used to skip identical redraws
+        self.last_frame = None
+        # Buffer the timer panels are drawn into and the panel texts it holds,
+        # None if it holds something else
+        self.buffer = self.new_buffer()
+        self.buffer_panels = None
+        self.redraws = 0
+        self.panel_redraws = 0
+        logger.info("display virtual init complete")
+
+    def display_time_remaining(self, primary_time_remaining, secondary_time_remaining = None):
+        """
+        Draw the timers.  Returns False if the frame is identical to the one
+        already on the display and nothing was drawn.
+        """
+        remaining = [primary_time_remaining]
+        if secondary_time_remaining is not None:
+            remaining.append(secondary_time_remaining)
+        return self.display_timers(remaining)
+
+    def display_timers(self, remaining_list):
+        """
+        Draw up to timer_capacity timers, two per panel, redrawing only the
+        panels whose text changed.  Returns False if nothing changed.
+        """
+        texts = self.layout.panel_texts(remaining_list)
+        frame = tuple(texts)
+        if frame == self.last_frame:
+            return False
+        self.last_frame = frame
+
+        for index in self.layout.dirty_panels(texts, self.buffer_panels):
+            x, y = self.layout.panels[index]
+            self.draw_panel(x, y, self.layout.runs(texts[index]))
+            self.panel_redraws += 1
+        self.buffer_panels = texts
+        self.swap(bytes(self.buffer))
+        return True
+
+    def draw_panel(self, x, y, runs):
+        """
+        Copy one panel's cached frame into the buffer at x, y
+        """
+        # Same layout as DisplayAdafruitHat
+        frameRuns = tuple((self.font if role == PRIMARY else self.fontSmall, runX, runY,
+                           PRIMARY_COLOR if role == PRIMARY else SECONDARY_COLOR, text)
+                          for role, runX, runY, text in runs)
+        panel = self.frame_cache.get_frame(frameRuns)
+        rowBytes = PANEL_WIDTH * 3
+        for row in range(PANEL_HEIGHT):
+            target = ((y + row) * self.width + x) * 3
+            self.buffer[target:target + rowBytes] = panel[row * rowBytes:(row + 1) * rowBytes]
+
+    def time_until_next_change(self, remaining_list):
+        """
+        Seconds until display_timers() would draw something different
+        """
+        return self.layout.time_until_change(remaining_list)
+
+    def time_until_change(self, time_remaining, no_flash_colon = False):
+        return time_until_change(time_remaining, no_flash_colon)
+
+    def format_time_remaining(self, time_remaining, no_flash_colon = False):
+        return format_time_remaining(time_remaining, no_flash_colon)
+
+    def clear(self):
+        self.show_text("")
+
+    def show_text(self, outText, line = 1):
+        self.last_frame = None
+        self.buffer_panels = None
+        buffer = self.new_buffer()
+        self.fontSmall.draw_text(buffer, self.width, self.height, 2, 15 * line, PRIMARY_COLOR, outText)
+        self.buffer = buffer
+        self.swap(bytes(buffer))
+
+    def scroll_text(self, outText, line = 1, repeat = 1, stop_event = None):
+        """
+        Scroll text across the display.  Stops early if stop_event is set.
+        """
+        self.last_frame = None
+        self.buffer_panels = None
+        textWidth = self.fontSmall.text_width(outText)
+
+        for loop_count in range(repeat):
+            pos = self.width
+            while pos + textWidth >= 0:
+                if stop_event is not None and stop_event.is_set():
+                    return
+                buffer = self.new_buffer()
+                self.fontSmall.draw_text(buffer, self.width, self.height, pos, 15 * line, PRIMARY_COLOR, outText)
+                pos -= 1
+                time.sleep(DisplayVirtual.SCROLL_DELAY)
+                self.swap(buffer)
+
+    def new_buffer(self):
+        return bytearray(self.width * self.height * 3)
+
+    def swap(self, buffer):
+        """
+        Show a drawn buffer, the equivalent of SwapOnVSync
+        """
+        frame = numpy.frombuffer(buffer, numpy.uint8).reshape((self.height, self.width, 3))
+        with self.lock:
+            self.frame = frame
+            self.redraws += 1
+            index = self.redraws
+        if self.capture_dir is not None:
+            path = os.path.join(self.capture_dir, "frame-%06d.%s" % (index, self.capture_format))
+            if self.capture_format == "png":
+                write_png(path, frame)
+            else:
+                with open(path, "wb") as f:
+                    f.write(frame.tobytes())
+
+    def get_frame(self):
+        """
+        Copy of the frame currently on the display
+        """
+        with self.lock:
+            return self.frame.copy()
+
+
+def write_png(path, frame):
+    """
+    Write a (height, width, 3) uint8 array as an 8-bit RGB PNG
+    """
+    height, width = frame.shape[0], frame.shape[1]
+    # Filter type 0 (none) at the start of each row
+    rows = numpy.zeros((height, width * 3 + 1), numpy.uint8)
+    rows[:, 1:] = frame.reshape((height, width * 3))
+
+    def chunk(chunkType, data):
+        return (struct.pack(">I", len(data)) + chunkType + data
+                + struct.pack(">I", zlib.crc32(chunkType + data) & 0xffffffff))
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)))
+        f.write(chunk(b"IEND", b""))
+
+
+# Main function
+if __name__ == "__main__":
+    FORMAT = '%(asctime)-15s %(threadName)-10s %(levelname)6s %(message)s'
+    logging.basicConfig(stream=sys.stdout, level=logging.NOTSET, format=FORMAT)
+
+    # Render a short countdown to PNG files
+    display = DisplayVirtual(capture_dir=sys.argv[1] if len(sys.argv) > 1 else "frames")
+    remaining = 65.0
+    while remaining >= 55:
+        display.display_time_remaining(remaining, remaining + 600)
+        remaining -= 0.5
+    logger.info("%d frames written to %s", display.redraws, display.capture_dir)
@@ -0,0 +1,373 @@
+#!/usr/bin/python3
+#
+# Alexa Timer Display
+#
+# fleet_aggregator.py - companion service that follows the birth and death
+#                       messages of every display node and serves a fleet view
+#
+# Subscribes with wildcards to the status topics the nodes publish (see
+# pubsub.py):
+#
+#   [NAMESPACE]/node/+/status                  online / offline / DISCONNECTED (will, shown as offline)
+#   [NAMESPACE]/device/+/+/+/+/status          unknown, or a JSON state
+#
+# and keeps an in-memory index of the nodes.  Every change gets a sequence
+# number, so clients can ask for only what changed since the last view:
+#
+#   GET /v1/fleet                 {"seq": 57, "full": true, "counts": {...}, "nodes": {...}}
+#   GET /v1/fleet?since=50        nodes changed after seq 50, removed nodes are null.
+#                                 "full" is true if 50 is too old and everything is sent.
+#   GET /v1/fleet/events          Server-Sent Events stream of the same incremental
+#                                 views, at most one every UPDATE_INTERVAL seconds
+#
+# Run with the same config.yml as the display:
+#
+#   python3 fleet_aggregator.py --port 8080
+#
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from http import HTTPStatus
+
+import yaml
+
+import metrics
+from http_request import HttpServer, HttpResponse, RequestHandler
+
+logger = logging.getLogger(__name__)
+
+FLEET_MESSAGES = metrics.counter('alexa_fleet_messages_total',
+    'Status messages received by the fleet aggregator', ('kind',))
+FLEET_NODES = metrics.gauge('alexa_fleet_nodes', 'Nodes in the fleet index by status', ('status',))
+
+# Longest status string kept, device states can be JSON documents
+MAX_STATUS_LENGTH = 64
+# The node's last will is published by the broker when it drops off
+NODE_STATUS_ALIASES = {"DISCONNECTED": "offline"}
+
+
+class NodeState():
+    """
+    Last known status of one node and its devices.  seq is the fleet
+    sequence number of the last change to it.
+    """
+
+    __slots__ = ('name', 'status', 'since', 'updated', 'devices', 'seq')
+
+    def __init__(self, name):
+        self.name = name
+        self.status = "unknown"
+        # Epoch seconds of the last status change and the last message
+        self.since = None
+        self.updated = None
+        # "type/location/device" to [status, since]
+        self.devices = {}
+        self.seq = 0
+
+    def to_dict(self):
+        return {
+            "status": self.status,
+            "since": self.since,
+            "updated": self.updated,
+            # Copied so it can be encoded outside the index lock
+            "devices": dict(self.devices)
+        }
+
+
+class FleetIndex():
+    """
+    Index of nodes by name.  Updated from the MQTT thread and read by the
+    HTTP server; messages that do not change a status only touch updated.
+    """
+
+    # Changes remembered for incremental views
+    JOURNAL_SIZE = 4096
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nodes = {}
+        self.seq = 0
+        # (seq, node name) of recent changes, oldest first
+        self.journal = deque(maxlen=FleetIndex.JOURNAL_SIZE)
+        # Number of nodes by status
+        self.counts = {}
+        for status in ("online", "offline", "unknown"):
+            FLEET_NODES.labels(status).set_function(lambda status=status: self.count(status))
+
+    def node_status(self, nodeName, status, now = None):
+        """
+        Record a node status.  An empty status (retained message cleared)
+        removes the node.  Returns True if the index changed.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            node = self.nodes.get(nodeName)
+            if not status:
+                if node is None:
+                    return False
+                del self.nodes[nodeName]
+                self._count(node.status, -1)
+                self._changed(nodeName, None)
+                return True
+            if node is None:
+                node = self.nodes[nodeName] = NodeState(nodeName)
+                self._count(node.status, 1)
+            node.updated = now
+            if node.status == status and node.since is not None:
+                return False
+            self._count(node.status, -1)
+            self._count(status, 1)
+            node.status = status
+            node.since = now
+            self._changed(nodeName, node)
+            return True
+
+    def device_status(self, nodeName, deviceKey, status, now = None):
+        """
+        Record a device status.  An empty status removes the device.
+        Returns True if the index changed.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            node = self.nodes.get(nodeName)
+            if node is None:
+                if not status:
+                    return False
+                node = self.nodes[nodeName] = NodeState(nodeName)
+                self._count(node.status, 1)
+            node.updated = now
+            device = node.devices.get(deviceKey)
+            if not status:
+                if device is None:
+                    return False
+                del node.devices[deviceKey]
+            elif device is not None and device[0] == status:
+                return False
+            else:
+                node.devices[deviceKey] = [status, now]
+            self._changed(nodeName, node)
+            return True
+
+    def view(self, since = None):
+        """
+        Nodes changed after sequence number since (all nodes if None or too
+        old) as {"seq", "full", "counts", "nodes"}.  Removed nodes are None.
+        """
+        with self.lock:
+            # Changes after since are all in the journal if it starts at or before since + 1
+            oldest = self.journal[0][0] if self.journal else self.seq + 1
+            full = since is None or since > self.seq or since < oldest - 1
+            if full:
+                nodes = {name: node.to_dict() for name, node in self.nodes.items()}
+            else:
+                nodes = {}
+                # Walk back from the newest change to the first one after since
+                for seq, name in reversed(self.journal):
+                    if seq <= since:
+                        break
+                    if name not in nodes:
+                        node = self.nodes.get(name)
+                        nodes[name] = node.to_dict() if node is not None else None
+            return {
+                "seq": self.seq,
+                "full": full,
+                "counts": dict(self.counts),
+                "nodes": nodes
+            }
+
+    def count(self, status):
+        return self.counts.get(status, 0)
+
+    def _changed(self, nodeName, node):
+        self.seq += 1
+        if node is not None:
+            node.seq = self.seq
+        self.journal.append((self.seq, nodeName))
+
+    def _count(self, status, amount):
+        count = self.counts.get(status, 0) + amount
+        if count:
+            self.counts[status] = count
+        else:
+            self.counts.pop(status, None)
+
+
+class FleetAggregator():
+    """
+    Subscribes to the node and device status topics of a namespace and
+    keeps the FleetIndex up to date
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.index = FleetIndex()
+        self.queueNodeStatus = namespace + "/node/+/status"
+        self.queueDeviceStatus = namespace + "/device/+/+/+/+/status"
+        self.client = None
+        self.server = None
+
+    def connect(self, mqttConfig, clientId = None):
+        """
+        Connect to the broker and start the paho network thread
+        """
+        import paho.mqtt.client as mqtt
+
+        if clientId is None:
+            clientId = "fleet-" + os.uname().nodename
+        self.client = mqtt.Client(client_id=clientId)
+        self.client.enable_logger(logging.getLogger('mqtt'))
+        self.client.reconnect_delay_set(1, 30)
+        self.client.on_connect = self.on_connect
+        self.client.message_callback_add(self.queueNodeStatus, self.on_message_node_status)
+        self.client.message_callback_add(self.queueDeviceStatus, self.on_message_device_status)
+        self.client.username_pw_set(mqttConfig['username'], mqttConfig['password'])
+        self.client.connect_async(mqttConfig['host'], mqttConfig['port'], 60)
+        self.client.loop_start()
+
+    def on_connect(self, client, userdata, flags, rc):
+        logger.info("Connected with result code %s, subscribing to %s and %s",
+            rc, self.queueNodeStatus, self.queueDeviceStatus)
+        # Retained birth and death messages give the current status of every node
+        client.subscribe([(self.queueNodeStatus, 1), (self.queueDeviceStatus, 1)])
+
+    ######################################################################
+    # Subscribe: [NAMESPACE]/node/[NODE_NAME]/status
+    ######################################################################
+    def on_message_node_status(self, client, userdata, msg):
+        levels = msg.topic.split("/")
+        if len(levels) != 4:
+            FLEET_MESSAGES.labels('ignored').inc()
+            return
+        status = decode_status(msg.payload)
+        self.index.node_status(levels[2], NODE_STATUS_ALIASES.get(status, status))
+        FLEET_MESSAGES.labels('node').inc()
+
+    ######################################################################
+    # Subscribe: [NAMESPACE]/device/[TYPE]/[LOCATION_NAME]/[NODE_NAME]/[DEVICE_NAME]/status
+    ######################################################################
+    def on_message_device_status(self, client, userdata, msg):
+        levels = msg.topic.split("/")
+        # ALL is the sync queue the nodes listen to, not a node
+        if len(levels) != 7 or levels[4] == "ALL":
+            FLEET_MESSAGES.labels('ignored').inc()
+            return
+        deviceKey = levels[2] + "/" + levels[3] + "/" + levels[5]
+        self.index.device_status(levels[4], deviceKey, decode_status(msg.payload))
+        FLEET_MESSAGES.labels('device').inc()
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+        if self.client is not None:
+            self.client.loop_stop()
+            self.client.disconnect()
+
+
+def decode_status(payload):
+    """
+    Status text of a message payload.  JSON device states are reduced to
+    their lightState if they have one.
+    """
+    status = payload.decode("utf-8", "ignore") if isinstance(payload, bytes) else (payload or "")
+    if status.startswith("{"):
+        try:
+            status = str(json.loads(status).get("lightState", status))
+        except (ValueError, AttributeError):
+            pass
+    return status[:MAX_STATUS_LENGTH]
+
+
+class FleetRequestHandler(RequestHandler):
+    """
+    Fleet view endpoints.  basalt is the FleetAggregator.
+    """
+
+    # Seconds between incremental views on the event stream
+    UPDATE_INTERVAL = 0.5
+    HEARTBEAT_INTERVAL = 15
+
+    def get_v1_fleet(self, request):
+        try:
+            since = request.query_value("since")
+            since = int(since) if since is not None else None
+        except ValueError:
+            return HttpResponse(HTTPStatus.BAD_REQUEST)
+        view = self.basalt.index.view(since)
+        return HttpResponse(body=json.dumps(view, separators=(',', ':')).encode('utf-8'),
+                            content_type='application/json')
+
+    async def get_v1_fleet_events(self, request):
+        return HttpResponse(content_type='text/event-stream', stream=self.fleet_stream())
+
+    async def fleet_stream(self):
+        """
+        Async generator of a full view followed by incremental views.  Bursts
+        of status messages are coalesced into one view per UPDATE_INTERVAL.
+        """
+        index = self.basalt.index
+        yield b"retry: 3000\n\n"
+        since = None
+        idle = 0
+        while True:
+            if since is None or index.seq != since:
+                view = index.view(since)
+                since = view["seq"]
+                idle = 0
+                yield ("event: fleet\ndata: %s\n\n" % json.dumps(view, separators=(',', ':'))).encode('utf-8')
+            elif idle >= FleetRequestHandler.HEARTBEAT_INTERVAL:
+                idle = 0
+                yield b": heartbeat\n\n"
+            await asyncio.sleep(FleetRequestHandler.UPDATE_INTERVAL)
+            idle += FleetRequestHandler.UPDATE_INTERVAL
+
+
+class FleetHttpServer(HttpServer):
+    """
+    HttpServer serving the fleet endpoints instead of the display's
+    """
+
+    def __init__(self, aggregator, port):
+        super().__init__(aggregator)
+        endpointsGET = {
+            "/v1/fleet": "v1_fleet",
+            "/v1/fleet/events": "v1_fleet_events",
+            "/metrics": "metrics",
+            }
+        self.handler = FleetRequestHandler(aggregator, endpointsGET, {})
+        self.port = port
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fleet status aggregator for Alexa timer displays")
+    parser.add_argument("--config", default="config.yml")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    FORMAT = '%(asctime)-15s %(threadName)-10s %(levelname)6s %(message)s'
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=FORMAT)
+
+    with open(args.config, 'r') as ymlfile:
+        mqttConfig = yaml.safe_load(ymlfile)['mqtt']
+
+    aggregator = FleetAggregator(mqttConfig['queue']['queueNamespace'])
+    aggregator.connect(mqttConfig)
+    aggregator.server = FleetHttpServer(aggregator, args.port)
+    try:
+        # NOTE: This is a blocking call
+        aggregator.server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        aggregator.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+#
+# Alexa Timer Display
+#
+# font_atlas.py - compile BDF fonts to a binary glyph atlas that is
+#                 memory-mapped at startup instead of parsed as text
+#
+# Compiled files go in a "compiled" directory next to the BDF file and are
+# rebuilt when the BDF file's size or modification time changes.  Fonts can
+# be subset to the glyphs the display draws.
+#
+#   load_font(path, codepoints)   BdfFont compatible font read from the atlas
+#   subset_bdf(path, codepoints)  path of a BDF holding only those glyphs,
+#                                 for rgbmatrix graphics.Font().LoadFont
+#
+# Run as a script to compile fonts and report load time and memory:
+#
+#   python3 font_atlas.py fonts/*.bdf
+#
+import bisect
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+import tracemalloc
+
+from bdf_font import BdfFont, Glyph, REPLACEMENT_CODEPOINT
+from timer_text import DISPLAY_CODEPOINTS, TIMER_CODEPOINTS
+
+logger = logging.getLogger(__name__)
+
+COMPILED_DIR = "compiled"
+
+# magic, version, source mtime (ns), source size, height, baseline, glyph count,
+# span count, padded so the code point table is 4 byte aligned
+_HEADER = struct.Struct("<4sHqqhhIIxx")
+_MAGIC = b"BDFA"
+_VERSION = 1
+# device width, height, y offset, span count, index of first span
+_GLYPH = struct.Struct("<hhhHI")
+# row, x start, x end
+_SPAN = struct.Struct("<hhh")
+
+
+class AtlasFont(BdfFont):
+    """
+    Font read from a memory-mapped atlas.  Glyphs are decoded the first
+    time they are used, so loading costs the same for any font size.
+    """
+
+    def __init__(self, path, atlasPath):
+        self.path = path
+        self.atlasPath = atlasPath
+        self.glyphs = {}
+        with open(atlasPath, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, mtime, size, self.height, self.baseline,
+            self.glyphCount, spanCount) = _HEADER.unpack_from(self.data)
+        offset = _HEADER.size
+        # Sorted code points, searched with bisect (the atlas is little endian like the Pi)
+        self.codepoints = memoryview(self.data)[offset:offset + 4 * self.glyphCount].cast("I")
+        self.glyphOffset = offset + 4 * self.glyphCount
+        self.spanOffset = self.glyphOffset + _GLYPH.size * self.glyphCount
+
+    def glyph(self, codepoint):
+        glyph = self.glyphs.get(codepoint)
+        if glyph is None:
+            glyph = self._read_glyph(codepoint)
+            if glyph is None:
+                if codepoint == REPLACEMENT_CODEPOINT:
+                    return None
+                return self.glyph(REPLACEMENT_CODEPOINT)
+            self.glyphs[codepoint] = glyph
+        return glyph
+
+    def _read_glyph(self, codepoint):
+        index = bisect.bisect_left(self.codepoints, codepoint)
+        if index >= self.glyphCount or self.codepoints[index] != codepoint:
+            return None
+        device_width, height, y_offset, spanCount, firstSpan = _GLYPH.unpack_from(
+            self.data, self.glyphOffset + index * _GLYPH.size)
+        start = self.spanOffset + firstSpan * _SPAN.size
+        spans = list(_SPAN.iter_unpack(self.data[start:start + spanCount * _SPAN.size]))
+        return Glyph(device_width, height, y_offset, spans)
+
+
+def load_font(path, codepoints = None):
+    """
+    Load a font from its compiled atlas, compiling it first if the atlas is
+    missing or older than the BDF file.  If the atlas cannot be written the
+    BDF file is parsed directly.
+    """
+    atlasPath = _compiled_path(path, codepoints, ".atlas")
+    stat = os.stat(path)
+    if not _atlas_current(atlasPath, stat):
+        try:
+            compile_font(path, atlasPath, codepoints)
+        except OSError as e:
+            logger.warning("Unable to write font atlas %s: %s", atlasPath, e)
+            return BdfFont(path, codepoints)
+    return AtlasFont(path, atlasPath)
+
+
+def compile_font(path, atlasPath, codepoints = None):
+    """
+    Parse a BDF font and write its atlas
+    """
+    stat = os.stat(path)
+    font = BdfFont(path, codepoints)
+    glyphTable = bytearray()
+    spanTable = bytearray()
+    spanCount = 0
+    keys = sorted(font.glyphs)
+    for codepoint in keys:
+        glyph = font.glyphs[codepoint]
+        glyphTable += _GLYPH.pack(glyph.device_width, glyph.height, glyph.y_offset,
+                                  len(glyph.spans), spanCount)
+        for span in glyph.spans:
+            spanTable += _SPAN.pack(*span)
+        spanCount += len(glyph.spans)
+    header = _HEADER.pack(_MAGIC, _VERSION, stat.st_mtime_ns, stat.st_size,
+                          font.height, font.baseline, len(keys), spanCount)
+    _write_atomic(atlasPath, header + struct.pack("<%dI" % len(keys), *keys) + glyphTable + spanTable)
+    logger.info("Compiled font %s: %d glyphs, %d bytes", atlasPath, len(keys),
+        _HEADER.size + 4 * len(keys) + len(glyphTable) + len(spanTable))
+
+
+def subset_bdf(path, codepoints):
+    """
+    Path of a BDF file with only the given glyphs, written next to the
+    atlases and rebuilt when the source changes.  Falls back to the source
+    path if the subset cannot be written.
+    """
+    subsetPath = _compiled_path(path, codepoints, ".bdf")
+    stat = os.stat(path)
+    stamp = "COMMENT source %d %d" % (stat.st_mtime_ns, stat.st_size)
+    try:
+        with open(subsetPath, "r", encoding="latin-1") as f:
+            for line in f:
+                if line.startswith("COMMENT source "):
+                    if line.rstrip("\n") == stamp:
+                        return subsetPath
+                    break
+                if line.startswith("STARTCHAR"):
+                    break
+    except OSError:
+        pass
+
+    with open(path, "r", encoding="latin-1") as f:
+        lines = f.read().splitlines()
+    header = []
+    chars = []
+    block = None
+    skip = False
+    for line in lines:
+        if skip:
+            skip = not line.startswith("ENDCHAR")
+        elif block is not None:
+            block.append(line)
+            if line.startswith("ENCODING ") and int(line.split()[1]) not in codepoints:
+                block = None
+                skip = True
+            elif line.startswith("ENDCHAR"):
+                chars.append(block)
+                block = None
+        elif line.startswith("STARTCHAR"):
+            block = [line]
+        elif line.startswith("CHARS "):
+            header.append(None)
+        elif not line.startswith("ENDFONT"):
+            header.append(line)
+    header = [("CHARS %d" % len(chars)) if line is None else line for line in header]
+    # The stamp goes right after STARTFONT so it is found without reading the glyphs
+    output = [header[0], stamp] + header[1:]
+    for block in chars:
+        output.extend(block)
+    output.append("ENDFONT")
+    try:
+        _write_atomic(subsetPath, ("\n".join(output) + "\n").encode("latin-1"))
+    except OSError as e:
+        logger.warning("Unable to write font subset %s: %s", subsetPath, e)
+        return path
+    logger.info("Wrote font subset %s: %d glyphs", subsetPath, len(chars))
+    return subsetPath
+
+
+def _compiled_path(path, codepoints, extension):
+    directory, name = os.path.split(path)
+    name = os.path.splitext(name)[0]
+    if codepoints is None:
+        key = "all"
+    else:
+        key = hashlib.sha1(",".join(str(c) for c in sorted(codepoints)).encode()).hexdigest()[:8]
+    return os.path.join(directory, COMPILED_DIR, "%s-%s%s" % (name, key, extension))
+
+
+def _atlas_current(atlasPath, stat):
+    try:
+        with open(atlasPath, "rb") as f:
+            header = f.read(_HEADER.size)
+    except OSError:
+        return False
+    if len(header) < _HEADER.size:
+        return False
+    magic, version, mtime, size = _HEADER.unpack(header)[:4]
+    return magic == _MAGIC and version == _VERSION and mtime == stat.st_mtime_ns and size == stat.st_size
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp, "wb") as f:
+        f.write(data)
+    os.replace(temp, path)
+
+
+def _measure(load):
+    """
+    Seconds and bytes allocated to load a font and draw the timer glyphs
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    font = load()
+    for codepoint in TIMER_CODEPOINTS:
+        font.glyph(codepoint)
+    seconds = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return font, seconds, size
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    paths = sys.argv[1:]
+    if not paths:
+        exit("Usage: font_atlas.py FONT.bdf ...")
+
+    print("Load time and Python heap after loading the timer glyphs.  The atlas")
+    print("itself is memory-mapped, its pages are shared and can be dropped by the kernel.")
+    print("rgbmatrix lines: BDF lines rgbmatrix parses, full font and display subset.\n")
+    print("%-44s %8s %8s %8s %9s %9s %9s %9s %8s %8s" % (
+        "font", "bdf ms", "atlas ms", "subst ms", "bdf KiB", "atlas KiB", "subst KiB",
+        "file KiB", "rgb full", "rgb sub"))
+    for path in paths:
+        full, fullSeconds, fullSize = _measure(lambda: BdfFont(path))
+        # Compile outside the measurement, then time a cold load of each atlas
+        load_font(path)
+        load_font(path, DISPLAY_CODEPOINTS)
+        subsetPath = subset_bdf(path, DISPLAY_CODEPOINTS)
+        atlas, atlasSeconds, atlasSize = _measure(lambda: load_font(path))
+        subset, subsetSeconds, subsetSize = _measure(lambda: load_font(path, DISPLAY_CODEPOINTS))
+        print("%-44s %8.2f %8.2f %8.2f %9.1f %9.1f %9.1f %9.1f %8d %8d" % (
+            os.path.basename(path), fullSeconds * 1000, atlasSeconds * 1000, subsetSeconds * 1000,
+            fullSize / 1024.0, atlasSize / 1024.0, subsetSize / 1024.0,
+            os.path.getsize(subset.atlasPath) / 1024.0, _line_count(path), _line_count(subsetPath)))
+
+
+def _line_count(path):
+    with open(path, "rb") as f:
+        return f.read().count(b"\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#
+# Alexa Timer Display
+#
+# frame_cache.py - bounded LRU cache of pre-rendered display frames
+#
+import logging
+import threading
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FRAME_CACHE_REQUESTS = metrics.counter('alexa_frame_cache_requests_total',
+    'Frame cache lookups by result: hit, miss (rendered and cached) or first (first sight, not rendered)',
+    ('result',))
+
+
+class FrameCache:
+    """
+    LRU cache of rendered frames.  A frame is described by a tuple of text
+    runs (font, x, y, color, text) which is also the cache key, so the same
+    formatted strings in the same layout and colour are only rendered once.
+
+    Most frames of a minutes and seconds countdown are never shown again, so
+    a caller that can draw them another way asks with render_first=False: a
+    frame is then only rendered and cached the second time it is asked for,
+    like the two colon blink frames of an hours countdown, shown for a
+    whole minute.
+    """
+
+    MAX_FRAMES = 64
+    # Keys seen once and not rendered, remembered for the second time
+    MAX_SEEN = 256
+
+    def __init__(self, width, height, to_image = bytes, max_frames = MAX_FRAMES):
+        """
+        to_image converts the rendered RGB buffer to what gets blitted to the
+        canvas (for example a PIL Image for canvas.SetImage)
+        """
+        self.width = width
+        self.height = height
+        self.to_image = to_image
+        self.max_frames = max_frames
+        self.frames = OrderedDict()
+        self.seen = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.first = 0
+
+    def get_frame(self, runs, render_first = True):
+        """
+        Return the image for a tuple of text runs, rendering it on a miss.
+        With render_first False, returns None for runs not asked for before.
+        """
+        with self.lock:
+            image = self.frames.get(runs)
+            if image is not None:
+                self.frames.move_to_end(runs)
+                self.hits += 1
+                FRAME_CACHE_REQUESTS.labels('hit').inc()
+                return image
+            if not render_first and self.seen.pop(runs, None) is None:
+                self.seen[runs] = True
+                if len(self.seen) > self.MAX_SEEN:
+                    self.seen.popitem(last=False)
+                self.first += 1
+                FRAME_CACHE_REQUESTS.labels('first').inc()
+                return None
+            self.misses += 1
+            FRAME_CACHE_REQUESTS.labels('miss').inc()
+
+        image = self.to_image(self.render(runs))
+
+        with self.lock:
+            self.frames[runs] = image
+            if len(self.frames) > self.max_frames:
+                self.frames.popitem(last=False)
+        return image
+
+    def render(self, runs):
+        buffer = bytearray(self.width * self.height * 3)
+        for font, x, y, color, text in runs:
+            font.draw_text(buffer, self.width, self.height, x, y, color, text)
+        return buffer
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.seen.clear()
+
+    def stats(self):
+        total = self.hits + self.misses + self.first
+        return {
+            "frames": len(self.frames),
+            "maxFrames": self.max_frames,
+            "hits": self.hits,
+            "misses": self.misses,
+            "first": self.first,
+            "hitRate": (self.hits / total) if total else 0.0
+        }
@@ -6,272 +6,699 @@
 import logging
 import time
 from datetime import datetime
-import http.server
-import socketserver
-import threading
-import socket
-from queue import Queue
-import socketserver
+import asyncio
 import json
-import psutil
-from functools import partial
-import subprocess
+import os
+import gzip
+import hashlib
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
 #from light import Light, LightState
 
+import metrics
+from log_buffer import parse_level, tail_log_files
+
 logger = logging.getLogger(__name__)
 
+MAX_LOG_LINES = 5000
+
+HTTP_REQUEST_SECONDS = metrics.histogram('alexa_http_request_seconds',
+    'Time to handle an HTTP request, per endpoint', ('method', 'endpoint'))
+
 
 class HttpServer():
+    """
+    HTTP/1.1 server running on an asyncio event loop.  Connections are kept
+    alive between requests and the number of open connections is bounded.
+    Event streams are bounded separately so open status pages do not lock
+    out requests, and at the limit the longest idle keep-alive connection
+    is closed to make room.
+    """
 
     PORT = 80
-    SOCKET_TIMEOUT = 60
-    THREAD_POOL_SIZE = 10
+    # Seconds an idle keep-alive connection stays open
+    KEEP_ALIVE_TIMEOUT = 60
+    MAX_CONNECTIONS = 20
+    MAX_EVENT_STREAMS = 10
+    # Seconds between warnings about rejected connections
+    REJECT_LOG_INTERVAL = 60
+    MAX_HEADER_SIZE = 16384
+    MAX_BODY_SIZE = 65536
+    # Threads used to run handlers that block (psutil, file reads)
+    HANDLER_THREADS = 1
 
     def __init__(self, _basault):
 
-        endpointsGET = { 
+        endpointsGET = {
             "/": "status",
             "/favicon.ico": "favicon",
             "/v1/data": "v1_data",
+            "/v1/events": "v1_events",
+            "/v1/wifiHistory": "v1_wifiHistory",
             "/v1/userLightStates": "v1_userLightStates",
             "/test": "test",
             "/log": "log",
+            "/metrics": "metrics",
+            "/v1/latency": "v1_latency",
+            "/v1/timers": "v1_timers",
+            "/v1/clock": "v1_clock",
             }
 
-        endpointsPOST = { 
+        endpointsPOST = {
             "/v1/lightState": "lightState"
             }
 
-        socketserver.TCPServer.allow_reuse_address = True
-
-        handler = partial(GetRequestHandler, _basault, endpointsGET, endpointsPOST)
-
-        #self.httpd = socketserver.TCPServer(('0.0.0.0', PORT), handler)
-        self.httpd = ThreadedHTTPServer(('0.0.0.0', HttpServer.PORT), handler)
+        self.handler = RequestHandler(_basault, endpointsGET, endpointsPOST)
+        self.events = EventBroadcaster(_basault, self)
+        self.executor = ThreadPoolExecutor(max_workers=HttpServer.HANDLER_THREADS,
+                                           thread_name_prefix="http")
+        self.port = HttpServer.PORT
+        self.loop = None
+        self.server = None
+        self.connections = 0
+        self.streams = 0
+        # Writers of keep-alive connections waiting for their next request, longest idle first
+        self.idle = {}
+        # Writers of idle connections closed to make room, counted until their handler ends
+        self.closing = set()
+        # Connections rejected since the last warning, and when it was logged
+        self.rejected = 0
+        self.lastRejectLog = None
 
     def run(self):
-        logger.info("serving at port: %d", HttpServer.PORT)
-        #self.httpd.serve_forever(poll_interval=5)
-        self.httpd.serve_forever()
+        """
+        Serve requests.  This is a blocking call.
+        """
+        logger.info("serving at port: %d", self.port)
+        asyncio.run(self.serve())
         logger.info("after serve_forever")
 
-    def shutdown(self):
-        self.httpd.server_close()
-        self.httpd._BaseServer__shutdown_request = True
-        # httpd.shutdown()
-
-
+    async def serve(self):
+        """
+        Serve requests on the running event loop
+        """
+        self.loop = asyncio.get_running_loop()
+        self.events.start()
+        self.server = await asyncio.start_server(self.handle_connection, '0.0.0.0', self.port,
+                                                 reuse_address=True, limit=HttpServer.MAX_HEADER_SIZE)
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
 
-# Docs: https://docs.python.org/3/library/http.server.html
+    def timers_changed(self):
+        """
+        Called from any thread when the timers have changed
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.events.publish_timers)
 
+    def shutdown(self):
+        if self.loop is not None and self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+        self.executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader, writer):
+        if self.connections - len(self.closing) >= HttpServer.MAX_CONNECTIONS and self.idle:
+            # Make room by closing the longest idle keep-alive connection
+            idleWriter = next(iter(self.idle))
+            del self.idle[idleWriter]
+            self.closing.add(idleWriter)
+            idleWriter.close()
+        if self.connections - len(self.closing) >= HttpServer.MAX_CONNECTIONS:
+            await self.reject(writer, "connections")
+            return
 
-class GetRequestHandler(http.server.SimpleHTTPRequestHandler):
+        self.connections += 1
+        # Counted as a connection until it turns into an event stream
+        counted = True
+        try:
+            keepAlive = True
+            while keepAlive:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader),
+                                                     HttpServer.KEEP_ALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except HttpError as e:
+                    await self.write_response(writer, HttpResponse(e.status), False)
+                    break
+                if request is None or writer in self.closing:
+                    break
+                self.idle.pop(writer, None)
+
+                keepAlive = request.keep_alive()
+                requestStart = time.perf_counter()
+                response = await self.handler.dispatch(request, self)
+                if response.stream is not None:
+                    if self.streams >= HttpServer.MAX_EVENT_STREAMS:
+                        await self.reject(writer, "event streams")
+                        break
+                    self.connections -= 1
+                    counted = False
+                    self.streams += 1
+                    try:
+                        await self.write_stream(writer, response)
+                    finally:
+                        self.streams -= 1
+                    break
+                await self.write_response(writer, response, keepAlive)
+                self.handler.observe_latency(request, time.perf_counter() - requestStart)
+                if keepAlive:
+                    self.idle[writer] = True
+        except ConnectionError:
+            pass
+        except Exception:
+            logger.exception("Exception handling HTTP connection")
+        finally:
+            self.idle.pop(writer, None)
+            self.closing.discard(writer)
+            if counted:
+                self.connections -= 1
+            writer.close()
+
+    async def reject(self, writer, limit):
+        """
+        Answer 503 and close, warning about rejections at most every REJECT_LOG_INTERVAL
+        """
+        self.rejected += 1
+        now = time.monotonic()
+        if self.lastRejectLog is None or now - self.lastRejectLog >= HttpServer.REJECT_LOG_INTERVAL:
+            logger.warning("Too many %s (%d connections, %d event streams), rejected %d",
+                limit, self.connections, self.streams, self.rejected)
+            self.rejected = 0
+            self.lastRejectLog = now
+        try:
+            await self.write_response(writer, HttpResponse(HTTPStatus.SERVICE_UNAVAILABLE), False)
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def read_request(self, reader):
+        """
+        Read one request.  Returns None if the client closed the connection.
+        """
+        try:
+            header = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError as e:
+            if not e.partial.strip():
+                return None
+            raise
+        except asyncio.LimitOverrunError:
+            raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+
+        lines = header.decode('latin-1').split('\r\n')
+        requestLine = lines[0].split()
+        if len(requestLine) != 3:
+            raise HttpError(HTTPStatus.BAD_REQUEST)
+        method, target, version = requestLine
+
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+        body = b''
+        if 'transfer-encoding' in headers:
+            raise HttpError(HTTPStatus.NOT_IMPLEMENTED)
+        contentLength = headers.get('content-length')
+        if contentLength is not None:
+            try:
+                contentLength = int(contentLength)
+            except ValueError:
+                raise HttpError(HTTPStatus.BAD_REQUEST)
+            if contentLength > HttpServer.MAX_BODY_SIZE:
+                raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            body = await reader.readexactly(contentLength)
+
+        return HttpRequest(method, target, version, headers, body)
+
+    async def write_response(self, writer, response, keepAlive):
+        status = HTTPStatus(response.status)
+        headerLines = ["HTTP/1.1 %d %s" % (status.value, status.phrase)]
+        headerLines.append("Connection: " + ("keep-alive" if keepAlive else "close"))
+        for name, value in CORS_HEADERS:
+            headerLines.append("%s: %s" % (name, value))
+        if response.content_type is not None:
+            headerLines.append("Content-Type: " + response.content_type)
+        for name, value in response.headers:
+            headerLines.append("%s: %s" % (name, value))
+        headerLines.append("Content-Length: %d" % len(response.body))
+        # Write header and body together to avoid a delayed ACK between them
+        writer.write(("\r\n".join(headerLines) + "\r\n\r\n").encode('latin-1') + response.body)
+        await writer.drain()
+
+    async def write_stream(self, writer, response):
+        """
+        Write a response whose body is streamed until the stream ends or the
+        client goes away.  The connection is closed afterwards.
+        """
+        headerLines = ["HTTP/1.1 200 OK", "Connection: close", "Cache-Control: no-cache"]
+        for name, value in CORS_HEADERS:
+            headerLines.append("%s: %s" % (name, value))
+        headerLines.append("Content-Type: " + response.content_type)
+        writer.write(("\r\n".join(headerLines) + "\r\n\r\n").encode('latin-1'))
+        stream = response.stream
+        try:
+            async for chunk in stream:
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            await stream.aclose()
+
+
+CORS_HEADERS = (
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE'),
+    ('Access-Control-Allow-Headers', 'Content-Type'),
+    ('Access-Control-Allow-Credentials', 'true'),
+    ('X-Content-Type-Options', 'nosniff'),
+)
+
+
+class HttpError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class HttpRequest():
+
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        self.target = target
+        self.version = version
+        # Header names are lower case
+        self.headers = headers
+        self.body = body
+        url = urlsplit(target)
+        self.path = url.path
+        self.query = parse_qs(url.query)
+
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def query_value(self, name, default = None):
+        values = self.query.get(name)
+        if not values:
+            return default
+        return values[0]
+
+
+class HttpResponse():
+
+    def __init__(self, status = HTTPStatus.OK, body = b'', content_type = None, headers = (), stream = None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        # Sequence of (name, value)
+        self.headers = headers
+        # Async generator of body chunks for a streamed response
+        self.stream = stream
+
+    @staticmethod
+    def json(responseMap):
+        return HttpResponse(body=json.dumps(responseMap).encode('utf-8'),
+                            content_type='application/json')
+
+    @staticmethod
+    def text(text):
+        return HttpResponse(body=text.encode('utf-8'), content_type='text/plain;charset=UTF-8')
+
+
+class RequestHandler():
     """
-    Class for handling a request to the root path /
+    Handles requests for the GET and POST endpoint tables.  An endpoint
+    "/v1/data": "v1_data" is handled by get_v1_data(request).  Handlers
+    return an HttpResponse.  Plain methods run on the server's handler
+    thread so they can block; coroutine methods run on the event loop.
     """
 
-    def __init__(self, basalt, endpointsGET, endpointsPOST, *args, **kwargs):
-        # NOTE: A new instance of this class is created for EVERY request
-        #logger.info("init GetRequestHandler")
+    def __init__(self, basalt, endpointsGET, endpointsPOST):
         self.basalt = basalt
         self.endpointsGET = endpointsGET
         self.endpointsPOST = endpointsPOST
-        super().__init__(*args, **kwargs)
-
-    def setup(self):
-        "Sets a timeout on the socket"
-        logger.info("Set timeout on the socket")
-        # TOOD: How does this work with keep-alive?  A keep-alive socket is getting timed out
-        self.request.settimeout(HttpServer.SOCKET_TIMEOUT)
-        http.server.SimpleHTTPRequestHandler.setup(self)
-
-    def log_message(self, format, *args):
-        logger.debug(format % args)
-
-    def do_GET(self):
-        pathOnly = self.path.split('?')[0]
-        methodSuffix = self.endpointsGET.get(pathOnly, None)
-        if methodSuffix is not None:
-            handlerMethodName = "get_" + methodSuffix
-            handlerMethod = getattr(self, handlerMethodName)
-            result = handlerMethod()
-            return result
+        self.staticFiles = StaticFileCache()
+
+    async def dispatch(self, request, server):
+        if request.method == 'GET':
+            methodSuffix = self.endpointsGET.get(request.path, None)
+            prefix = "get_"
+        elif request.method == 'POST':
+            methodSuffix = self.endpointsPOST.get(request.path, None)
+            prefix = "post_"
         else:
-            self.send_response(404)
-            self.addCORSHeaders()
-            self.end_headers()            
-
-    def do_POST(self):
-        pathOnly = self.path.split('?')[0]
-        methodSuffix = self.endpointsPOST.get(pathOnly, None)
+            return HttpResponse(HTTPStatus.NOT_IMPLEMENTED)
 
-        content_length = int(self.headers['Content-Length'])
-
-        logger.info("content_length: %d", content_length)
+        handlerMethod = None
+        if methodSuffix is not None:
+            handlerMethod = getattr(self, prefix + methodSuffix, None)
+        if handlerMethod is None:
+            return HttpResponse(HTTPStatus.NOT_FOUND)
 
-        postDataStr = self.rfile.read(content_length).decode(encoding="utf-8")
+        try:
+            if asyncio.iscoroutinefunction(handlerMethod):
+                return await handlerMethod(request)
+            return await server.loop.run_in_executor(server.executor, handlerMethod, request)
+        except Exception:
+            logger.exception("Exception in handler for %s %s", request.method, request.path)
+            return HttpResponse(HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    def observe_latency(self, request, seconds):
+        # Unknown paths share one label so scans cannot grow the metric without bound
+        if ((request.method == 'GET' and request.path in self.endpointsGET)
+                or (request.method == 'POST' and request.path in self.endpointsPOST)):
+            labels = (request.method, request.path)
+        else:
+            labels = ('other', 'other')
+        HTTP_REQUEST_SECONDS.labels(*labels).observe(seconds)
 
+    def post_lightState(self, request):
+        logger.info("content_length: %d", len(request.body))
+        postDataStr = request.body.decode(encoding="utf-8")
         logger.info("postDataStr: %s", postDataStr)
+        try:
+            post_data = json.loads(postDataStr)
+        except ValueError:
+            return HttpResponse(HTTPStatus.BAD_REQUEST)
 
-        post_data = json.loads(postDataStr)
-
-        #print(json.dumps(post_data, indent=4, sort_keys=True))
-
-        if methodSuffix is not None:
-            handlerMethodName = "post_" + methodSuffix
-            handlerMethod = getattr(self, handlerMethodName)
-            result = handlerMethod(post_data)
-            return result
-        else:
-            self.send_response(404)
-            self.addCORSHeaders()
-            self.end_headers() 
-
-
-    def do_POSTx(self):
-        print('-----------------------')
-        print('POST %s (from client %s)' % (self.path, self.client_address))
-        print(self.headers)
-        content_length = int(self.headers['Content-Length'])
-        post_data = json.loads(self.rfile.read(content_length))
-        print(json.dumps(post_data, indent=4, sort_keys=True))
-        self.send_response(200)
-        self.end_headers()
-
-    def post_lightState(self, post_data):
         logger.info("post_lightState: "+ str(post_data))
         # light = self.basalt.light
         # lightStateName = post_data['stateName']
         # lightState = LightState[lightStateName]
         # light.setLightState(lightState)
         response = { 'status': 'sucess'}
-        self.__send_json_response(response)
-        return
+        return HttpResponse.json(response)
 
-    def get_status(self):
+    def get_status(self, request):
         # serve the file!
-        self.path = "status.html"
-        return http.server.SimpleHTTPRequestHandler.do_GET(self)
+        return self.send_file(request, "status.html", "text/html; charset=utf-8")
 
-    def get_favicon(self):
+    def get_favicon(self, request):
         # serve the file!
-        self.path = "images/favicon.ico"
-        return http.server.SimpleHTTPRequestHandler.do_GET(self)
-
-    def get_log(self):
-        cmd = "cat /var/log/basalt_data.log.1 /var/log/basalt_data.log  2>/dev/null  | tail -n 40"
-        self.run_command(cmd)
-        
-    def run_command(self, cmd):
-
-        p = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, universal_newlines=True)
-        cmdOutput = p.stdout.strip()
-
-
-        # Write the response
-        self.protocol_version = 'HTTP/1.1'
-        self.send_response(200, 'OK')
-        self.send_header('Connection', 'Keep-Alive')
-        self.addCORSHeaders()
-
-        self.send_header('Content-type', 'text/plain;charset=UTF-8')
-        self.send_header("Content-Length", str(len(cmdOutput)))
-        self.end_headers()
-        self.wfile.write(bytes(cmdOutput, 'utf-8'))
-
-    def get_v1_userLightStates(self):
+        return self.send_file(request, "images/favicon.ico", "image/x-icon")
+
+    def send_file(self, request, path, content_type):
+        """
+        Serve a file from the static file cache.  Answers 304 Not Modified if
+        the client has the current version, and gzip if the client accepts it.
+        """
+        staticFile = self.staticFiles.get(path)
+        if staticFile is None:
+            return HttpResponse(HTTPStatus.NOT_FOUND)
+
+        useGzip = (staticFile.gzipData is not None
+                   and 'gzip' in request.headers.get('accept-encoding', ''))
+        etag = staticFile.gzipEtag if useGzip else staticFile.etag
+        headers = [('ETag', etag), ('Last-Modified', staticFile.lastModified),
+                   ('Cache-Control', 'no-cache'), ('Vary', 'Accept-Encoding')]
+
+        if staticFile.not_modified(request):
+            return HttpResponse(HTTPStatus.NOT_MODIFIED, headers=headers)
+        if useGzip:
+            headers.append(('Content-Encoding', 'gzip'))
+            return HttpResponse(body=staticFile.gzipData, content_type=content_type, headers=headers)
+        return HttpResponse(body=staticFile.data, content_type=content_type, headers=headers)
+
+    def get_log(self, request):
+        """
+        Recent log lines.  Query parameters:
+            lines  number of lines (default 40)
+            level  minimum level name or number, e.g. WARNING
+            since  only lines logged after this time (epoch seconds)
+        Lines come from the in-memory buffer, or from the log files when
+        the buffer no longer holds everything that was asked for.
+        """
+        try:
+            lines = min(int(request.query_value("lines", "40")), MAX_LOG_LINES)
+            since = request.query_value("since")
+            since = float(since) if since is not None else None
+        except ValueError:
+            return HttpResponse(HTTPStatus.BAD_REQUEST)
+        level = parse_level(request.query_value("level"))
+        if level is None:
+            return HttpResponse(HTTPStatus.BAD_REQUEST)
+
+        log_buffer = getattr(self.basalt, "log_buffer", None)
+        incomplete = True
+        if log_buffer is not None:
+            result, incomplete = log_buffer.get_lines(lines, level, since)
+        if incomplete:
+            result = tail_log_files(lines, level, since)
+
+        return HttpResponse.text("\n".join(result))
+
+    async def get_v1_events(self, request):
+        """
+        Server-Sent Events stream of timer and health changes
+        """
+        events = self.basalt.server.events
+        return HttpResponse(content_type='text/event-stream', stream=events.stream())
+
+    def get_metrics(self, request):
+        return HttpResponse(body=metrics.render().encode('utf-8'),
+                            content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    def get_v1_latency(self, request):
+        manage_timers = self.basalt.manage_timers
+        if manage_timers is None:
+            return HttpResponse.json({})
+        return HttpResponse.json(manage_timers.latency.summary())
+
+    def get_v1_timers(self, request):
+        """
+        The timers shown, merged from MQTT and Bluetooth, and match statistics
+        """
+        manage_timers = self.basalt.manage_timers
+        if manage_timers is None:
+            return HttpResponse.json({})
+        reconciler = manage_timers.reconciler
+        return HttpResponse.json({
+            "timers": [timer.to_dict() for timer in reconciler.timers()],
+            "stats": reconciler.stats()
+        })
+
+    def get_v1_clock(self, request):
+        """
+        The correction applied to the Pi's clock for the countdowns
+        """
+        manage_timers = self.basalt.manage_timers
+        if manage_timers is None:
+            return HttpResponse.json({})
+        return HttpResponse.json(manage_timers.clock.status())
+
+    def get_v1_wifiHistory(self, request):
+        return HttpResponse.json(self.basalt.rpi_info.get_history())
+
+    def get_v1_userLightStates(self, request):
         # light = self.basalt.light
         # response = light.getUserLightStates()
         response = { 'example': 'hello' }
-        self.__send_json_response(response)
-        return
+        return HttpResponse.json(response)
+
+    def get_v1_data(self, request):
+        # psutil is imported on first use to keep it off the startup path
+        import psutil
 
-    def get_v1_data(self):
-        
         #light = self.basalt.light
         rpiInfo = self.basalt.rpi_info.get_info()
+        manage_timers = self.basalt.manage_timers
+        timers_from_bluetooth = manage_timers.timers_from_bluetooth
+
+        # ?device=kitchen for the MQTT timers set on one Alexa device
+        device = request.query_value("device")
+        if device is None:
+            mqttTimers = manage_timers.timers_from_mqtt.timers.sorted_timers()
+        else:
+            mqttTimers = [(timer.id, timer.expire)
+                          for timer in manage_timers.timers_from_mqtt.timers.device_timers(device)]
 
         response = {
                 #"lightState" : light.getLightState().name,
                 "cpuPercent": psutil.cpu_percent(),
                 "rpiTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
-                "rpiInfo": rpiInfo
+                "rpiInfo": rpiInfo,
+                "timers": {
+                    "mqtt": mqttTimers,
+                    "bluetooth": timers_from_bluetooth.timers.sorted_timers() if timers_from_bluetooth is not None else []
+                }
             }
-        self.__send_json_response(response)
-        return
-
-
-    def __send_json_response(self, responseMap):
-        data = json.dumps(responseMap)
-
-        # Write the response
-        self.protocol_version = 'HTTP/1.1'
-        self.send_response(200, 'OK')
-        self.send_header('Connection', 'Keep-Alive')
-        self.addCORSHeaders()
-
-        self.send_header('Content-type', 'application/json')
-        self.send_header("Content-Length", str(len(data)))
-        self.end_headers()
-        self.wfile.write(bytes(data, 'utf-8'))
-        return
-
-    def addCORSHeaders(self):
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods',
-                            'GET,PUT,POST,DELETE')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.send_header('Access-Control-Allow-Credentials', 'true')
-        self.send_header('X-Content-Type-Options', 'nosniff')
-
-# Source of below code: http://code.activestate.com/recipes/574454-thread-pool-mixin-class-for-use-with-socketservert/
-class ThreadPoolMixIn(socketserver.ThreadingMixIn):
-    '''
-    use a thread pool instead of a new thread on every request
-    '''
-    numThreads = HttpServer.THREAD_POOL_SIZE
-    allow_reuse_address = True  # seems to fix socket.error on server restart
-
-    def serve_forever(self):
-        '''
-        Handle one request at a time until doomsday.
-        '''
-        # set up the threadpool
-        self.requests = Queue(self.numThreads)
-
-        for x in range(self.numThreads):
-            t = threading.Thread(target=self.process_request_thread)
-            t.setDaemon(1)
-            t.start()
-
-        # server main loop
-        while True:
-            self.handle_request()
+        return HttpResponse.json(response)
 
-        self.server_close()
 
-    def process_request_thread(self):
-        '''
-        obtain request from queue instead of directly from server socket
-        '''
-        # The thread starts and stays on this loop.
-        # The method call hangs waiting until something is inserted into self.requests
-        #  and .get() unblocks
-        while True:
-            socketserver.ThreadingMixIn.process_request_thread(self, *self.requests.get())
+class StaticFile():
+    """
+    A file loaded into memory with its gzip variant and validators
+    """
 
-    def handle_request(self):
-        '''
-        simply collect requests and put them on the queue for the workers.
-        '''
-        try:
-            request, client_address = self.get_request()
-        except socket.error:
-            return
-        if self.verify_request(request, client_address):
-            self.requests.put((request, client_address))
+    def __init__(self, path):
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        self.mtime = stat.st_mtime_ns
+        self.size = stat.st_size
+        digest = hashlib.sha1(self.data).hexdigest()[:16]
+        self.etag = '"%s"' % digest
+        self.gzipEtag = '"%s-gz"' % digest
+        self.lastModified = formatdate(stat.st_mtime, usegmt=True)
+        # Only keep the compressed copy if it is smaller
+        gzipData = gzip.compress(self.data, 9)
+        self.gzipData = gzipData if len(gzipData) < len(self.data) else None
+
+    def not_modified(self, request):
+        ifNoneMatch = request.headers.get('if-none-match')
+        if ifNoneMatch is not None:
+            tags = [tag.strip() for tag in ifNoneMatch.split(',')]
+            return '*' in tags or self.etag in tags or self.gzipEtag in tags
+        ifModifiedSince = request.headers.get('if-modified-since')
+        if ifModifiedSince is not None:
+            try:
+                return parsedate_to_datetime(ifModifiedSince).timestamp() >= self.mtime // 1000000000
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+class StaticFileCache():
+    """
+    Static files held in memory.  A file is reloaded when its mtime or size
+    changes, checked at most every CHECK_INTERVAL seconds.
+    """
 
+    CHECK_INTERVAL = 2
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # path to (StaticFile, time of last check)
+        self.files = {}
+
+    def get(self, path):
+        """
+        Returns the StaticFile for a path, or None if the file does not exist
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is not None and now < entry[1] + StaticFileCache.CHECK_INTERVAL:
+                return entry[0]
+            try:
+                stat = os.stat(path)
+                staticFile = entry[0] if entry is not None else None
+                if staticFile is None or staticFile.mtime != stat.st_mtime_ns or staticFile.size != stat.st_size:
+                    logger.info("Loading static file %s", path)
+                    staticFile = StaticFile(path)
+            except OSError:
+                self.files.pop(path, None)
+                return None
+            self.files[path] = (staticFile, now)
+            return staticFile
+
+
+class EventBroadcaster():
+    """
+    Pushes the merged timer list and a health snapshot to Server-Sent Events
+    clients.  Each message is encoded once and only sent when it changed,
+    so any number of clients cost one encode per change.  Runs on the
+    server's event loop.
+    """
 
-class ThreadedHTTPServer(ThreadPoolMixIn, http.server.HTTPServer):
-    """Handle requests in a separate thread."""
-    pass
+    HEARTBEAT_INTERVAL = 15
+    # Seconds between health samples while any client is connected
+    HEALTH_INTERVAL = 5
+
+    def __init__(self, basalt, server):
+        self.basalt = basalt
+        self.server = server
+        # Latest encoded message by event name
+        self.messages = {}
+        # Data the latest message was built from, used to skip unchanged messages
+        self.messageKeys = {}
+        self.changed = None
+        self.clients = 0
+
+    def start(self):
+        self.changed = asyncio.Event()
+        asyncio.get_running_loop().create_task(self.sample_health())
+
+    def publish(self, name, data, key = None):
+        """
+        Publish an event.  Nothing is sent if key (default data) is the same
+        as the last time this event was published.
+        """
+        if key is None:
+            key = data
+        if name in self.messageKeys and self.messageKeys[name] == key:
+            return
+        self.messageKeys[name] = key
+        self.messages[name] = ("event: %s\ndata: %s\n\n" % (name, json.dumps(data))).encode('utf-8')
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def publish_timers(self):
+        self.publish("timers", self.timers_snapshot())
+
+    def timers_snapshot(self):
+        """
+        Timers shown, merged from all sources, ordered by expire time
+        """
+        manage_timers = self.basalt.manage_timers
+        if manage_timers is None:
+            return []
+        return [timer.to_dict() for timer in manage_timers.reconciler.timers()]
+
+    def health_snapshot(self):
+        import psutil
+
+        rpiInfo = self.basalt.rpi_info.get_info() if self.basalt.rpi_info is not None else {}
+        return {
+            "cpuPercent": psutil.cpu_percent(),
+            "rpiTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+            "rpiInfo": rpiInfo
+        }
+
+    async def sample_health(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(EventBroadcaster.HEALTH_INTERVAL)
+            if self.clients == 0:
+                continue
+            try:
+                health = await loop.run_in_executor(self.server.executor, self.health_snapshot)
+            except Exception:
+                logger.exception("Exception sampling health")
+                continue
+            # rpiTime alone changing is not a change
+            key = dict(health)
+            del key["rpiTime"]
+            self.publish("health", health, key)
+
+    async def stream(self):
+        """
+        Async generator of event stream chunks for one client
+        """
+        self.clients += 1
+        try:
+            yield b"retry: 3000\n\n"
+            if "timers" not in self.messages:
+                self.publish_timers()
+            sent = {}
+            while True:
+                # Take the event before sending so a change made while sending is not missed
+                changed = self.changed
+                for name, message in list(self.messages.items()):
+                    if sent.get(name) is not message:
+                        sent[name] = message
+                        yield message
+                try:
+                    await asyncio.wait_for(changed.wait(), EventBroadcaster.HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b": heartbeat\n\n"
+        finally:
+            self.clients -= 1
@@ -0,0 +1,121 @@
+#
+# Alexa Timer Display
+#
+# latency_trace.py - time from a timer update arriving (MQTT or Bluetooth)
+#                    to the first frame on the display that shows it
+#
+import logging
+import threading
+import time
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+# local: arrival to frame swapped, broker: publish time to arrival
+UPDATE_LATENCY_SECONDS = metrics.histogram('alexa_update_latency_seconds',
+    'Latency of a timer update reaching the display', ('source', 'stage'), LATENCY_BUCKETS)
+
+
+class LatencyTrace():
+    """
+    One timer update.  arrival is time.monotonic() when it was received;
+    published is the sender's wall clock publish time (epoch seconds) if known.
+    """
+
+    __slots__ = ('source', 'arrival', 'brokerDelay')
+
+    def __init__(self, source, arrival = None, published = None):
+        self.source = source
+        self.arrival = time.monotonic() if arrival is None else arrival
+        # Wall clocks of the sender and the Pi may differ, see clock offset
+        self.brokerDelay = None
+        if published is not None:
+            self.brokerDelay = max(0.0, time.time() - (time.monotonic() - self.arrival) - published)
+
+
+class LatencyTracker():
+    """
+    Collects traces handed to ManageTimers.timer_changed and completes them
+    when the render loop has drawn a frame from timers read after the change.
+    Keeps the last SAMPLE_SIZE latencies per source for percentiles.
+    """
+
+    SAMPLE_SIZE = 200
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+        # source to deque of (local, broker or None)
+        self.samples = {}
+
+    def add(self, trace):
+        """
+        Called after the timers of a trace have been updated
+        """
+        with self.lock:
+            self.pending.append(trace)
+
+    def take_pending(self):
+        """
+        Traces whose changes will be reflected by timers read from now on
+        """
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+        return pending
+
+    def complete(self, traces):
+        """
+        The frame showing these traces has been swapped onto the display
+        """
+        if not traces:
+            return
+        now = time.monotonic()
+        for trace in traces:
+            local = now - trace.arrival
+            UPDATE_LATENCY_SECONDS.labels(trace.source, 'local').observe(local)
+            if trace.brokerDelay is not None:
+                UPDATE_LATENCY_SECONDS.labels(trace.source, 'broker').observe(trace.brokerDelay)
+                logger.info("Update from %s displayed %.1f ms after arrival, broker delay %.1f ms",
+                    trace.source, local * 1000, trace.brokerDelay * 1000)
+            else:
+                logger.info("Update from %s displayed %.1f ms after arrival", trace.source, local * 1000)
+            with self.lock:
+                samples = self.samples.get(trace.source)
+                if samples is None:
+                    samples = self.samples[trace.source] = deque(maxlen=LatencyTracker.SAMPLE_SIZE)
+                samples.append((local, trace.brokerDelay))
+
+    def summary(self):
+        """
+        Latency percentiles in milliseconds per source over the recent samples
+        """
+        with self.lock:
+            samples = dict((source, list(values)) for source, values in self.samples.items())
+        result = {}
+        for source, values in samples.items():
+            local = [value[0] for value in values]
+            broker = [value[1] for value in values if value[1] is not None]
+            result[source] = {
+                'count': len(values),
+                'local': _percentiles(local),
+                'broker': _percentiles(broker),
+            }
+        return result
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    result = {}
+    for pct in (50, 90, 99):
+        index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+        result['p%d' % pct] = round(values[index] * 1000, 2)
+    result['max'] = round(values[-1] * 1000, 2)
+    return result
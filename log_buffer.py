@@ -0,0 +1,166 @@
+#
+# Alexa Timer Display
+#
+# log_buffer.py - in-memory ring buffer of recent log records and a
+#                 seek-from-end tail reader for the log files on disk
+#
+import logging
+import os
+import re
+import time
+from collections import deque
+
+# systemd appends our stdout/stderr to this file (see config/alexa.service)
+LOG_FILE = "/var/log/alexa.log"
+
+_LEVEL_NAMES = ('CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG')
+_LOG_LINE_TIME = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),(\d{3}) ')
+# The level field of the app's format, '%(asctime)-15s %(threadName)-10s %(levelname)6s %(message)s'.
+# Thread names are at least 10 characters and may be longer, the level is
+# the first level name after them, before anything in the message
+_LOG_LINE_LEVEL = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3} .{10,}? +(%s) '
+                             % '|'.join(_LEVEL_NAMES))
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    Logging handler that keeps the last `capacity` formatted records in memory.
+    Messages longer than MAX_MESSAGE_SIZE are truncated so the buffer stays bounded.
+    """
+
+    CAPACITY = 2000
+    MAX_MESSAGE_SIZE = 2000
+
+    def __init__(self, capacity = CAPACITY, level = logging.NOTSET):
+        super().__init__(level)
+        # (created, levelno, formatted line)
+        self.records = deque(maxlen=capacity)
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            line = self.format(record)
+            if len(line) > RingBufferHandler.MAX_MESSAGE_SIZE:
+                line = line[:RingBufferHandler.MAX_MESSAGE_SIZE] + "..."
+            if len(self.records) == self.records.maxlen:
+                self.dropped += 1
+            self.records.append((record.created, record.levelno, line))
+        except Exception:
+            self.handleError(record)
+
+    def get_lines(self, lines = 40, level = logging.NOTSET, since = None):
+        """
+        Return up to `lines` of the newest formatted records at or above level
+        and created after since (epoch seconds), oldest first.  The second value
+        returned is True if older records have been dropped from the buffer,
+        so the result may not cover everything that was asked for.
+        """
+        self.acquire()
+        try:
+            records = list(self.records)
+            dropped = self.dropped > 0
+        finally:
+            self.release()
+
+        result = []
+        for created, levelno, line in reversed(records):
+            if len(result) >= lines:
+                return list(reversed(result)), False
+            if since is not None and created <= since:
+                return list(reversed(result)), False
+            if levelno >= level:
+                result.append(line)
+        return list(reversed(result)), dropped
+
+
+def parse_level(value):
+    """
+    Level from a name (INFO) or number (20).  Returns None if unknown.
+    """
+    if value is None:
+        return logging.NOTSET
+    if value.isdigit():
+        return int(value)
+    level = logging.getLevelName(value.upper())
+    return level if isinstance(level, int) else None
+
+
+def tail_file(path, lines, blockSize = 4096):
+    """
+    Return the last `lines` lines of a file, reading blocks backwards from the end
+    """
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return []
+    with f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        # One extra line, the first one read may be partial
+        while position > 0 and data.count(b'\n') <= lines:
+            readSize = min(blockSize, position)
+            position -= readSize
+            f.seek(position)
+            data = f.read(readSize) + data
+    result = data.decode('utf-8', 'replace').splitlines()
+    if position > 0:
+        result = result[1:]
+    return result[-lines:] if lines > 0 else []
+
+
+def tail_log_files(lines, level = logging.NOTSET, since = None, path = LOG_FILE):
+    """
+    Last `lines` matching lines from the log file and its rotated predecessor (path.1)
+    """
+    result = _tail_matching(path, lines, level, since)
+    if len(result) < lines:
+        older = _tail_matching(path + ".1", lines - len(result), level, since)
+        result = older + result
+    return result
+
+
+# Most lines read from one file when looking for lines that match a filter
+MAX_SCAN_LINES = 50000
+
+
+def _tail_matching(path, lines, level, since):
+    readLines = lines
+    while True:
+        raw = tail_file(path, readLines)
+        result = _filter_lines(raw, level, since)
+        # Stop when there are enough lines, the whole file was read, or
+        # (with since) the oldest line read is already too old
+        if len(result) >= lines or len(raw) < readLines or readLines >= MAX_SCAN_LINES:
+            return result[-lines:] if lines > 0 else []
+        if since is not None and raw and len(_filter_lines(raw[:1], logging.NOTSET, since)) == 0:
+            return result
+        readLines *= 4
+
+
+def _filter_lines(lines, level, since):
+    if level == logging.NOTSET and since is None:
+        return lines
+    result = []
+    for line in lines:
+        if since is not None:
+            match = _LOG_LINE_TIME.match(line)
+            if match is None:
+                continue
+            created = time.mktime(time.strptime(match.group(1), '%Y-%m-%d %H:%M:%S')) + int(match.group(2)) / 1000.0
+            if created <= since:
+                continue
+        if level != logging.NOTSET and _line_level(line) < level:
+            continue
+        result.append(line)
+    return result
+
+
+def _line_level(line):
+    """
+    Level of a line in the app's log format, NOTSET if it has none
+    """
+    match = _LOG_LINE_LEVEL.match(line)
+    if match is None:
+        return logging.NOTSET
+    return logging.getLevelName(match.group(1))
@@ -12,6 +12,8 @@
 #       sudo python3 launch.py --setup
 #       sudo python3 launch.py --example kitchen_sink (to pair which alexa)
 #
+import asyncio
+import importlib
 import logging
 import sys
 import os
@@ -21,16 +23,31 @@ import time
 import math
 import netifaces 
 
-import dateutil.parser
-
-from timers_from_bluetooth import TimersFromBluetooth
+import metrics
+from clock_offset import CLOCK_ERROR_SECONDS, CLOCK_OFFSET_SECONDS, ClockOffset
+from latency_trace import LatencyTracker
+from render_scheduler import RenderScheduler
+from timestamp_parser import parse_timestamp
+from timer_index import BLUETOOTH, MQTT, Timer
+from timer_reconciler import TimerReconciler
 from timers_from_mqtt import TimersFromMqtt
 
-#from display_max7219 import DisplayMax7219 as Display
-from display_adafruit_hat import DisplayAdafruitHat as Display
+# The display (rgbmatrix) and bluetooth gadget (agt) modules are imported
+# in init_display and init_bluetooth so they can load in parallel at startup
 
 logger = logging.getLogger(__name__)
 
+# Display types for init_display, (module, class)
+DISPLAYS = {
+    "adafruit": ("display_adafruit_hat", "DisplayAdafruitHat"),
+    "virtual": ("display_virtual", "DisplayVirtual"),
+    "max7219": ("display_max7219", "DisplayMax7219"),
+}
+
+RENDER_SECONDS = metrics.histogram('alexa_render_loop_seconds',
+    'Time spent in one render loop iteration, excluding the sleep')
+ACTIVE_TIMERS = metrics.gauge('alexa_active_timers', 'Number of timers known per source', ('source',))
+
 class ManageTimers:
 
  
@@ -43,44 +60,104 @@ class ManageTimers:
         self.timer_thread = None
 
         self.event = threading.Event()
+        # Set by the single event loop runtime to wake its render task from
+        # any thread.  None when the render loop runs in timer_thread.
+        self.wake = None
+
+        self.display = None
+        # Set once the display exists and the startup splash no longer blocks it
+        self.display_ready = threading.Event()
+        self.splash_thread = None
+        self.splash_stop = threading.Event()
+        self.first_frame_logged = False
+        self.latency = LatencyTracker()
+        # Only show the MQTT timers set on this Alexa device (room), None for all
+        self.room = None
+        # Corrected time for the countdowns, the Pi's clock may be off after boot
+        self.clock = ClockOffset()
+        # The timers shown, merged from both sources
+        self.reconciler = TimerReconciler(wall=self.clock.now)
+        # Frame deadlines and the render loop thread's priority
+        self.scheduler = RenderScheduler()
 
         self.timers_from_mqtt = TimersFromMqtt(self)
+
+        ACTIVE_TIMERS.labels('mqtt').set_function(lambda: len(self.timers_from_mqtt.timers))
+        ACTIVE_TIMERS.labels('bluetooth').set_function(
+            lambda: len(self.timers_from_bluetooth.timers) if self.timers_from_bluetooth is not None else 0)
+        CLOCK_OFFSET_SECONDS.set_function(self.clock.offset)
+        CLOCK_ERROR_SECONDS.set_function(self.clock.error_estimate)
+
+    def init_bluetooth(self):
+        from timers_from_bluetooth import TimersFromBluetooth
         self.timers_from_bluetooth = TimersFromBluetooth(self)
 
+    def init_display(self, background_splash = False, display_type = "adafruit", display_options = None):
+        """
+        Connect the display and scroll the startup message.  With
+        background_splash the message scrolls in its own thread and stops
+        as soon as the first timer is displayed.  display_type is a key of
+        DISPLAYS and display_options are passed to the display class.
+        """
+        moduleName, className = DISPLAYS[display_type]
+        Display = getattr(importlib.import_module(moduleName), className)
 
-        logger.info("init display")
-        self.display = Display()
+        logger.info("init display %s", display_type)
+        self.display = Display(**(display_options or {}))
 
         #netifaces.ifaddresses('wlan0')
-        ip = netifaces.ifaddresses('wlan0')[netifaces.AF_INET][0]['addr']
+        try:
+            ip = netifaces.ifaddresses('wlan0')[netifaces.AF_INET][0]['addr']
+        except (ValueError, KeyError, IndexError):
+            # No wifi, e.g. running headless with the virtual display
+            ip = "no wlan0"
 
         #self.display.show_text("Startup")
         #self.display.show_text(ip, 2)
-        self.display.scroll_text("Startup: " + ip, 2, 2)
+        if background_splash:
+            self.splash_thread = threading.Thread(target=self._show_splash, args=(ip,), name="splash")
+            self.splash_thread.setDaemon(True)
+            self.splash_thread.start()
+        else:
+            self._show_splash(ip)
+        self.display_ready.set()
+
+    def _show_splash(self, ip):
+        self.display.scroll_text("Startup: " + ip, 2, 2, self.splash_stop)
+        if not self.splash_stop.is_set():
+            #self.display.show_text("Initialize", 2)
+            self.display.clear()
 
-        
     def startup(self):
 
-        #self.display.show_text("Initialize", 2)
-        self.display.clear()
-
         logger.info("About to call gadget main")
         # The following is a blocking call
         self.timers_from_bluetooth.main()
 
 
-    def timer_changed(self):
+    def timer_changed(self, trace = None):
         """
-        One or more timers have changed
+        One or more timers have changed.  trace is the LatencyTrace of the
+        update, completed when a frame reflecting the change is displayed.
         """
 
-        # If we clear all times from MQTT, then clear them from bluetooth
-        # so that we don't display ":00" longer then needed as bluetooth 
-        # updates come in about 1 second slower then MQTT
-        if len(self.timers_from_mqtt.sortedTimers) == 0:
-            self.timers_from_bluetooth.clear_all_timers()
+        # Bluetooth reports the same changes about 1 second after MQTT, the
+        # reconciler shows whichever arrives first
+        self.reconcile()
+
+        if trace is not None:
+            self.latency.add(trace)
 
-        self._create_timer_thread()
+        if self.wake is not None:
+            self.wake()
+        else:
+            self._create_timer_thread()
+            # Wake up the timer thread so the change is displayed right away
+            self.event.set()
+
+        # Push the change to status page clients
+        if self.app.server is not None:
+            self.app.server.timers_changed()
 
 
     def _create_timer_thread(self):
@@ -98,57 +175,132 @@ class ManageTimers:
         Runs a timer
         """
 
-        time_remaining = 1
+        # Wait for the display and stop the startup splash if it is still scrolling
+        self.display_ready.wait()
+        self.splash_stop.set()
+        if self.splash_thread is not None:
+            self.splash_thread.join()
+
+        self.scheduler.enter_realtime()
+        traces = []
         while True:
 
-            timers = self.filter_timers(self.timers_from_mqtt.sortedTimers)
-            if not bool(timers):
-                timers = self.filter_timers(self.timers_from_bluetooth.sortedTimers)
+            # Clear before reading the timers so a change made after this
+            # point wakes up the wait below
+            self.event.clear()
+            deadline, traces = self.render_once()
 
             # Break out of loop if there are no timers to display
-            if not bool(timers):
+            if deadline is None:
                 break
-
-            currentTime = time.time()
-
-            # Get secondary timer info (if any)
-            time_remaining_secondary = None
-            if len(timers) > 1:
-                timer_end_time = timers[1][1]
-                time_remaining_secondary = max(0, timer_end_time - currentTime)
-            
-            timer_end_time = timers[0][1]
-            time_remaining = max(0, timer_end_time - currentTime)
-            self.display.display_time_remaining(time_remaining, time_remaining_secondary)
-
-            #logger.info("Timer token %s.  %d seconds left.", 
-            #    timers[0][0], time_remaining)
-
-            # Format the timer digits for display
-            #timer = time.strftime("%H:%M:%S", time.gmtime(time_remaining))
-            #logger.info("Display timer value: %s", timer)
-
-            # We grab the time again to caculate sleep
-            subseconds = time.time() % 1
-            if subseconds >= 0.5:
-                sleepTime = 1.0 - subseconds
-            else:
-                sleepTime = 0.5 - subseconds
-            #logger.info("sleepTime: %f", sleepTime)
-            self.event.wait(sleepTime)
+            self.scheduler.wait(self.event, deadline)
         
         self.timer_thread = None
         self.display.clear()
+        self.latency.complete(traces)
 
-    def filter_timers(self, timers):
+    async def run_timers_async(self, wake):
+        """
+        Render loop as a task on the event loop, for the single event loop
+        runtime.  Runs for as long as the loop, waiting on the asyncio.Event
+        wake (set through self.wake) while there are no timers.
+        """
+        # The render loop shares the event loop thread, SCHED_FIFO would put MQTT and HTTP at that priority too
+        if self.scheduler.priority is not None or self.scheduler.cpu is not None:
+            logger.warning("Render loop priority and CPU only apply with the threads runtime, ignored")
+        showing = False
+        while True:
+            # Clear before reading the timers, as in _run_timer
+            wake.clear()
+            deadline, traces = self.render_once()
+            if deadline is None:
+                if showing:
+                    showing = False
+                    self.display.clear()
+                self.latency.complete(traces)
+                await wake.wait()
+                continue
+
+            showing = True
+            timeout = deadline - time.monotonic()
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            self.scheduler.record(deadline)
+
+    def render_once(self):
+        """
+        Draw the timers once.  Returns (time.monotonic() deadline of the next
+        frame, when the display next needs to change, []) or, if there are no
+        timers to display, (None, traces to complete once the display is
+        cleared).
+        """
+        iterationStart = time.perf_counter()
+        traces = self.latency.take_pending()
+
+        timers = self.filter_timers(self.display.timer_capacity)
+
+        if not bool(timers):
+            return None, traces
+
+        currentTime = self.clock.now()
+        frameStart = time.monotonic()
+        remaining = [max(0, timer_end_time - currentTime) for timerId, timer_end_time in timers]
+        # Nothing is drawn if the frame has not changed
+        self.display.display_timers(remaining)
+        # If nothing was drawn the frame already on the display is current
+        self.latency.complete(traces)
+        if not self.first_frame_logged:
+            self.first_frame_logged = True
+            logger.info("First timer frame %.3f seconds after startup",
+                time.monotonic() - self.app.startup_time)
+
+        #logger.info("Timer token %s.  %d seconds left.", 
+        #    timers[0][0], remaining[0])
+
+        # Sleep until the next visible change: a second boundary, colon
+        # blink, minute rollover or a displayed timer being removed
+        sleepTime = min(timer_end_time for timerId, timer_end_time in timers) + 15 - currentTime
+        change = self.display.time_until_next_change(remaining)
+        if change is not None:
+            sleepTime = min(sleepTime, change)
+
+        RENDER_SECONDS.observe(time.perf_counter() - iterationStart)
+
+        #logger.info("sleepTime: %f", sleepTime)
+        return frameStart + sleepTime, []
+
+    def filter_timers(self, count = 2):
         """
         Remove any times that have expired more then 15 seconds in the past
+        and return the next count timers as a list of (id, end time)
+        """
+        expiredBefore = self.clock.now() - 15
+        dropped = False
+        for index in self.timer_indexes().values():
+            if index.expire(expiredBefore):
+                dropped = True
+        if dropped:
+            self.reconcile()
+            # Status page clients only hear of changes pushed to them
+            if self.app.server is not None:
+                self.app.server.timers_changed()
+        return self.reconciler.next_timers(count)
+
+    def timer_indexes(self):
         """
-        if bool(timers):
-            currentTime = time.time()
-            currentTimePlus = currentTime - 15
-            timers[:] = [x for x in timers if x[1] > currentTimePlus]
-        return timers
+        Map of source to the source's TimerIndex
+        """
+        indexes = {MQTT: self.timers_from_mqtt.timers}
+        if self.timers_from_bluetooth is not None:
+            indexes[BLUETOOTH] = self.timers_from_bluetooth.timers
+        return indexes
+
+    def reconcile(self):
+        self.reconciler.reconcile(self.timer_indexes(), self.room)
 
 
     def test(self):
@@ -159,9 +311,9 @@ class ManageTimers:
         self.register_signal_handler()
 
         scheduledTime = '2020-02-11T02:00:00-07:00'
-        t = dateutil.parser.parse(scheduledTime).timestamp()
-        self.timers['2551392553'] = t
-        self.sort_timers()
+        t = parse_timestamp(scheduledTime)
+        self.timers_from_bluetooth.timers.set(Timer('2551392553', BLUETOOTH, t))
+        self.reconcile()
         self.timer_thread = threading.Thread(target=self._run_timer)
         self.timer_thread.setDaemon(True) 
         self.timer_thread.start()
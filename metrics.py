@@ -0,0 +1,278 @@
+#
+# Alexa Timer Display
+#
+# metrics.py - counters, gauges and fixed-bucket histograms exported in the
+#              Prometheus text format on /metrics
+#
+# Metrics are created once at module level and updated from any thread:
+#
+#   RENDER_SECONDS = metrics.histogram('alexa_render_seconds', 'Render loop iteration time')
+#   RENDER_SECONDS.observe(elapsed)
+#
+import bisect
+import os
+import threading
+
+# Default histogram buckets in seconds, 100 us to 5 s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class Metric():
+    """
+    Base for a metric family.  A family with label names holds one child per
+    combination of label values, created on first use by labels().
+    """
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        # label values tuple to child
+        self.children = {}
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError("%s expects labels %s" % (self.name, self.labelnames))
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        # Metrics without labels are their own single child
+        return self.labels()
+
+    def _label_text(self, values, extra = None):
+        pairs = list(zip(self.labelnames, values))
+        if extra is not None:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('%s="%s"' % (name, _escape(str(value))) for name, value in pairs) + '}'
+
+    def render(self, lines):
+        lines.append("# HELP %s %s" % (self.name, self.documentation))
+        lines.append("# TYPE %s %s" % (self.name, self.TYPE))
+        for values, child in sorted(self.children.items()):
+            child.render(self, values, lines)
+
+
+class _CounterChild():
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount = 1):
+        with self.lock:
+            self.value += amount
+
+    def render(self, metric, values, lines):
+        lines.append("%s%s %s" % (metric.name, metric._label_text(values), _format(self.value)))
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount = 1):
+        self._default().inc(amount)
+
+
+class _GaugeChild():
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """
+        Read the value from function() each time metrics are collected
+        """
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+    def render(self, metric, values, lines):
+        lines.append("%s%s %s" % (metric.name, metric._label_text(values), _format(self.get())))
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+
+class _HistogramChild():
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket plus +Inf, not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum
+
+    def percentile(self, pct):
+        """
+        Upper bound of the bucket holding the pct percentile, None if empty
+        """
+        counts, total = self.snapshot()
+        count = sum(counts)
+        if count == 0:
+            return None
+        rank = pct / 100.0 * count
+        seen = 0
+        for bound, bucketCount in zip(self.buckets + (float('inf'),), counts):
+            seen += bucketCount
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def render(self, metric, values, lines):
+        counts, total = self.snapshot()
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append("%s_bucket%s %d" % (metric.name, metric._label_text(values, ('le', _format(bound))), cumulative))
+        cumulative += counts[-1]
+        lines.append("%s_bucket%s %d" % (metric.name, metric._label_text(values, ('le', '+Inf')), cumulative))
+        lines.append("%s_sum%s %s" % (metric.name, metric._label_text(values), _format(total)))
+        lines.append("%s_count%s %d" % (metric.name, metric._label_text(values), cumulative))
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames = (), buckets = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def percentile(self, pct):
+        return self._default().percentile(pct)
+
+
+class Registry():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                # Modules imported twice (e.g. as __main__) share the metric
+                if type(existing) is not type(metric):
+                    raise ValueError("metric %s already registered as %s" % (metric.name, existing.TYPE))
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            metric.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames = ()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames = ()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames = (), buckets = DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render():
+    return REGISTRY.render()
+
+
+def process_stats():
+    """
+    (number of OS threads, resident memory in bytes) of this process
+    """
+    return _read_threads(), _read_rss()
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _read_rss():
+    try:
+        with open('/proc/self/statm', 'rt') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def _read_threads():
+    # Counts native threads too (rgbmatrix refresh, bluez), not just Python ones
+    try:
+        with open('/proc/self/stat', 'rt') as f:
+            return int(f.read().rpartition(')')[2].split()[17])
+    except (OSError, IndexError, ValueError):
+        return threading.active_count()
+
+
+gauge('process_resident_memory_bytes', 'Resident memory size in bytes').set_function(_read_rss)
+gauge('process_threads', 'Number of OS threads in the process').set_function(_read_threads)
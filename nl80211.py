@@ -0,0 +1,198 @@
+#
+# Alexa Timer Display
+#
+# nl80211.py - minimal nl80211 (generic netlink) client to read wifi station
+#              info in-process, the same data "iw wlan0 station dump" shows
+#
+import logging
+import os
+import socket
+import struct
+
+logger = logging.getLogger(__name__)
+
+NETLINK_GENERIC = 16
+
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+NL80211_CMD_GET_INTERFACE = 5
+NL80211_CMD_GET_STATION = 17
+NL80211_ATTR_IFINDEX = 3
+NL80211_ATTR_STA_INFO = 21
+NL80211_ATTR_WIPHY_FREQ = 38
+NL80211_ATTR_SSID = 52
+
+# enum nl80211_sta_info
+STA_INFO_INACTIVE_TIME = 1
+STA_INFO_RX_BYTES = 2
+STA_INFO_TX_BYTES = 3
+STA_INFO_SIGNAL = 7
+STA_INFO_TX_BITRATE = 8
+STA_INFO_RX_PACKETS = 9
+STA_INFO_TX_PACKETS = 10
+STA_INFO_TX_RETRIES = 11
+STA_INFO_TX_FAILED = 12
+STA_INFO_SIGNAL_AVG = 13
+STA_INFO_RX_BITRATE = 14
+STA_INFO_CONNECTED_TIME = 16
+STA_INFO_RX_BYTES64 = 23
+STA_INFO_TX_BYTES64 = 24
+
+# enum nl80211_rate_info
+RATE_INFO_BITRATE = 1
+RATE_INFO_BITRATE32 = 5
+
+_NLMSGHDR = struct.Struct("=IHHII")
+_GENLMSGHDR = struct.Struct("=BBH")
+_NLATTR = struct.Struct("=HH")
+
+
+class NetlinkError(OSError):
+    pass
+
+
+def _attr(attrType, data):
+    length = _NLATTR.size + len(data)
+    return _NLATTR.pack(length, attrType) + data + b"\0" * ((4 - length % 4) % 4)
+
+
+def _parse_attrs(data, offset = 0):
+    """
+    Parse netlink attributes into a dict of type to raw bytes
+    """
+    attrs = {}
+    while offset + _NLATTR.size <= len(data):
+        length, attrType = _NLATTR.unpack_from(data, offset)
+        if length < _NLATTR.size:
+            break
+        # Strip the nested and byte order flags
+        attrs[attrType & 0x3fff] = data[offset + _NLATTR.size:offset + length]
+        offset += (length + 3) & ~3
+    return attrs
+
+
+def _u32(value):
+    return struct.unpack("=I", value[:4])[0]
+
+
+def _bitrate(value):
+    """
+    Bitrate in Mbit/s from a nested rate info attribute
+    """
+    rate = _parse_attrs(value)
+    if RATE_INFO_BITRATE32 in rate:
+        return _u32(rate[RATE_INFO_BITRATE32]) / 10.0
+    if RATE_INFO_BITRATE in rate:
+        return struct.unpack("=H", rate[RATE_INFO_BITRATE][:2])[0] / 10.0
+    return None
+
+
+class Nl80211:
+    """
+    Generic netlink socket bound to the nl80211 family
+    """
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+        self.sock.bind((0, 0))
+        self.seq = 0
+        try:
+            self.familyId = self.resolve_family("nl80211")
+        except Exception:
+            self.sock.close()
+            raise
+
+    def close(self):
+        self.sock.close()
+
+    def resolve_family(self, name):
+        replies = self._request(GENL_ID_CTRL, CTRL_CMD_GETFAMILY, NLM_F_REQUEST,
+                                _attr(CTRL_ATTR_FAMILY_NAME, name.encode() + b"\0"))
+        for attrs in replies:
+            if CTRL_ATTR_FAMILY_ID in attrs:
+                return struct.unpack("=H", attrs[CTRL_ATTR_FAMILY_ID][:2])[0]
+        raise NetlinkError("generic netlink family not found: " + name)
+
+    def get_interface(self, ifname):
+        """
+        Returns dict with freq (MHz) and ssid of the interface
+        """
+        replies = self._request(self.familyId, NL80211_CMD_GET_INTERFACE, NLM_F_REQUEST,
+                                _attr(NL80211_ATTR_IFINDEX, struct.pack("=I", socket.if_nametoindex(ifname))))
+        info = {}
+        for attrs in replies:
+            if NL80211_ATTR_WIPHY_FREQ in attrs:
+                info["freq"] = _u32(attrs[NL80211_ATTR_WIPHY_FREQ])
+            if NL80211_ATTR_SSID in attrs:
+                info["ssid"] = attrs[NL80211_ATTR_SSID].decode("utf-8", "replace")
+        return info
+
+    def get_station(self, ifname):
+        """
+        Returns dict of station info for the access point we are connected to,
+        or an empty dict if not connected
+        """
+        replies = self._request(self.familyId, NL80211_CMD_GET_STATION, NLM_F_REQUEST | NLM_F_DUMP,
+                                _attr(NL80211_ATTR_IFINDEX, struct.pack("=I", socket.if_nametoindex(ifname))))
+        for attrs in replies:
+            if NL80211_ATTR_STA_INFO not in attrs:
+                continue
+            sta = _parse_attrs(attrs[NL80211_ATTR_STA_INFO])
+            info = {}
+            for key, attrType in (("inactiveTime", STA_INFO_INACTIVE_TIME),
+                                  ("rxBytes", STA_INFO_RX_BYTES), ("txBytes", STA_INFO_TX_BYTES),
+                                  ("rxPackets", STA_INFO_RX_PACKETS), ("txPackets", STA_INFO_TX_PACKETS),
+                                  ("txRetries", STA_INFO_TX_RETRIES), ("txFailed", STA_INFO_TX_FAILED),
+                                  ("connectedTime", STA_INFO_CONNECTED_TIME)):
+                if attrType in sta:
+                    info[key] = _u32(sta[attrType])
+            for key, attrType in (("rxBytes", STA_INFO_RX_BYTES64), ("txBytes", STA_INFO_TX_BYTES64)):
+                if attrType in sta:
+                    info[key] = struct.unpack("=Q", sta[attrType][:8])[0]
+            for key, attrType in (("signal", STA_INFO_SIGNAL), ("signalAvg", STA_INFO_SIGNAL_AVG)):
+                if attrType in sta:
+                    info[key] = struct.unpack("=b", sta[attrType][:1])[0]
+            for key, attrType in (("txBitrate", STA_INFO_TX_BITRATE), ("rxBitrate", STA_INFO_RX_BITRATE)):
+                if attrType in sta:
+                    info[key] = _bitrate(sta[attrType])
+            return info
+        return {}
+
+    def _request(self, msgType, cmd, flags, payload):
+        """
+        Send a generic netlink request and return the attributes of each reply
+        """
+        self.seq += 1
+        body = _GENLMSGHDR.pack(cmd, 1, 0) + payload
+        self.sock.send(_NLMSGHDR.pack(_NLMSGHDR.size + len(body), msgType, flags, self.seq, 0) + body)
+
+        replies = []
+        while True:
+            data = self.sock.recv(65536)
+            offset = 0
+            while offset + _NLMSGHDR.size <= len(data):
+                length, replyType, replyFlags, seq, pid = _NLMSGHDR.unpack_from(data, offset)
+                if length < _NLMSGHDR.size:
+                    return replies
+                if seq == self.seq:
+                    if replyType == NLMSG_DONE:
+                        return replies
+                    if replyType == NLMSG_ERROR:
+                        error = struct.unpack_from("=i", data, offset + _NLMSGHDR.size)[0]
+                        if error == 0:
+                            # Acknowledgement
+                            return replies
+                        raise NetlinkError(-error, os.strerror(-error))
+                    replies.append(_parse_attrs(data[offset:offset + length],
+                                                _NLMSGHDR.size + _GENLMSGHDR.size))
+                    if not flags & NLM_F_DUMP:
+                        return replies
+                offset += (length + 3) & ~3
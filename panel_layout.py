@@ -0,0 +1,80 @@
+#
+# Alexa Timer Display
+#
+# panel_layout.py - assign timers to the 64x32 panels of a chained and/or
+#                   parallel LED matrix and work out which panels changed
+#
+from timer_text import format_time_remaining, time_until_change
+
+PANEL_WIDTH = 64
+PANEL_HEIGHT = 32
+
+# Roles of a text run, mapped to a font and colour by the display
+PRIMARY = 0
+SECONDARY = 1
+
+
+class PanelLayout():
+    """
+    Splits the matrix into 64x32 panels, left to right then top to bottom.
+    Each panel uses the single panel layout: one timer in the large font,
+    and the next one in the small font below it.  Timers are handed out in
+    order, so a matrix of N panels shows up to 2 * N timers.
+    """
+
+    def __init__(self, chain_length = 1, parallel = 1):
+        self.width = PANEL_WIDTH * chain_length
+        self.height = PANEL_HEIGHT * parallel
+        # Top left corner of each panel
+        self.panels = [(column * PANEL_WIDTH, row * PANEL_HEIGHT)
+                       for row in range(parallel) for column in range(chain_length)]
+        self.timer_capacity = 2 * len(self.panels)
+
+    def panel_texts(self, remaining_list):
+        """
+        (primary text, secondary text or None) per panel, None for an empty panel
+        """
+        texts = []
+        for index in range(len(self.panels)):
+            slot = 2 * index
+            if slot >= len(remaining_list):
+                texts.append(None)
+                continue
+            secondary = None
+            if slot + 1 < len(remaining_list):
+                secondary = format_time_remaining(remaining_list[slot + 1], True)
+            texts.append((format_time_remaining(remaining_list[slot]), secondary))
+        return texts
+
+    def runs(self, texts):
+        """
+        Text runs (role, x, y, text) of one panel, relative to the panel
+        """
+        if texts is None:
+            return ()
+        primary, secondary = texts
+        if secondary is None:
+            # Primary timer in the middle of the panel
+            return ((PRIMARY, 2, 27, primary),)
+        # Primary at the top to leave room for the secondary timer
+        return ((PRIMARY, 2, 22, primary), (SECONDARY, 4, 31, secondary))
+
+    def time_until_change(self, remaining_list):
+        """
+        Seconds until any panel's text changes, None if none will
+        """
+        result = None
+        for slot, remaining in enumerate(remaining_list[:self.timer_capacity]):
+            # Secondary timers do not flash the colon
+            change = time_until_change(remaining, slot % 2 == 1)
+            if change is not None and (result is None or change < result):
+                result = change
+        return result
+
+    def dirty_panels(self, texts, previous):
+        """
+        Indexes of panels whose texts differ from previous (None: all panels)
+        """
+        if previous is None:
+            return list(range(len(self.panels)))
+        return [index for index in range(len(self.panels)) if texts[index] != previous[index]]
@@ -10,9 +10,16 @@ import sys
 
 import yaml
 
+import metrics
+from latency_trace import LatencyTrace
+from timestamp_parser import parse_timestamp
+
 
 logger = logging.getLogger(__name__)
 
+MQTT_HANDLER_SECONDS = metrics.histogram('alexa_mqtt_handler_seconds',
+    'Time spent handling an MQTT timer message', ('handler',))
+
 #
 # Node: [NAMESPACE]/node/[NODE_NAME]/status
 #    yukon/node/rpibasaltX/status
@@ -24,6 +31,19 @@ logger = logging.getLogger(__name__)
 # All Device sync: [NAMESPACE]/device/[TYPE]/[LOCATION_NAME]/ALL/[DEVICE_NAME]/status
 #    yukon/device/basalt/driveway/ALL/light/status
 #
+# Timers: [NAMESPACE]/device/[TYPE]/[LOCATION_NAME]/[NODE_NAME]/[DEVICE_NAME]/timers
+#    Full list of timers: { "seq": 41, "timers": [ { "id": ..., "deviceName": ..., "expireTime": ... }, ... ] }
+#    "seq" is optional, but deltas are only applied after a full list with a seq
+#    "published" is optional, the sender's publish time (epoch seconds or ISO-8601),
+#    used to measure broker delay and correct the Pi's clock.  Also accepted on timer deltas.
+#
+# Timer deltas: [NAMESPACE]/device/[TYPE]/[LOCATION_NAME]/[NODE_NAME]/[DEVICE_NAME]/timers/delta
+#    { "seq": 42, "ops": [ { "op": "add", "id": ..., "deviceName": ..., "expireTime": ... },
+#                          { "op": "remove", "id": ... } ] }
+#    seq must increase by one per message.  On a gap the node publishes
+#    { "lastSeq": ... } to .../timers/request and waits for a full list of timers.
+#    It also requests one on connecting while its clock is not synchronized
+#
 # Pub test message from command-line:
 #   mosquitto_pub -h rpicontroller1 -h mqtt.hyperboard.net -u mqtt -P XXXXX -r -d -t "yukon/device/halloween-tombstone/front/ALL/light/status" -m '{ "lightState": "FLAME"}'
 #   mosquitto_sub -h rpicontroller1 -h mqtt.hyperboard.net -u mqtt -P XXXXX -d -t "yukon/device/halloween-tombstone/front/rpihalloween/light/status"
@@ -31,8 +51,13 @@ logger = logging.getLogger(__name__)
 class Pubsub:
 
  
-    def __init__(self, alexa):
+    def __init__(self, alexa, start_loop = True):
+        """
+        With start_loop False the paho network thread is not started and
+        connecting is left to the caller, e.g. the single event loop runtime
+        """
         self.alexa = alexa
+        self.start_loop = start_loop
 
         ymlfile = open("config.yml", 'r')
         cfg = yaml.safe_load(ymlfile)
@@ -56,6 +81,10 @@ class Pubsub:
         # Device name example: yukon/device/basalt/driveway/basalt1/light/status
         self.queueDeviceStatus =       self.queueNamespace + "/device/" + self.typeName + "/" + self.locationName + "/" + self.nodeName + "/" + self.deviceName + "/status"
         self.queueDeviceUpdateTimers = self.queueNamespace + "/device/" + self.typeName + "/" + self.locationName + "/" + self.nodeName + "/" + self.deviceName + "/timers"
+        self.queueDeviceUpdateTimerDeltas = self.queueDeviceUpdateTimers + "/delta"
+        self.queueDeviceRequestTimers = self.queueDeviceUpdateTimers + "/request"
+        # Time of the last request for a full list of timers
+        self.lastTimersRequest = 0
 
         self.queueDeviceAllStatus = self.queueNamespace + "/device/" + self.typeName + "/" + self.locationName + "/ALL/" + self.deviceName + "/status"
 
@@ -75,12 +104,14 @@ class Pubsub:
         self.client.will_set(self.queueNodeStatus, deathPayload, 0, True)
 
         self.client.message_callback_add(self.queueDeviceUpdateTimers, self.on_message_update_timers)
+        self.client.message_callback_add(self.queueDeviceUpdateTimerDeltas, self.on_message_update_timer_deltas)
         self.client.on_message = self.on_message
 
         self.client.username_pw_set(self.mqttBrokerUsername, self.mqttBrokerPassword)
         self.client.connect_async(self.mqttBrokerHost,self.mqttBrokerPort,60)
 
-        self.client.loop_start()
+        if start_loop:
+            self.client.loop_start()
 
     ######################################################################
     # Publish the BIRTH certificates
@@ -117,7 +148,12 @@ class Pubsub:
         logger.info("Connected with result code "+str(rc))
         self.client.subscribe(self.queueDeviceAllStatus, qos=2)
         self.client.subscribe(self.queueDeviceUpdateTimers, qos=2)
+        self.client.subscribe(self.queueDeviceUpdateTimerDeltas, qos=2)
         self.publishBirth()
+        # The retained timers do not say what time it is, a fresh list does
+        manage_timers = self.alexa.manage_timers
+        if manage_timers is not None and manage_timers.clock.status()["source"] == "none":
+            self.publishTimersRequest(manage_timers.timers_from_mqtt.lastSeq)
 
     def on_disconnect(self, client, userdata, rc):
         logger.warn("Disconnected with result code "+str(rc))
@@ -135,6 +171,7 @@ class Pubsub:
     # Subscribe: List for the ALL (sync) queue to change light state
     ######################################################################
     def on_message_update_timers(self, client, userdata, msg):
+        handlerStart = time.perf_counter()
         try:
             topic=msg.topic
             logger.info("Got message from %s timestamp: %s", topic, msg.timestamp)
@@ -148,11 +185,63 @@ class Pubsub:
             # for timer in timers: 
             #     logger.info("timer id: %s", timer['id'])
 
-            self.alexa.manage_timers.timers_from_mqtt.update_all_timers(timers)
+            self.alexa.manage_timers.timers_from_mqtt.update_all_timers(timers, m_in.get("seq"),
+                self.latency_trace(msg, m_in))
 
         except: # catch *all* exceptions
             e = sys.exc_info()
             logger.error("Exception in on_message_update_timers: %s", e)
+        MQTT_HANDLER_SECONDS.labels('timers').observe(time.perf_counter() - handlerStart)
+
+    ######################################################################
+    # Subscribe: Add/update/remove of individual timers
+    ######################################################################
+    def on_message_update_timer_deltas(self, client, userdata, msg):
+        handlerStart = time.perf_counter()
+        try:
+            logger.info("Got message from %s timestamp: %s", msg.topic, msg.timestamp)
+            m_in=json.loads(msg.payload)
+            timers_from_mqtt = self.alexa.manage_timers.timers_from_mqtt
+            lastSeq = timers_from_mqtt.lastSeq
+            if not timers_from_mqtt.apply_timer_deltas(m_in["seq"], m_in["ops"], self.latency_trace(msg, m_in)):
+                self.publishTimersRequest(lastSeq)
+
+        except: # catch *all* exceptions
+            e = sys.exc_info()
+            logger.error("Exception in on_message_update_timer_deltas: %s", e)
+        MQTT_HANDLER_SECONDS.labels('deltas').observe(time.perf_counter() - handlerStart)
+
+    ######################################################################
+    # Latency trace of a timers message, from when paho received it
+    ######################################################################
+    def latency_trace(self, msg, m_in):
+        # paho stamps messages with time.monotonic() when they are read
+        arrival = None
+        if 0 < msg.timestamp <= time.monotonic():
+            arrival = msg.timestamp
+        published = m_in.get("published")
+        try:
+            if isinstance(published, str):
+                published = parse_timestamp(published)
+        except ValueError:
+            published = None
+        if not isinstance(published, (int, float)):
+            published = None
+        trace = LatencyTrace("mqtt", arrival, published)
+        # Retained messages may have been published long before
+        if published is not None and not msg.retain:
+            self.alexa.manage_timers.clock.add_sample(published, trace.arrival)
+        return trace
+
+    ######################################################################
+    # Publish a request for the full list of timers (at most every 5 seconds)
+    ######################################################################
+    def publishTimersRequest(self, lastSeq):
+        now = time.time()
+        if now < self.lastTimersRequest + 5:
+            return
+        self.lastTimersRequest = now
+        self.publishEventObject(self.queueDeviceRequestTimers, { "lastSeq": lastSeq })
 
 
     def shutdown(self):
@@ -160,6 +249,9 @@ class Pubsub:
         self.publishNodeOffline()
         self.client.loop_stop()
         self.client.disconnect()
+        if not self.start_loop:
+            # No network thread, send the offline message and disconnect now
+            self.client.loop_write()
 
 
     def testPub(self):
@@ -0,0 +1,91 @@
+#
+# Alexa Timer Display
+#
+# render_scheduler.py - frame deadlines for the render loop
+#
+# The render loop draws a frame when the display next changes: the colon
+# blink every half second, a second or minute boundary.  Each wait is for a
+# deadline on time.monotonic(), so neither the time spent drawing nor the
+# wall clock being stepped moves the next frame.  How late the loop wakes
+# up for each deadline goes to a histogram.
+#
+# Waking up on time needs the CPU and then the GIL.  With a priority set
+# (the service runs as root) the render thread, and only it, is scheduled
+# SCHED_FIFO.  It can also be pinned to one CPU.  The rgbmatrix refresh
+# thread already runs SCHED_FIFO on the last CPU, so pick another one.
+# Neither applies with the asyncio runtime, where the render loop shares
+# the event loop thread with MQTT and HTTP.
+#
+# The GIL switch interval is for the whole process, so it is only changed
+# when asked for (set_switch_interval): a shorter one makes a thread
+# parsing MQTT JSON or serving HTTP hand over the GIL sooner, at the cost
+# of more switching everywhere.
+#
+import logging
+import os
+import sys
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_MISS_SECONDS = metrics.histogram('alexa_render_deadline_miss_seconds',
+    'Time from a frame deadline to the render loop waking up for it',
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25))
+
+
+class RenderScheduler:
+    """
+    Waits for the render loop's frame deadlines and records how late it woke
+    """
+
+    def __init__(self, priority = None, cpu = None):
+        # SCHED_FIFO priority (1-99) of the render loop thread, None for the default scheduler
+        self.priority = priority
+        # CPU to run the render loop thread on, None for any
+        self.cpu = cpu
+
+    def enter_realtime(self):
+        """
+        Apply the priority and CPU to the calling thread, the one that runs
+        the render loop.  Failures are logged, the loop runs regardless.
+        """
+        if self.priority is not None:
+            try:
+                # 0 is the calling thread on Linux, the rest of the process keeps its policy
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+                logger.info("Render loop SCHED_FIFO priority %d", self.priority)
+            except (AttributeError, OSError) as e:
+                logger.warning("Could not set SCHED_FIFO priority %d: %s", self.priority, e)
+        if self.cpu is not None:
+            try:
+                os.sched_setaffinity(0, (self.cpu,))
+                logger.info("Render loop on CPU %d", self.cpu)
+            except (AttributeError, OSError) as e:
+                logger.warning("Could not run render loop on CPU %d: %s", self.cpu, e)
+
+    def wait(self, event, deadline):
+        """
+        Wait until the time.monotonic() deadline or until event is set.
+        Returns True if woken by the event.
+        """
+        timeout = deadline - time.monotonic()
+        if timeout > 0 and event.wait(timeout):
+            return True
+        self.record(deadline)
+        return False
+
+    def record(self, deadline):
+        """
+        The loop woke up for a deadline, record how late
+        """
+        DEADLINE_MISS_SECONDS.observe(max(0.0, time.monotonic() - deadline))
+
+
+def set_switch_interval(seconds):
+    """
+    Set the GIL switch interval for the whole process (the default is 5 ms)
+    """
+    sys.setswitchinterval(seconds)
+    logger.info("GIL switch interval %.1f ms", sys.getswitchinterval() * 1000)
@@ -1,45 +1,161 @@
 
-
-import subprocess
 import logging
+import threading
 import time
+from collections import namedtuple
+
+from nl80211 import Nl80211
 
 logger = logging.getLogger(__name__)
 
+# One wifi sample.  Fields are None when not available.
+WifiSample = namedtuple('WifiSample', [
+    'time', 'signal', 'noise', 'txBitrate', 'rxBitrate', 'txRetries', 'txFailed',
+    'rxBytes', 'txBytes', 'rxPackets', 'txPackets', 'txErrors', 'rxErrors'])
+
 
 class RpiInfo:
+    """
+    Samples wifi state on a background thread from nl80211, /proc/net/wireless
+    and /sys/class/net statistics.  get_info() returns the latest snapshot and
+    get_history() the last HISTORY_SIZE samples; neither blocks or forks.
+    """
+
+    INTERFACE = 'wlan0'
+    SAMPLE_INTERVAL = 5
+    # 10 minutes of samples
+    HISTORY_SIZE = 120
 
     def __init__(self, fountain):
+        # Snapshots are replaced, never modified, so readers need no lock
         self.dataMap = {}
+        self.history = ()
         self.lastUpdate = None
+        self.nl80211 = None
+        self.nl80211Error = None
 
-    def get_info(self):
-        now = time.time()
-        if self.lastUpdate is None or now > self.lastUpdate + 1:
-            # Only update every n seconds
-            self.lastUpdate = now
-            self.update()
+        self.thread = threading.Thread(target=self.run, name="rpi-info")
+        self.thread.setDaemon(True)
+        self.thread.start()
 
+    def get_info(self):
         return self.dataMap
 
+    def get_history(self):
+        """
+        Samples as a list of dicts, oldest first
+        """
+        return [sample._asdict() for sample in self.history]
+
+    def run(self):
+        while True:
+            try:
+                self.update()
+            except Exception:
+                logger.exception("Exception sampling wifi info")
+            time.sleep(RpiInfo.SAMPLE_INTERVAL)
+
     def update(self):
+        station = self.read_station()
+        wireless = self.read_proc_wireless()
+        statistics = self.read_statistics()
+
+        signal = station.get('signal', wireless.get('level'))
+        sample = WifiSample(
+            time=time.time(),
+            signal=signal,
+            noise=wireless.get('noise'),
+            txBitrate=station.get('txBitrate'),
+            rxBitrate=station.get('rxBitrate'),
+            txRetries=station.get('txRetries'),
+            txFailed=station.get('txFailed'),
+            rxBytes=statistics.get('rx_bytes', station.get('rxBytes')),
+            txBytes=statistics.get('tx_bytes', station.get('txBytes')),
+            rxPackets=statistics.get('rx_packets', station.get('rxPackets')),
+            txPackets=statistics.get('tx_packets', station.get('txPackets')),
+            txErrors=statistics.get('tx_errors'),
+            rxErrors=statistics.get('rx_errors'))
+
+        # Same keys "iw" printed, which the status page shows
         localDataMap = {}
-        self.runColonOutputCommand(localDataMap, "iw wlan0 link")
-        self.runColonOutputCommand(localDataMap, "iw wlan0 station dump")
-        self.runColonOutputCommand(localDataMap, "iw dev wlan0 link")
+        if signal is not None:
+            localDataMap['signal'] = "%d dBm" % signal
+        if sample.rxBitrate is not None:
+            localDataMap['rx bitrate'] = "%.1f MBit/s" % sample.rxBitrate
+        if sample.txBitrate is not None:
+            localDataMap['tx bitrate'] = "%.1f MBit/s" % sample.txBitrate
+        if 'freq' in station:
+            localDataMap['freq'] = str(station['freq'])
+        if 'ssid' in station:
+            localDataMap['SSID'] = station['ssid']
+        if sample.rxBytes is not None:
+            localDataMap['RX'] = "%d bytes (%s packets)" % (sample.rxBytes, sample.rxPackets)
+        if sample.txBytes is not None:
+            localDataMap['TX'] = "%d bytes (%s packets)" % (sample.txBytes, sample.txPackets)
+        if 'connectedTime' in station:
+            localDataMap['connected time'] = "%d seconds" % station['connectedTime']
+        if sample.txRetries is not None:
+            localDataMap['tx retries'] = sample.txRetries
+        if sample.txFailed is not None:
+            localDataMap['tx failed'] = sample.txFailed
         #logger.info("dataMap: " + str(localDataMap))
-        self.dataMap = localDataMap
 
-    def runColonOutputCommand(self, dataMap, cmd):
+        self.history = self.history[-(RpiInfo.HISTORY_SIZE - 1):] + (sample,)
+        self.dataMap = localDataMap
+        self.lastUpdate = sample.time
 
-        p = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, universal_newlines=True)
-        cmdOutput = p.stdout.strip()
+    def read_station(self):
+        """
+        Station and interface info from nl80211, empty if not available
+        """
+        try:
+            if self.nl80211 is None:
+                self.nl80211 = Nl80211()
+            station = self.nl80211.get_station(RpiInfo.INTERFACE)
+            if station:
+                station.update(self.nl80211.get_interface(RpiInfo.INTERFACE))
+            self.nl80211Error = None
+            return station
+        except OSError as e:
+            # Only log when the error changes so a missing interface does not flood the log
+            if str(e) != self.nl80211Error:
+                logger.warning("Unable to read nl80211 station info: %s", e)
+                self.nl80211Error = str(e)
+            if self.nl80211 is not None:
+                self.nl80211.close()
+                self.nl80211 = None
+            return {}
 
-        lines = cmdOutput.splitlines()
-        for line in lines:
-            keyValue = line.split(':')
-            if len(keyValue) == 2:
-                dataMap[keyValue[0].strip()] = keyValue[1].strip()
+    def read_proc_wireless(self):
+        """
+        Link quality, signal level and noise from /proc/net/wireless
+        """
+        try:
+            with open("/proc/net/wireless", "rt") as f:
+                lines = f.readlines()
+        except OSError:
+            return {}
+        for line in lines[2:]:
+            name, _, values = line.partition(':')
+            if name.strip() != RpiInfo.INTERFACE:
+                continue
+            fields = values.split()
+            try:
+                return {
+                    'link': float(fields[1].rstrip('.')),
+                    'level': int(float(fields[2].rstrip('.'))),
+                    'noise': int(float(fields[3].rstrip('.')))
+                }
+            except (IndexError, ValueError):
+                return {}
+        return {}
 
-        return dataMap
-        
+    def read_statistics(self):
+        statistics = {}
+        for name in ('rx_bytes', 'tx_bytes', 'rx_packets', 'tx_packets', 'tx_errors', 'rx_errors'):
+            try:
+                with open("/sys/class/net/%s/statistics/%s" % (RpiInfo.INTERFACE, name), "rt") as f:
+                    statistics[name] = int(f.read())
+            except (OSError, ValueError):
+                pass
+        return statistics
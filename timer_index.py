@@ -0,0 +1,368 @@
+#
+# Alexa Timer Display
+#
+# timer_index.py - timer records and the ordered index of them shared by
+#                  the timer sources
+#
+import heapq
+import sys
+import threading
+import time
+
+# Rebuild the heap once it holds this many times more entries than live timers
+COMPACT_FACTOR = 2
+COMPACT_MIN_SIZE = 64
+# update_all() rebuilds the heap with one heapify instead of a push per
+# timer when more than this fraction of the timers changed
+REBUILD_FRACTION = 0.25
+
+# Timer sources
+MQTT = "mqtt"
+BLUETOOTH = "bluetooth"
+
+
+class Timer:
+    """
+    One timer, alert or reminder from a timer source.
+
+    device is the Alexa device (room) the timer was set on, or None if the
+    source does not say, e.g. the Echo paired over Bluetooth.  created is
+    when a TimerIndex first saw the timer.  Records are replaced rather
+    than changed once added to a TimerIndex.  Slotted, and device names
+    interned, to keep thousands of timers small.
+    """
+
+    __slots__ = ("id", "source", "device", "label", "expire", "created", "type")
+
+    def __init__(self, timer_id, source, expire, device = None, label = None, created = None,
+                 timer_type = "TIMER"):
+        self.id = timer_id
+        self.source = source
+        self.device = sys.intern(device) if device else None
+        self.label = label or None
+        self.expire = expire
+        self.created = created
+        self.type = timer_type
+
+    def same(self, other):
+        """
+        True if other has the same expire time and metadata, created aside
+        """
+        return (self.expire == other.expire and self.device == other.device
+                and self.label == other.label and self.type == other.type)
+
+    def to_dict(self):
+        return {"id": self.id, "source": self.source, "device": self.device, "label": self.label,
+                "expireTime": self.expire, "created": self.created, "type": self.type}
+
+    def __repr__(self):
+        return "Timer(%r, %s, device=%r, label=%r, expire=%.3f)" % (
+            self.id, self.source, self.device, self.label, self.expire)
+
+
+class TimerIndex:
+    """
+    Ordered index of Timer records keyed by timer id.
+
+    Timers are ordered by (expire time, timer id), the same order the
+    sources used to get from sorted().  Insert, update and delete are
+    O(log n) using a heap with lazy deletion, the next two timers are
+    cached so peeking them is O(1), and expired timers are only dropped
+    when they reach the top of the heap.  A secondary index by device
+    gives one room's timers in O(k) for k timers in the room.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Map of timer id to (Timer, sequence number)
+        self.entries = {}
+        # Map of device to {timer id: Timer}, timers without a device are not included
+        self.devices = {}
+        # Map of device to its ordered Timers, built on first use after a change
+        self.device_records = {}
+        # Heap of (expire time, timer id, sequence number).  An entry is
+        # stale if its sequence number no longer matches self.entries
+        self.heap = []
+        self.seq = 0
+        self.head = None
+        self.ordered = None
+        self.records = None
+        # Ids of timers added, changed or removed since take_changes()
+        self.changes = set()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, timer_id):
+        return timer_id in self.entries
+
+    def get(self, timer_id, default=None):
+        """
+        Return the Timer with the id
+        """
+        entry = self.entries.get(timer_id)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def set(self, timer):
+        """
+        Add a Timer or replace the one with the same id.  Returns True if
+        the expire time or metadata changed.
+        """
+        with self.lock:
+            if not self._set(timer):
+                return False
+            self._changed()
+            return True
+
+    def remove(self, timer_id):
+        """
+        Remove a timer.  Returns True if the timer was present.
+        """
+        with self.lock:
+            if not self._delete(timer_id):
+                return False
+            self._changed()
+            return True
+
+    def clear(self):
+        with self.lock:
+            self.changes.update(self.entries)
+            self.entries = {}
+            self.devices = {}
+            self.heap = []
+            self._changed()
+
+    def update_all(self, timers):
+        """
+        Replace the contents of the index with a list of Timers.  Returns
+        True if anything changed.
+
+        Most full updates change a timer or two, which are pushed onto the
+        heap in O(log n) each.  Heapifying every entry again would be O(n)
+        per update.  When many timers changed, as with the first list, the
+        heap is rebuilt with a single heapify instead.
+        """
+        timers_map = {timer.id: timer for timer in timers}
+        with self.lock:
+            entries = self.entries
+            removed = [x for x in entries if x not in timers_map]
+            changed = []
+            for timer_id, timer in timers_map.items():
+                entry = entries.get(timer_id)
+                if entry is not None:
+                    # Timer.same() inlined, most timers in a full update have not changed
+                    previous = entry[0]
+                    if (previous.expire == timer.expire and previous.device == timer.device
+                            and previous.label == timer.label and previous.type == timer.type):
+                        continue
+                changed.append(timer)
+            if not removed and not changed:
+                return False
+            for timer_id in removed:
+                self._delete(timer_id)
+            if len(changed) > REBUILD_FRACTION * len(timers_map):
+                self._rebuild(changed)
+            else:
+                for timer in changed:
+                    self._set(timer)
+            self._changed()
+            return True
+
+    def expire(self, expired_before):
+        """
+        Lazily drop timers that expired before the given time.
+        Only the top of the heap is examined.
+        """
+        with self.lock:
+            dropped = False
+            heap = self.heap
+            while heap:
+                expire_time, timer_id, seq = heap[0]
+                entry = self.entries.get(timer_id)
+                if entry is not None and entry[1] == seq:
+                    if expire_time > expired_before:
+                        break
+                    self._delete(timer_id)
+                    dropped = True
+                heapq.heappop(heap)
+            if dropped:
+                self._changed()
+            return dropped
+
+    def peek(self, count=2):
+        """
+        Return up to count of the next timers, at most two, as a list of
+        (timer id, expire time)
+        """
+        head = self.head
+        if head is None:
+            with self.lock:
+                head = self._peek_head()
+        return head[:count]
+
+    def sorted_timers(self):
+        """
+        Return all timers as a list of (timer id, expire time) ordered by expire time.
+        The list is built once per change and shared by every reader.
+        """
+        ordered = self.ordered
+        if ordered is None:
+            with self.lock:
+                ordered = [(timer.id, timer.expire) for timer in self._sorted_records()]
+                self.ordered = ordered
+        return ordered
+
+    def sorted_records(self):
+        """
+        Return all Timers ordered by expire time, built once per change
+        """
+        records = self.records
+        if records is None:
+            with self.lock:
+                records = self._sorted_records()
+        return records
+
+    def device_timers(self, device):
+        """
+        Return the Timers set on a device ordered by expire time.
+        Like sorted_timers() the list is shared until the next change.
+        """
+        records = self.device_records.get(device)
+        if records is None:
+            with self.lock:
+                timers = self.devices.get(device)
+                records = sorted(timers.values(), key=_timer_order) if timers else []
+                self.device_records[device] = records
+        return records
+
+    def take_changes(self):
+        """
+        Return the ids of the timers added, changed or removed since the
+        last call, for keeping views of the index up to date
+        """
+        with self.lock:
+            changes = self.changes
+            self.changes = set()
+        return changes
+
+    def device_names(self):
+        with self.lock:
+            return sorted(self.devices)
+
+    def _sorted_records(self):
+        records = self.records
+        if records is None:
+            records = [entry[0] for entry in self.entries.values()]
+            records.sort(key=_timer_order)
+            self.records = records
+        return records
+
+    def _rebuild(self, changed):
+        """
+        Add or replace many changed Timers, then heapify every entry once
+        """
+        entries = self.entries
+        now = time.time()
+        seq = self.seq
+        for timer in changed:
+            timer_id = timer.id
+            entry = entries.get(timer_id)
+            if entry is not None:
+                previous = entry[0]
+                timer.created = previous.created
+                if previous.device is not None:
+                    self._remove_device(previous)
+            elif timer.created is None:
+                timer.created = now
+            seq += 1
+            entries[timer_id] = (timer, seq)
+            if timer.device is not None:
+                self.devices.setdefault(timer.device, {})[timer_id] = timer
+        self.seq = seq
+        self.changes.update(timer.id for timer in changed)
+        self.heap = [(entry[0].expire, timer_id, entry[1]) for timer_id, entry in entries.items()]
+        heapq.heapify(self.heap)
+
+    def _set(self, timer):
+        timer_id = timer.id
+        entry = self.entries.get(timer_id)
+        if entry is not None:
+            previous = entry[0]
+            if previous.same(timer):
+                return False
+            # Keep when the timer was first seen
+            timer.created = previous.created
+            if previous.device != timer.device:
+                self._remove_device(previous)
+            if previous.expire == timer.expire:
+                # Metadata only, the heap entry is still right
+                self.changes.add(timer_id)
+                self.entries[timer_id] = (timer, entry[1])
+                self._add_device(timer)
+                return True
+        elif timer.created is None:
+            timer.created = time.time()
+        self.changes.add(timer_id)
+        self.seq += 1
+        self.entries[timer_id] = (timer, self.seq)
+        self._add_device(timer)
+        heapq.heappush(self.heap, (timer.expire, timer_id, self.seq))
+        return True
+
+    def _delete(self, timer_id):
+        entry = self.entries.pop(timer_id, None)
+        if entry is None:
+            return False
+        self.changes.add(timer_id)
+        self._remove_device(entry[0])
+        return True
+
+    def _add_device(self, timer):
+        if timer.device is not None:
+            self.devices.setdefault(timer.device, {})[timer.id] = timer
+
+    def _remove_device(self, timer):
+        device = self.devices.get(timer.device)
+        if device is not None:
+            device.pop(timer.id, None)
+            if not device:
+                del self.devices[timer.device]
+
+    def _changed(self):
+        self.head = None
+        self.ordered = None
+        self.records = None
+        self.device_records = {}
+        if len(self.heap) > COMPACT_MIN_SIZE and len(self.heap) > COMPACT_FACTOR * len(self.entries):
+            self.heap = [(entry[0].expire, timer_id, entry[1]) for timer_id, entry in self.entries.items()]
+            heapq.heapify(self.heap)
+
+    def _pop_stale(self):
+        heap = self.heap
+        while heap:
+            expire_time, timer_id, seq = heap[0]
+            entry = self.entries.get(timer_id)
+            if entry is not None and entry[1] == seq:
+                return heap[0]
+            heapq.heappop(heap)
+        return None
+
+    def _peek_head(self):
+        head = []
+        first = self._pop_stale()
+        if first is not None:
+            head.append((first[1], first[0]))
+            # Take the first entry off to find the second, then put it back
+            heapq.heappop(self.heap)
+            second = self._pop_stale()
+            if second is not None:
+                head.append((second[1], second[0]))
+            heapq.heappush(self.heap, first)
+        self.head = head
+        return head
+
+
+def _timer_order(timer):
+    return (timer.expire, timer.id)
@@ -0,0 +1,294 @@
+#
+# Alexa Timer Display
+#
+# timer_reconciler.py - merge the timers reported over MQTT and Bluetooth
+#
+# The same timer on the paired Echo is usually reported by both sources,
+# Bluetooth about a second after MQTT.  The reconciler matches the two by
+# expire time and shows one entry for them.  Whichever source reports a new
+# timer, a change or a cancellation first is taken.  The other source's
+# report is merged when it arrives:
+#
+#   new         a timer from one source matches an unmatched timer from the
+#               other source that expires within TOLERANCE seconds and was
+#               first reported less than MATCH_WINDOW seconds ago
+#   change      an expire time moving more than TOLERANCE seconds is taken
+#               right away; the slower source agreeing later changes nothing
+#   cancel      when one source drops a matched timer, the other source's
+#               copy is hidden until that source drops or changes it too
+#
+# Where several timers expire within TOLERANCE of each other the closest
+# one is matched.  With a room set only that room's MQTT timers take part.
+#
+import bisect
+import logging
+import threading
+import time
+
+import metrics
+from timer_index import BLUETOOTH, MQTT
+
+logger = logging.getLogger(__name__)
+
+# Seconds apart the expire times of the same timer from both sources can be
+TOLERANCE = 2.0
+# Seconds after the first report of a new timer that the other source's
+# report of it is matched
+MATCH_WINDOW = 30.0
+
+SOURCES = (MQTT, BLUETOOTH)
+OTHER = {MQTT: BLUETOOTH, BLUETOOTH: MQTT}
+
+RECONCILE_EVENTS = metrics.counter('alexa_timer_reconcile_total',
+    'Timers matched, changed and cancelled across sources by the source that reported first',
+    ('event', 'first'))
+MATCH_DELAY_SECONDS = metrics.histogram('alexa_timer_match_delay_seconds',
+    'Time from the first source reporting a timer to the other source reporting it',
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+
+
+class ReconciledTimer:
+    """
+    One timer as shown, with the record from each source that reported it.
+    The mqtt and bluetooth attributes are named after the sources.
+    """
+
+    __slots__ = ("id", "expire", "first", "reported", MQTT, BLUETOOTH)
+
+    def __init__(self, timer, reported):
+        self.id = timer.id
+        self.expire = timer.expire
+        self.first = timer.source
+        # time.monotonic() of the first report
+        self.reported = reported
+        self.mqtt = None
+        self.bluetooth = None
+        setattr(self, timer.source, timer)
+
+    def records(self):
+        return [timer for timer in (self.mqtt, self.bluetooth) if timer is not None]
+
+    def to_dict(self):
+        records = self.records()
+        return {
+            "id": self.id,
+            "source": self.first,
+            "sources": [timer.source for timer in records],
+            "device": next((timer.device for timer in records if timer.device), None),
+            "label": next((timer.label for timer in records if timer.label), None),
+            "expireTime": self.expire,
+        }
+
+
+class TimerReconciler:
+    """
+    Keeps the merged list of timers from the timer sources' TimerIndexes.
+    Each reconcile only looks at the timers changed since the last one.
+    wall is the clock expire times are compared with, e.g. ClockOffset.now.
+    """
+
+    def __init__(self, tolerance = TOLERANCE, match_window = MATCH_WINDOW, wall = time.time):
+        self.tolerance = tolerance
+        self.match_window = match_window
+        self.wall = wall
+        self.lock = threading.Lock()
+        # Per source map of timer id to its ReconciledTimer
+        self.matched = {MQTT: {}, BLUETOOTH: {}}
+        # Per source map of timer id to the ReconciledTimers only that source reported
+        self.unmatched = {MQTT: {}, BLUETOOTH: {}}
+        # Per source map of timer id to a Timer already cancelled by the other source
+        self.hidden = {MQTT: {}, BLUETOOTH: {}}
+        # Sorted (expire time, id, first source) of the ReconciledTimers shown
+        self.order = []
+        self.entries = {}
+        # ReconciledTimers in order, built on first use after a change
+        self.ordered = None
+        self.counts = dict(((event, source), 0) for event in ("match", "change", "cancel")
+                           for source in SOURCES)
+        # Sum and count of MQTT minus Bluetooth expire times of matched timers
+        self.offsetSum = 0.0
+        self.offsetCount = 0
+
+    def next_timers(self, count = 2):
+        """
+        Return the next count timers as a list of (id, end time)
+        """
+        with self.lock:
+            return [(key[1], key[0]) for key in self.order[:count]]
+
+    def timers(self):
+        """
+        Return the ReconciledTimers ordered by expire time
+        """
+        with self.lock:
+            if self.ordered is None:
+                self.ordered = [self.entries[key] for key in self.order]
+            return self.ordered
+
+    def reconcile(self, indexes, room = None, now = None):
+        """
+        Apply the changes to a map of source to TimerIndex since the last
+        reconcile.  Only MQTT timers set on room take part if a room is given.
+        now is the time.monotonic() of the changes.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            # Take the changes of both sources before applying either
+            changes = dict((source, index.take_changes()) for source, index in indexes.items())
+            for source in SOURCES:
+                index = indexes.get(source)
+                if index is None:
+                    continue
+                for timer_id in changes[source]:
+                    timer = index.get(timer_id)
+                    if timer is not None and source == MQTT and room is not None and timer.device != room:
+                        timer = None
+                    self._apply(source, timer_id, timer, now)
+
+    def reset(self, source, index):
+        """
+        Clear a source's timers without treating them as cancelled, e.g.
+        when Bluetooth connects or disconnects.  Matched timers stay from the
+        other source, and match the source's timers again when it resends them.
+        """
+        other = OTHER[source]
+        now = time.monotonic()
+        with self.lock:
+            index.clear()
+            index.take_changes()
+            for entry in self.unmatched[source].values():
+                self._remove(entry)
+            for timer_id, entry in self.matched[source].items():
+                if getattr(entry, other) is not None:
+                    setattr(entry, source, None)
+                    self.unmatched[other][getattr(entry, other).id] = entry
+            for entry in self.unmatched[other].values():
+                entry.reported = now
+            self.matched[source] = {}
+            self.unmatched[source] = {}
+            self.hidden[source] = {}
+            self.ordered = None
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+            hidden = sum(len(timers) for timers in self.hidden.values())
+            mqttOnly = len(self.unmatched[MQTT])
+            bluetoothOnly = len(self.unmatched[BLUETOOTH])
+            total = len(self.order)
+            offset = self.offsetSum / self.offsetCount if self.offsetCount else None
+        result = {
+            "timers": total,
+            "matched": total - mqttOnly - bluetoothOnly,
+            "mqttOnly": mqttOnly,
+            "bluetoothOnly": bluetoothOnly,
+            "hidden": hidden,
+            # Mean MQTT minus Bluetooth expire time of matched timers
+            "expireOffset": offset,
+            "matchDelayP50": MATCH_DELAY_SECONDS.percentile(50),
+            "matchDelayP99": MATCH_DELAY_SECONDS.percentile(99),
+        }
+        for (event, source), count in counts.items():
+            result["%s%sFirst" % (event, source.capitalize())] = count
+        return result
+
+    def _apply(self, source, timer_id, timer, now):
+        """
+        Apply the current Timer, or None if it is gone, of a changed timer id
+        """
+        other = OTHER[source]
+        hidden = self.hidden[source].get(timer_id)
+        if hidden is not None:
+            if timer is hidden:
+                return
+            # Dropped at last, or changed and shown again
+            del self.hidden[source][timer_id]
+
+        entry = self.matched[source].get(timer_id)
+        if entry is None:
+            if timer is not None:
+                self._add(source, timer, now)
+            return
+
+        otherTimer = getattr(entry, other)
+        if timer is None:
+            del self.matched[source][timer_id]
+            if otherTimer is None:
+                del self.unmatched[source][timer_id]
+                self._remove(entry)
+                return
+            # Cancelled here first, hide the other source's copy until it catches up
+            del self.matched[other][otherTimer.id]
+            self.hidden[other][otherTimer.id] = otherTimer
+            self._remove(entry)
+            if entry.expire > self.wall():
+                # Not just expired
+                self._count("cancel", source)
+            return
+
+        previous = getattr(entry, source)
+        setattr(entry, source, timer)
+        if timer.expire == previous.expire:
+            return
+        if otherTimer is None:
+            self._move(entry, timer.expire)
+        elif abs(timer.expire - entry.expire) > self.tolerance:
+            # Changed here first, the other source agreeing later changes nothing
+            self._move(entry, timer.expire)
+            self._count("change", source)
+
+    def _add(self, source, timer, now):
+        """
+        Match a timer not seen before, or show it on its own
+        """
+        best = None
+        bestDifference = None
+        reportedAfter = now - self.match_window
+        for entry in self.unmatched[OTHER[source]].values():
+            difference = abs(entry.expire - timer.expire)
+            if (difference <= self.tolerance and entry.reported >= reportedAfter
+                    and (best is None or difference < bestDifference)):
+                best = entry
+                bestDifference = difference
+        if best is None:
+            entry = ReconciledTimer(timer, now)
+            self.matched[source][timer.id] = entry
+            self.unmatched[source][timer.id] = entry
+            self._insert(entry)
+            return
+
+        other = OTHER[source]
+        del self.unmatched[other][getattr(best, other).id]
+        setattr(best, source, timer)
+        self.matched[source][timer.id] = best
+        self.ordered = None
+        self._count("match", best.first)
+        MATCH_DELAY_SECONDS.observe(now - best.reported)
+        self.offsetSum += best.mqtt.expire - best.bluetooth.expire
+        self.offsetCount += 1
+        logger.info("Matched %s timer %s with %s timer %s", source, timer.id, best.first, best.id)
+
+    def _key(self, entry):
+        return (entry.expire, entry.id, entry.first)
+
+    def _insert(self, entry):
+        key = self._key(entry)
+        bisect.insort(self.order, key)
+        self.entries[key] = entry
+        self.ordered = None
+
+    def _remove(self, entry):
+        key = self._key(entry)
+        del self.order[bisect.bisect_left(self.order, key)]
+        del self.entries[key]
+        self.ordered = None
+
+    def _move(self, entry, expire):
+        self._remove(entry)
+        entry.expire = expire
+        self._insert(entry)
+
+    def _count(self, event, first):
+        self.counts[(event, first)] += 1
+        RECONCILE_EVENTS.labels(event, first).inc()
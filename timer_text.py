@@ -0,0 +1,97 @@
+#
+# Alexa Timer Display
+#
+# timer_text.py - fonts, colors and timer text shared by the 64x32 displays
+#                 (DisplayAdafruitHat and DisplayVirtual)
+#
+import time
+
+from bdf_font import REPLACEMENT_CODEPOINT
+
+FONT_PATH = "fonts/ibm-vio-12x30-r-iso10646-1-30-modified.bdf"
+FONT_SMALL_PATH = "fonts/ibm-vio-6x10-r-iso10646-1-10-modified.bdf"
+
+# Glyphs used by format_time_remaining
+TIMER_CODEPOINTS = set([ord(c) for c in " 0123456789:~\uFEFD\uFEFE"] + [REPLACEMENT_CODEPOINT])
+# Timer glyphs and printable ASCII for show_text and scroll_text
+DISPLAY_CODEPOINTS = TIMER_CODEPOINTS | set(range(0x20, 0x7f))
+
+PRIMARY_COLOR = (255, 0, 0)
+SECONDARY_COLOR = (128, 0, 0)
+
+
+def time_until_change(time_remaining, no_flash_colon = False):
+    """
+    Seconds until format_time_remaining() returns different text for this
+    timer, or None if the text will not change (timer at zero)
+    """
+    if time_remaining is None or time_remaining <= 0:
+        return None
+
+    # Wake up just after the boundary so the new value is displayed
+    margin = 0.001
+
+    if time_remaining >= 3600:
+        # Hours mode shows hours and minutes only
+        return (time_remaining % 60) + margin
+    if no_flash_colon:
+        # Below one second the text stays at zero seconds
+        if time_remaining < 1:
+            return None
+        return (time_remaining % 1) + margin
+    # Colon flashes every half second
+    return (time_remaining % 0.5) + margin
+
+
+def format_time_remaining(time_remaining, no_flash_colon = False):
+    """
+    Timer text as drawn on the display.  Uses the font's private glyphs
+    U+FEFD and U+FEFE for the hours and minutes markers, and "~" for the
+    colon in the blink-off half of each second.
+    """
+
+    if time_remaining is None:
+        return ""
+
+    halfSecond = (time_remaining % 1) >= 0.5
+
+    #logger.info("%d seconds left.  halfSecond: %d", time_remaining, halfSecond)
+
+    # Format the timer digits for display
+    gmtime = time.gmtime(time_remaining)
+
+    hours = gmtime.tm_hour
+    minutes = gmtime.tm_min
+    seconds = gmtime.tm_sec
+
+    # Format Hours
+    hoursStr = str(hours)
+    if (hours < 10):
+        hoursStr = " " + hoursStr
+
+    # Format Minutes
+    minutesStr = str(minutes)
+    if (hours == 0 and minutes == 0):
+        minutesStr = "  "
+    else:
+        minutesStr = str(minutes)
+        if (hours > 0 and minutes < 10):
+            minutesStr = minutesStr.zfill(2)
+        elif (minutes < 10):
+            minutesStr = " " + minutesStr
+
+    # Format Seconds
+    secondsStr = str(seconds).zfill(2)
+
+    # Format time seperator
+    if halfSecond or (time_remaining == 0) or no_flash_colon:
+        sperator = ":" 
+    else:
+        sperator = "~"
+
+    if hours > 0:
+        outText = hoursStr + "\uFEFD" + minutesStr + "\uFEFE"
+    else:
+        outText = minutesStr + sperator + secondsStr
+
+    return outText
@@ -21,11 +21,18 @@ import time
 import math
 import netifaces 
 
-import dateutil.parser
 from agt import AlexaGadget
 
+import metrics
+from latency_trace import LatencyTrace
+from timer_index import BLUETOOTH, Timer, TimerIndex
+from timestamp_parser import parse_timestamp
+
 logger = logging.getLogger(__name__)
 
+BLUETOOTH_DIRECTIVE_SECONDS = metrics.histogram('alexa_bluetooth_directive_seconds',
+    'Time spent handling a Bluetooth Alerts directive', ('directive',))
+
 # Alexa Gadget code.  
 # Parent class: https://github.com/alexa/Alexa-Gadgets-Raspberry-Pi-Samples/blob/master/src/agt/alexa_gadget.py
 class TimersFromBluetooth(AlexaGadget):
@@ -39,20 +46,27 @@ class TimersFromBluetooth(AlexaGadget):
     def __init__(self, manage_timers):
         self.manage_timers = manage_timers
 
-        # Dictionary of timers where key is token and value is end time
-        self.timers = {}
-        self.sortedTimers = None
+        # Index of Timer records where the id is the directive token.  The
+        # directives do not name the Echo, so the timers have no device
+        self.timers = TimerIndex()
+        # Runs directive handlers, in the gadget's thread unless the single
+        # event loop runtime hands them to its loop (loop.call_soon_threadsafe)
+        self.run_callback = lambda function, *args: function(*args)
 
         super().__init__("alexa_timer_display.ini")        
 
     def on_connected(self, device_addr):
         logger.info("Bluetooth on_connected called")
+        # The Echo sends its alerts again, match them with the MQTT timers
+        self.manage_timers.reconciler.reset(BLUETOOTH, self.timers)
         #self.display.show_text("Connected")
         #self.display.clear()
 
     def on_disconnected(self, device_addr):
         logger.info("Bluetooth on_disconnect called")
-        self.timers = {}
+        # Not a cancellation, keep showing the timers MQTT also reports
+        self.manage_timers.reconciler.reset(BLUETOOTH, self.timers)
+        self.manage_timers.timer_changed()
         time.sleep(1)
         #self.display.show_text("Disconnected")
 
@@ -60,13 +74,23 @@ class TimersFromBluetooth(AlexaGadget):
         """
         Handles Alerts.SetAlert directive sent from Echo Device
         """
+        self.run_callback(self._on_set_alert, directive, LatencyTrace('bluetooth'))
+
+    def _on_set_alert(self, directive, trace):
+        directiveStart = time.perf_counter()
+        try:
+            self._set_alert(directive, trace)
+        finally:
+            BLUETOOTH_DIRECTIVE_SECONDS.labels('SetAlert').observe(time.perf_counter() - directiveStart)
+
+    def _set_alert(self, directive, trace):
         # check that this is a timer. if it is something else (alarm, reminder), just ignore
         if directive.payload.type != 'TIMER':
             logger.info("Received SetAlert directive but type != TIMER. Ignorning")
             return
 
         # parse the scheduledTime in the directive. if is already expired, ignore
-        t = dateutil.parser.parse(directive.payload.scheduledTime).timestamp()
+        t = parse_timestamp(directive.payload.scheduledTime)
         if t <= 0:
             logger.info("Received SetAlert directive for token %s but scheduledTime has already passed. Ignoring", directive.payload.token)
             return
@@ -78,15 +102,21 @@ class TimersFromBluetooth(AlexaGadget):
         # check if this is an update to an alrady running timer (e.g. users asks alexa to add 30s)
         # if it is, just adjust the end time
 
-        self.timers[directive.payload.token] = t
-        self.sort_timers()
+        # Not every version of the Alerts interface sends a label
+        label = getattr(directive.payload, 'label', None)
+        self.timers.set(Timer(directive.payload.token, BLUETOOTH, t, label=label,
+            timer_type=directive.payload.type))
         logger.info("Calling timer_changed from bluetooth")
-        self.manage_timers.timer_changed()
+        self.manage_timers.timer_changed(trace)
 
     def on_alerts_deletealert(self, directive):
         """
         Handles Alerts.DeleteAlert directive sent from Echo Device
         """
+        self.run_callback(self._on_delete_alert, directive, LatencyTrace('bluetooth'))
+
+    def _on_delete_alert(self, directive, trace):
+        directiveStart = time.perf_counter()
         # # check if this is for the currently running timer. if not, just ignore
         # if self.timer_token_primary != directive.payload.token:
         #     logger.info("Received DeleteAlert directive but not for the currently active timer. Ignoring")
@@ -95,16 +125,13 @@ class TimersFromBluetooth(AlexaGadget):
         # # delete the timer, and stop the currently running timer thread
         # logger.info("Received DeleteAlert directive. Cancelling the timer")
         # self.timer_token_primary = None
-        self.timers.pop(directive.payload.token, None)
-        self.sort_timers()
-        self.manage_timers.timer_changed()
+        self.timers.remove(directive.payload.token)
+        self.manage_timers.timer_changed(trace)
+        BLUETOOTH_DIRECTIVE_SECONDS.labels('DeleteAlert').observe(time.perf_counter() - directiveStart)
     
 
-    def sort_timers(self):
-        self.sortedTimers = sorted(self.timers.items(), key = lambda kv:(kv[1], kv[0]))
-
     def clear_all_timers(self):
-        self.timers = {}
+        self.timers.clear()
 
 if __name__ == '__main__':
 
@@ -21,7 +21,8 @@ import time
 import math
 import netifaces 
 
-import dateutil.parser
+from timer_index import MQTT, Timer, TimerIndex
+from timestamp_parser import parse_timestamp
 
 logger = logging.getLogger(__name__)
 
@@ -32,12 +33,14 @@ class TimersFromMqtt:
     def __init__(self, manage_timers):
         self.manage_timers = manage_timers
         
-        # Dictionary of timers where key is timer id and value is end time
-        self.timers = {}
-        self.sortedTimers = None
+        # Index of Timer records by timer id and device name
+        self.timers = TimerIndex()
+        # Sequence number of the last update applied.  None until a full
+        # update with a sequence number arrives, or after a gap in the deltas
+        self.lastSeq = None
         
 
-    def update_all_timers(self, updatedTimersArray):
+    def update_all_timers(self, updatedTimersArray, seq = None, trace = None):
         """
         Update the timers with an array of Timers.  Array example:
             {
@@ -45,21 +48,71 @@ class TimersFromMqtt:
                 "deviceName": "tv_room",
                 "expireTime": "2020-10-03T12:46:12-0600"
             }, ...
+        "label" and "type" (TIMER, ALARM or REMINDER) are optional.
         """
         #self.lastAllTimersUpdate =  time.time()
-        timersMap = {}
+        timers = []
         for timer in updatedTimersArray: 
-            timerId = timer['id']
-            expireTime = dateutil.parser.parse(timer['expireTime'])   
-            timersMap[timerId] = expireTime.timestamp()
-            logger.info("timer id: %s time: %s", timerId, expireTime)
+            timers.append(self.make_timer(timer))
+            logger.info("timer id: %s time: %s", timer['id'], timer['expireTime'])
 
-        self.timers = timersMap
-        self.sort_timers()
+        self.timers.update_all(timers)
+        self.lastSeq = seq
         logger.info("Calling timer_changed from mqtt")
-        self.manage_timers.timer_changed()
+        self.manage_timers.timer_changed(trace)
 
+    def apply_timer_deltas(self, seq, operations, trace = None):
+        """
+        Apply add/update/remove operations to the timers.  Operations example:
+            { "op": "add", "id": "AB72C64C86AW2-...", "deviceName": "tv_room",
+              "expireTime": "2020-10-03T12:46:12-0600" },
+            { "op": "remove", "id": "AB72C64C86AW2-..." }, ...
+
+        Returns False if seq does not follow the last update, in which case
+        nothing is applied until the next full update of all timers.  If an
+        op is malformed (KeyError, ValueError) none of them are applied.
+        """
+        if self.lastSeq is None or seq > self.lastSeq + 1:
+            logger.warning("Timer delta seq %s does not follow %s, waiting for all timers update",
+                seq, self.lastSeq)
+            self.lastSeq = None
+            return False
+        if seq <= self.lastSeq:
+            logger.info("Ignoring old timer delta seq %s, last seq %s", seq, self.lastSeq)
+            return True
+
+        # Parse every op first so a bad one leaves the timers as they were
+        parsed = []
+        for operation in operations:
+            op = operation['op']
+            timerId = operation['id']
+            if op == 'add' or op == 'update':
+                parsed.append((op, timerId, self.make_timer(operation)))
+            elif op == 'remove':
+                parsed.append((op, timerId, None))
+            else:
+                logger.warning("Unknown timer delta op: %s", op)
 
-    def sort_timers(self):
-        self.sortedTimers = sorted(self.timers.items(), key = lambda kv:(kv[1], kv[0]))
+        changed = False
+        for op, timerId, timer in parsed:
+            if timer is not None:
+                if self.timers.set(timer):
+                    changed = True
+                logger.info("timer %s id: %s time: %s", op, timerId, timer.expire)
+            else:
+                if self.timers.remove(timerId):
+                    changed = True
+                logger.info("timer remove id: %s", timerId)
 
+        self.lastSeq = seq
+        if changed:
+            logger.info("Calling timer_changed from mqtt delta")
+            self.manage_timers.timer_changed(trace)
+        return True
+
+    def make_timer(self, timer):
+        """
+        Timer record from a timer in a message
+        """
+        return Timer(timer['id'], MQTT, parse_timestamp(timer['expireTime']),
+            timer.get('deviceName'), timer.get('label'), timer_type=timer.get('type') or "TIMER")
@@ -0,0 +1,110 @@
+#
+# Alexa Timer Display
+#
+# timestamp_parser.py - fast parser for the ISO-8601 timestamps in timer updates
+#
+# MQTT updates send expireTime as "2020-10-03T12:46:12-0600" and the gadget
+# sends scheduledTime in the same ISO-8601 form.  Those shapes are parsed
+# directly; anything else falls back to dateutil, which is imported only
+# when it is first needed.
+#
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_ISO_8601 = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(\.\d+)?'
+    r'(Z|[+-]\d{2}(?::?\d{2})?)$')
+
+# Memoized timezone offsets in seconds, keyed by the offset text ("-0600", "Z")
+_tz_offsets = {}
+# Memoized start of day in epoch seconds, keyed by (year, month, day)
+_day_starts = {}
+_DAY_CACHE_SIZE = 366
+
+_dateutil_parser = None
+
+
+def parse_timestamp(text):
+    """
+    Parse an ISO-8601 timestamp with a timezone offset and return epoch seconds
+    """
+    match = _ISO_8601.match(text)
+    if match is None:
+        return _parse_fallback(text)
+
+    year, month, day, hour, minute, second, fraction, tz = match.groups()
+
+    offset = _tz_offsets.get(tz)
+    if offset is None:
+        offset = _tz_offset(tz)
+
+    dayKey = (year, month, day)
+    dayStart = _day_starts.get(dayKey)
+    if dayStart is None:
+        dayStart = _day_start(int(year), int(month), int(day))
+        if dayStart is None:
+            return _parse_fallback(text)
+        if len(_day_starts) >= _DAY_CACHE_SIZE:
+            _day_starts.clear()
+        _day_starts[dayKey] = dayStart
+
+    hour = int(hour)
+    minute = int(minute)
+    second = int(second)
+    if hour > 23 or minute > 59 or second > 59:
+        return _parse_fallback(text)
+
+    timestamp = float(dayStart + hour * 3600 + minute * 60 + second - offset)
+    if fraction is not None:
+        timestamp += float(fraction)
+    return timestamp
+
+
+_DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _day_start(year, month, day):
+    """
+    Epoch seconds at midnight UTC of a date, or None if the date is invalid
+    """
+    if not 1 <= month <= 12:
+        return None
+    leap = year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+    if not 1 <= day <= _DAYS_IN_MONTH[month - 1] + (1 if leap and month == 2 else 0):
+        return None
+    # Days from civil date (proleptic Gregorian calendar)
+    if month <= 2:
+        year -= 1
+    era = year // 400
+    yearOfEra = year - era * 400
+    dayOfYear = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    dayOfEra = yearOfEra * 365 + yearOfEra // 4 - yearOfEra // 100 + dayOfYear
+    return (era * 146097 + dayOfEra - 719468) * 86400
+
+
+def _tz_offset(tz):
+    if tz == 'Z':
+        offset = 0
+    else:
+        digits = tz[1:].replace(':', '')
+        offset = int(digits[0:2]) * 3600
+        if len(digits) > 2:
+            offset += int(digits[2:4]) * 60
+        if tz[0] == '-':
+            offset = -offset
+    _tz_offsets[tz] = offset
+    return offset
+
+
+def _parse_fallback(text):
+    """
+    Parse with dateutil for timestamps that are not in the expected form
+    """
+    global _dateutil_parser
+    if _dateutil_parser is None:
+        import dateutil.parser
+        _dateutil_parser = dateutil.parser
+    logger.debug("Timestamp not in ISO-8601 form, using dateutil: %s", text)
+    return _dateutil_parser.parse(text).timestamp()